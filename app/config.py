@@ -2,7 +2,7 @@ import os
 import json
 import logging
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 from google_auth_oauthlib.flow import Flow
 import openai
 
@@ -22,6 +22,60 @@ CACHE_ENABLED = os.getenv('CACHE_ENABLED', 'true').lower() == 'true'
 CACHE_TTL_SHORT = int(os.getenv('CACHE_TTL_SHORT', '300'))    # 5 minuten
 CACHE_TTL_MEDIUM = int(os.getenv('CACHE_TTL_MEDIUM', '3600')) # 1 uur
 CACHE_TTL_LONG = int(os.getenv('CACHE_TTL_LONG', '86400'))    # 1 dag
+CACHE_HARD_TTL_FACTOR = float(os.getenv('CACHE_HARD_TTL_FACTOR', '2'))  # hard TTL = soft TTL x factor (stale-while-revalidate)
+REDIS_MAX_CONNECTIONS = int(os.getenv('REDIS_MAX_CONNECTIONS', '20'))
+REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', '5'))
+CACHE_CODEC = os.getenv('CACHE_CODEC', 'msgpack').lower()                      # msgpack (indien geïnstalleerd) of json
+CACHE_COMPRESS_MIN_BYTES = int(os.getenv('CACHE_COMPRESS_MIN_BYTES', '1024'))  # payloads vanaf deze grootte zlib-comprimeren, 0 = uit
+CACHE_COMPRESS_LEVEL = int(os.getenv('CACHE_COMPRESS_LEVEL', '3'))             # zlib level 1-9
+CACHE_SIZE_METRICS_KEYS = int(os.getenv('CACHE_SIZE_METRICS_KEYS', '1000'))    # keys waarvan de grootte bijgehouden wordt
+CACHE_GZIP_MIN_BYTES = int(os.getenv('CACHE_GZIP_MIN_BYTES', '1024'))         # response bodies vanaf deze grootte gzippen
+HTTP_MAX_AGE_SHORT = int(os.getenv('HTTP_MAX_AGE_SHORT', '0'))                 # Cache-Control max-age per CacheTTL tier (seconden),
+HTTP_MAX_AGE_MEDIUM = int(os.getenv('HTTP_MAX_AGE_MEDIUM', '60'))              # 0 = de client valideert elke keer
+HTTP_MAX_AGE_LONG = int(os.getenv('HTTP_MAX_AGE_LONG', '3600'))                # opnieuw met If-None-Match
+L1_CACHE_SIZE = int(os.getenv('L1_CACHE_SIZE', '512'))                        # in-process entries, 0 = uit
+L1_CACHE_TTL = float(os.getenv('L1_CACHE_TTL', '30'))                         # seconden
+L1_GENERATION_CHECK_INTERVAL = float(os.getenv('L1_GENERATION_CHECK_INTERVAL', '1'))  # seconden
+CACHE_LOCK_ENABLED = os.getenv('CACHE_LOCK_ENABLED', 'true').lower() == 'true'  # single-flight over workers
+CACHE_LOCK_TIMEOUT = float(os.getenv('CACHE_LOCK_TIMEOUT', '10'))             # seconden, max duur van een load
+CACHE_LOCK_WAIT = float(os.getenv('CACHE_LOCK_WAIT', '2'))                    # seconden wachten op andere worker
+
+# Google Calendar sync
+SYNC_PAGE_SIZE = int(os.getenv('SYNC_PAGE_SIZE', '250'))  # events per Google API pagina (max 2500)
+SYNC_UPSERT_CHUNK_SIZE = int(os.getenv('SYNC_UPSERT_CHUNK_SIZE', '500'))  # rijen per upsert request
+SYNC_UPSERT_MAX_RETRIES = int(os.getenv('SYNC_UPSERT_MAX_RETRIES', '2'))  # extra pogingen per chunk
+SYNC_RETRY_BACKOFF = float(os.getenv('SYNC_RETRY_BACKOFF', '0.5'))        # seconden, verdubbelt per poging
+SYNC_CONCURRENCY = int(os.getenv('SYNC_CONCURRENCY', '4'))                # agenda's tegelijk ophalen
+SYNC_CALENDAR_TIMEOUT = float(os.getenv('SYNC_CALENDAR_TIMEOUT', '120'))  # seconden per agenda
+SYNC_WRITE_QUEUE_SIZE = int(os.getenv('SYNC_WRITE_QUEUE_SIZE', '1000'))   # max gebufferde rijen in de schrijf-stage
+
+# Achtergrond sync jobs
+SYNC_JOB_BACKEND = os.getenv('SYNC_JOB_BACKEND', 'memory').lower()      # memory | redis
+SYNC_JOB_HISTORY = int(os.getenv('SYNC_JOB_HISTORY', '50'))             # aantal bewaarde jobs
+SYNC_JOB_TTL = int(os.getenv('SYNC_JOB_TTL', '86400'))                  # seconden (redis backend)
+SYNC_INTERVAL_SECONDS = int(os.getenv('SYNC_INTERVAL_SECONDS', '0'))    # periodieke resync, 0 = uit
+
+# Zoekindex
+SEARCH_INDEX_MAX_AGE = float(os.getenv('SEARCH_INDEX_MAX_AGE', '900'))  # seconden tot een volledige rebuild, 0 = nooit
+
+# In-process event store (leesmodel voor today/upcoming/events/filter)
+EVENT_STORE_ENABLED = os.getenv('EVENT_STORE_ENABLED', 'false').lower() == 'true'
+EVENT_STORE_MAX_AGE = float(os.getenv('EVENT_STORE_MAX_AGE', '300'))  # seconden tot een volledige reload, 0 = nooit
+
+# Statistiek-tellers (/api/stats)
+STATS_AGGREGATES_MAX_AGE = float(os.getenv('STATS_AGGREGATES_MAX_AGE', '300'))  # seconden tot een rebuild van de in-process tellers, 0 = nooit
+
+# Overlappende events tussen agenda's (/api/events/conflicts)
+CONFLICT_INDEX_MAX_AGE = float(os.getenv('CONFLICT_INDEX_MAX_AGE', '900'))  # seconden tot een volledige rebuild, 0 = nooit
+
+# Delta-endpoint (/api/events/changes)
+CHANGES_SAFETY_WINDOW = int(os.getenv('CHANGES_SAFETY_WINDOW', '60'))    # seconden die opnieuw meegestuurd worden (late commits)
+TOMBSTONE_RETENTION_DAYS = int(os.getenv('TOMBSTONE_RETENTION_DAYS', '30'))  # zo lang blijven deletes opvraagbaar
+
+# Push van wijzigingen (/api/events/stream)
+STREAM_QUEUE_SIZE = int(os.getenv('STREAM_QUEUE_SIZE', '100'))          # berichten per client; vol = resync
+STREAM_MAX_CLIENTS = int(os.getenv('STREAM_MAX_CLIENTS', '100'))        # gelijktijdige streams per worker
+STREAM_HEARTBEAT = float(os.getenv('STREAM_HEARTBEAT', '15'))           # seconden tussen keepalives
 
 # CORS Configuration
 CORS_ORIGINS = os.getenv('CORS_ORIGINS', 'http://localhost:3000,http://localhost:5173,https://jeff-agenda-assist.vercel.app').split(',')
@@ -36,8 +90,16 @@ logger.info(f"CACHE_TTL_MEDIUM: {CACHE_TTL_MEDIUM}")
 logger.info(f"CACHE_TTL_LONG: {CACHE_TTL_LONG}")
 logger.info("="*50)
 
+# Database access
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))      # threads voor Supabase queries
+DB_TIMEOUT = float(os.getenv('DB_TIMEOUT', '15'))        # seconden per query
+
 # Maak de Supabase-client
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+supabase: Client = create_client(
+    SUPABASE_URL,
+    SUPABASE_KEY,
+    options=ClientOptions(postgrest_client_timeout=DB_TIMEOUT)
+)
 
 # Google Calendar scopes
 SCOPES = [
@@ -2,18 +2,29 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
-from app.config import logger, supabase, CREDENTIALS_FILE, CORS_ORIGINS
-from app.routers import auth, events, notifications, stats, ai
+from app.config import logger, CREDENTIALS_FILE, CORS_ORIGINS
+from app.routers import auth, events, notifications, stats, ai, sync
 from app.middleware.performance import performance_middleware
+from app.services import supabase_service as db
+from app.services.cache_service import close_redis
+from app.services.change_stream import change_broadcaster
+from app.services.event_store import event_store
+from app.services.sync_jobs import sync_scheduler
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Startup and shutdown events"""
     # Startup
     logger.info("Starting up...")
+    sync_scheduler.start()
+    event_store.start()
     yield
     # Shutdown
     logger.info("Shutting down...")
+    await sync_scheduler.stop()
+    await change_broadcaster.close()
+    await close_redis()
+    db.shutdown()
 
 app = FastAPI(lifespan=lifespan)
 
@@ -24,6 +35,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Cache-Status", "X-Response-Time", "X-Next-Cursor", "ETag"],
 )
 
 app.middleware("http")(performance_middleware)
@@ -38,7 +50,7 @@ async def health():
     """Detailed health check"""
     try:
         # Test Supabase-verbinding
-        supabase_ok = bool(supabase.table('calendar_events').select("*").limit(1).execute())
+        supabase_ok = bool(await db.execute(db.table('calendar_events').select("google_event_id").limit(1)))
 
         return {
             "status": "ok",
@@ -55,3 +67,4 @@ app.include_router(events.router, prefix="/api/events", tags=["events"])
 app.include_router(notifications.router, prefix="/api/notifications", tags=["notifications"])
 app.include_router(stats.router, prefix="/api/stats", tags=["stats"])
 app.include_router(ai.router, prefix="/api/ai", tags=["ai"])
+app.include_router(sync.router, prefix="/api/sync", tags=["sync"])
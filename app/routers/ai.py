@@ -2,10 +2,14 @@ from fastapi import APIRouter, HTTPException
 from typing import List, Optional
 from datetime import datetime, timedelta
 
-from app.config import supabase, logger
+from app.config import logger
+from app.services import supabase_service as db
 from app.schemas import ChatMessage, ChatResponse, AIRequest, AIResponse, AIAnalysis, ErrorResponse
 from app.utils.ai_client import get_openai_client
 
+# Alleen wat de prompts gebruiken; geen attendees of conference_data ophalen
+CONTEXT_COLUMNS = 'summary, start_time, category'
+
 router = APIRouter()
 
 async def get_relevant_events(days: int = 7):
@@ -14,11 +18,11 @@ async def get_relevant_events(days: int = 7):
         now = datetime.now()
         end_date = now + timedelta(days=days)
         
-        result = supabase.table('calendar_events')\
-            .select('*')\
+        query = db.table('calendar_events')\
+            .select(CONTEXT_COLUMNS)\
             .gte('start_time', now.isoformat())\
-            .lte('start_time', end_date.isoformat())\
-            .execute()
+            .lte('start_time', end_date.isoformat())
+        result = await db.execute(query)
             
         return result.data
     except Exception as e:
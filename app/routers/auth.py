@@ -2,14 +2,16 @@ from fastapi import APIRouter, Request
 from fastapi.responses import RedirectResponse
 
 from app.config import flow, logger
-from app.services.calendar_service import sync_calendar
+from app.services.sync_jobs import sync_scheduler
 
 router = APIRouter()
 
 @router.get("/login")
 async def login():
     """Start de OAuth flow"""
-    authorization_url, state = flow.authorization_url()
+    # Offline access (met consent, anders geeft Google alleen de eerste keer een
+    # refresh token): periodieke syncs draaien ook nadat het access token verlopen is
+    authorization_url, state = flow.authorization_url(access_type='offline', prompt='consent')
     return RedirectResponse(authorization_url)
 
 @router.get("/callback")
@@ -18,8 +20,12 @@ async def callback(request: Request):
     try:
         flow.fetch_token(authorization_response=str(request.url))
         credentials = flow.credentials
-        await sync_calendar(credentials)
-        return {"message": "Calendar synchronized successfully"}
+        job = await sync_scheduler.enqueue(credentials, trigger="oauth")
+        return {
+            "message": "Calendar sync started",
+            "job_id": job.id,
+            "status_url": f"/api/sync/jobs/{job.id}"
+        }
     except Exception as e:
         logger.error(f"Error in callback: {str(e)}")
         return {"error": str(e)}, 500
@@ -1,79 +1,148 @@
-from fastapi import APIRouter, HTTPException
-from typing import Optional, List
-from datetime import datetime, timedelta
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import Callable, Optional, List
+from datetime import datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
 import time
-from fastapi.responses import JSONResponse
 
-from app.config import supabase, logger
-from app.schemas import Event, EventUpdate, SearchResult, EventCategory, EventLabel, UpdateLabelsRequest, EventWithLabels
-from app.services.cache_service import get_cached_data, set_cached_data, invalidate_cache, CacheTTL
+from app.config import logger
+from app.services import supabase_service as db
+from app.schemas import Event, EventChanges, EventConflicts, EventUpdate, SearchResult, EventCategory, EventLabel, UpdateLabelsRequest, EventWithLabels
+from app.services.cache_service import (
+    get_cached_data, set_cached_data, invalidate_cache,
+    query_tags, get_cache_stats, get_payload_sizes, CacheTTL
+)
+from app.services.conflict_index import conflict_index
+from app.services.event_changes import EventChange, SNAPSHOT_COLUMNS, publish
+from app.services.change_stream import TooManyClientsError, change_broadcaster, event_stream
+from app.services.event_delta import CursorExpiredError, fetch_changes
+from app.services.event_store import event_store
+from app.services.pagination import (
+    InvalidCursorError, MAX_PAGE_SIZE, decode_cursor, fetch_page, stream_ndjson
+)
+from app.services.response_cache import JsonPayload, cached_json_response
+from app.services.search_index import search_index
+from app.utils.cache_keys import build_cache_key, canonical_labels, canonical_timestamp
+from app.utils.fields import (
+    CHANGES_DEFAULT_FIELDS, EVENT_DEFAULT_FIELDS, FILTER_DEFAULT_FIELDS, InvalidFieldsError,
+    parse_fields, project, select_columns
+)
+from app.utils.time_utils import parse_timestamp
 
 router = APIRouter()
 
+def to_event(row: dict) -> dict:
+    """Zet een calendar_events rij om naar een (JSON-klare) Event"""
+    return Event(**row).model_dump()
+
+def check_cursor(cursor: Optional[str]):
+    """Een ongeldige cursor is een fout van de client (400), geen serverfout"""
+    try:
+        decode_cursor(cursor)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def check_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Onbekende velden zijn een fout van de client (400)"""
+    try:
+        return parse_fields(fields)
+    except InvalidFieldsError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def event_transform(fields: Optional[List[str]]) -> Callable[[dict], dict]:
+    """Zonder fields= een volledige Event, anders alleen de gevraagde velden"""
+    if fields is None:
+        return to_event
+    return lambda row: project(row, fields)
+
+def ndjson_response(build_query, transform, limit: Optional[int], cursor: Optional[str]) -> StreamingResponse:
+    """Stream events als NDJSON (één event per regel), per keyset-pagina gelezen"""
+    return StreamingResponse(stream_ndjson(build_query, transform, limit, cursor), media_type="application/x-ndjson")
+
+async def fetch_events_page(build_query, limit: Optional[int], cursor: Optional[str], **filters):
+    """Eén pagina uit de in-process event store als die geladen is, anders uit Supabase.
+
+    `filters` zijn de argumenten van EventStore.query en moeten hetzelfde
+    selecteren als `build_query`. Alleen voor responses die niet in de gedeelde
+    Redis-cache komen: de store loopt achter op wijzigingen uit andere workers.
+    """
+    if event_store.available():
+        return event_store.page(limit, cursor, **filters)
+    return await fetch_page(build_query, limit, cursor)
+
+async def fetch_snapshot(event_id: str) -> List[dict]:
+    """Huidige versie van een event, zodat listeners ook de oude versie kennen"""
+    query = db.table('calendar_events').select(SNAPSHOT_COLUMNS).eq('google_event_id', event_id)
+    result = await db.execute(query)
+    return result.data
+
 @router.get("/", response_model=List[Event])
 async def get_events(
+    request: Request,
     start_date: Optional[str] = None,
     end_date: Optional[str] = None,
-    calendar_name: Optional[str] = None
+    calendar_name: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    response_format: str = Query("json", alias="format", pattern="^(json|ndjson)$")
 ):
-    """Haal events op uit Supabase met optionele filters"""
+    """Haal events op uit Supabase met optionele filters, paginering en streaming"""
+    check_cursor(cursor)
+    requested = check_fields(fields)
     try:
-        cache_key = f"events:{start_date}:{end_date}:{calendar_name}"
-        
-        # Check cache
-        if cached := await get_cached_data(cache_key):
-            return cached
-            
-        # Database query
-        query = supabase.table('calendar_events').select('*')
-
-        if start_date:
-            query = query.gte('start_time', start_date)
-        if end_date:
-            query = query.lte('end_time', end_date)
-        if calendar_name:
-            query = query.eq('calendar_name', calendar_name)
-
-        query = query.order('start_time', desc=False)
-        result = query.execute()
-
-        events = []
-        for event in result.data:
-            events.append(Event(
-                summary=event['summary'],
-                description=event.get('description', ''),
-                start_time=event['start_time'],
-                end_time=event['end_time'],
-                location=event.get('location', ''),
-                calendar_name=event['calendar_name'],
-                is_recurring=event['is_recurring']
-            ))
-
-        # Cache resultaat (1 uur)
-        await set_cached_data(cache_key, events, CacheTTL.MEDIUM)
-        return events
+        # Gelijkwaardige filters leveren dezelfde query en dus dezelfde cache key op
+        start_date = canonical_timestamp(start_date)
+        end_date = canonical_timestamp(end_date, round_up=True)
+
+        columns = select_columns(requested or EVENT_DEFAULT_FIELDS)
+        transform = event_transform(requested)
+
+        def build_query():
+            query = db.table('calendar_events').select(columns)
+
+            if start_date:
+                query = query.gte('start_time', start_date)
+            if end_date:
+                query = query.lte('end_time', end_date)
+            if calendar_name:
+                query = query.eq('calendar_name', calendar_name)
+            return query
+
+        if response_format == "ndjson":
+            return ndjson_response(build_query, transform, limit, cursor)
+
+        cache_key = build_cache_key(
+            "events", start=start_date, end=end_date, calendar=calendar_name,
+            limit=limit, cursor=cursor, fields=requested
+        )
+
+        async def load_events():
+            # Niet uit de event store: deze body komt in de gedeelde Redis-cache, en de store
+            # van deze worker ziet wijzigingen uit andere workers pas na een reload
+            rows, next_cursor = await fetch_page(build_query, limit, cursor)
+            events = [transform(row) for row in rows]
+            return JsonPayload(events, {"X-Next-Cursor": next_cursor}) if next_cursor else events
+
+        # Cache de response body (1 uur); gelijktijdige missers delen één query
+        tags = query_tags(calendar_name=calendar_name, start_date=start_date, end_date=end_date)
+        return await cached_json_response(request, cache_key, load_events, CacheTTL.MEDIUM, tags)
     except Exception as e:
         logger.error(f"Error fetching events: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/calendars")
-async def get_calendars():
+async def get_calendars(request: Request):
     """Haal lijst van unieke agenda-namen op"""
     try:
-        cache_key = "calendars:list"
-        
-        # Check cache
-        if cached := await get_cached_data(cache_key):
-            return cached
-            
-        # Database query
-        result = supabase.table('calendar_events').select('calendar_name').execute()
-        calendars = {"calendars": list(set(event['calendar_name'] for event in result.data))}
-        
+        cache_key = build_cache_key("calendars")
+
+        async def load_calendars():
+            result = await db.execute(db.table('calendar_events').select('calendar_name'))
+            return {"calendars": list(set(event['calendar_name'] for event in result.data))}
+
         # Cache resultaat (1 dag)
-        await set_cached_data(cache_key, calendars, CacheTTL.LONG)
-        return calendars
+        return await cached_json_response(request, cache_key, load_calendars, CacheTTL.LONG, query_tags())
     except Exception as e:
         logger.error(f"Error fetching calendars: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -82,7 +151,8 @@ async def get_calendars():
 async def delete_event(event_id: str):
     """Verwijder een event uit Supabase"""
     try:
-        supabase.table('calendar_events').delete().eq('google_event_id', event_id).execute()
+        result = await db.execute(db.table('calendar_events').delete().eq('google_event_id', event_id))
+        await publish(EventChange(deleted=result.data))
         return {"message": f"Event {event_id} verwijderd"}
     except Exception as e:
         logger.error(f"Error deleting event: {str(e)}")
@@ -93,90 +163,191 @@ async def update_event(event_id: str, event: EventUpdate):
     """Update een event in Supabase"""
     try:
         update_data = {k: v for k, v in event.dict().items() if v is not None}
-        update_data['updated_at'] = datetime.utcnow().isoformat()
-
-        result = supabase.table('calendar_events')\
-                         .update(update_data)\
-                         .eq('google_event_id', event_id)\
-                         .execute()
+        update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
+        # De rij wijkt nu af van Google: zonder hash schrijft de volgende sync hem weer over
+        update_data['content_hash'] = None
+
+        previous = await fetch_snapshot(event_id)
+        query = db.table('calendar_events')\
+                  .update(update_data)\
+                  .eq('google_event_id', event_id)
+        result = await db.execute(query)
+        await publish(EventChange(upserted=result.data, previous=previous))
         return result.data[0] if result.data else None
     except Exception as e:
         logger.error(f"Error updating event: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/today")
-async def get_today_events():
+async def get_today_events(
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    response_format: str = Query("json", alias="format", pattern="^(json|ndjson)$")
+):
     """Haal events van vandaag op"""
+    check_cursor(cursor)
+    requested = check_fields(fields)
     try:
         amsterdam_tz = ZoneInfo("Europe/Amsterdam")
         now = datetime.now(amsterdam_tz)
         today_start = now.replace(hour=0, minute=0, second=0, microsecond=0)
         today_end = now.replace(hour=23, minute=59, second=59, microsecond=999999)
 
-        result = supabase.table('calendar_events')\
-                         .select('*')\
-                         .gte('start_time', today_start.isoformat())\
-                         .lte('end_time', today_end.isoformat())\
-                         .order('start_time')\
-                         .execute()
+        columns = select_columns(requested or EVENT_DEFAULT_FIELDS)
+        transform = event_transform(requested)
+
+        def build_query():
+            return db.table('calendar_events')\
+                     .select(columns)\
+                     .gte('start_time', today_start.isoformat())\
+                     .lte('end_time', today_end.isoformat())
+
+        if response_format == "ndjson":
+            return ndjson_response(build_query, transform, limit, cursor)
 
-        return [Event(**event) for event in result.data]
+        rows, next_cursor = await fetch_events_page(
+            build_query, limit, cursor, start_min=today_start.isoformat(), end_max=today_end.isoformat()
+        )
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return [transform(row) for row in rows]
     except Exception as e:
         logger.error(f"Error fetching today's events: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.get("/upcoming")
-async def get_upcoming_events(days: int = 7):
+async def get_upcoming_events(
+    response: Response,
+    days: int = 7,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    response_format: str = Query("json", alias="format", pattern="^(json|ndjson)$")
+):
     """Haal events voor de komende X dagen op"""
+    check_cursor(cursor)
+    requested = check_fields(fields)
     try:
         amsterdam_tz = ZoneInfo("Europe/Amsterdam")
         now = datetime.now(amsterdam_tz)
         end_date = now + timedelta(days=days)
 
-        result = supabase.table('calendar_events')\
-                         .select('*')\
-                         .gte('start_time', now.isoformat())\
-                         .lte('start_time', end_date.isoformat())\
-                         .order('start_time')\
-                         .execute()
+        columns = select_columns(requested or EVENT_DEFAULT_FIELDS)
+        transform = event_transform(requested)
+
+        def build_query():
+            return db.table('calendar_events')\
+                     .select(columns)\
+                     .gte('start_time', now.isoformat())\
+                     .lte('start_time', end_date.isoformat())
 
-        return [Event(**event) for event in result.data]
+        if response_format == "ndjson":
+            return ndjson_response(build_query, transform, limit, cursor)
+
+        rows, next_cursor = await fetch_events_page(
+            build_query, limit, cursor, start_min=now.isoformat(), start_max=end_date.isoformat()
+        )
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        return [transform(row) for row in rows]
     except Exception as e:
         logger.error(f"Error fetching upcoming events: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/changes", response_model=EventChanges)
+async def get_event_changes(
+    since: Optional[str] = None,
+    limit: int = Query(500, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None
+):
+    """Events die sinds een cursor (of tijdstip) gewijzigd of verwijderd zijn"""
+    requested = check_fields(fields)
+    try:
+        # Zonder id en tijdstip kan een client een wijziging niet toepassen
+        fields_out = list(dict.fromkeys(['google_event_id', 'updated_at', *requested])) if requested else CHANGES_DEFAULT_FIELDS
+        columns = select_columns(fields_out, required=('updated_at', 'google_event_id'))
+        return await fetch_changes(since, columns, fields_out, limit)
+    except InvalidCursorError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except CursorExpiredError as e:
+        raise HTTPException(status_code=410, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error fetching event changes: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/stream")
+async def stream_changes(request: Request, calendar_name: Optional[List[str]] = Query(None)):
+    """Server-sent events met compacte notificaties van gewijzigde events"""
+    try:
+        subscription = change_broadcaster.subscribe(set(calendar_name) if calendar_name else None)
+    except TooManyClientsError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return StreamingResponse(
+        event_stream(subscription, request.is_disconnected),
+        media_type="text/event-stream",
+        # Geen buffering door proxies (nginx) of caches
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/conflicts", response_model=EventConflicts)
+async def get_conflicts(
+    calendar_name: Optional[List[str]] = Query(None),
+    category: Optional[List[str]] = Query(None),
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    include_all_day: bool = False,
+    limit: int = Query(500, ge=1, le=MAX_PAGE_SIZE)
+):
+    """Overlappende events tussen agenda's, bijvoorbeeld een dienst en een privé-afspraak"""
+    for value in (start_date, end_date):
+        if value and parse_timestamp(value.strip()) is None:
+            raise HTTPException(status_code=400, detail=f"Invalid timestamp: {value}")
+    try:
+        await conflict_index.ensure_built()
+        conflicts = conflict_index.conflicts(
+            calendars=set(calendar_name) if calendar_name else None,
+            start_min=canonical_timestamp(start_date),
+            end_max=canonical_timestamp(end_date, round_up=True),
+            include_all_day=include_all_day
+        )
+        if category:
+            # Alleen paren waarin minstens één event deze category heeft (zoals vroeg/laat)
+            conflicts = [
+                conflict for conflict in conflicts
+                if conflict['first'].get('category') in category or conflict['second'].get('category') in category
+            ]
+        return EventConflicts(conflicts=conflicts[:limit], total_count=len(conflicts), limit=limit)
+    except Exception as e:
+        logger.error(f"Error detecting conflicts: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/search", response_model=SearchResult)
 async def search_events(
     query: str,
     calendar_name: Optional[str] = None,
-    include_description: bool = True
+    include_description: bool = True,
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0)
 ):
-    """Zoek in events op basis van query"""
+    """Zoek in events op basis van query, gerankt op relevantie"""
     try:
-        db_query = supabase.table('calendar_events').select('*')
-        if calendar_name:
-            db_query = db_query.eq('calendar_name', calendar_name)
-
-        result = db_query.execute()
-        events = result.data
-
-        matched_events = []
-        lower_query = query.lower()
-
-        for event in events:
-            if lower_query in event['summary'].lower():
-                matched_events.append(event)
-            elif include_description and event['description'] and lower_query in event['description'].lower():
-                matched_events.append(event)
-            elif event['location'] and lower_query in event['location'].lower():
-                matched_events.append(event)
-
-        event_objects = [Event(**event) for event in matched_events]
+        await search_index.ensure_built()
+        total_count, matched_events = search_index.search(
+            query,
+            limit=limit,
+            offset=offset,
+            calendar_name=calendar_name,
+            include_description=include_description
+        )
 
         return SearchResult(
-            events=event_objects,
-            total_count=len(event_objects),
-            query=query
+            events=[Event(**event) for event in matched_events],
+            total_count=total_count,
+            query=query,
+            limit=limit,
+            offset=offset
         )
     except Exception as e:
         logger.error(f"Error searching events: {str(e)}")
@@ -195,11 +366,15 @@ async def update_event_labels(
             update_data['category'] = update.category
         if update.labels is not None:
             update_data['labels'] = update.labels
+        # /changes vindt gewijzigde events via updated_at
+        update_data['updated_at'] = datetime.now(timezone.utc).isoformat()
 
-        result = supabase.table('calendar_events')\
+        previous = await fetch_snapshot(event_id)
+        query = db.table('calendar_events')\
             .update(update_data)\
-            .eq('google_event_id', event_id)\
-            .execute()
+            .eq('google_event_id', event_id)
+        result = await db.execute(query)
+        await publish(EventChange(upserted=result.data, previous=previous))
 
         return result.data[0] if result.data else None
 
@@ -209,77 +384,64 @@ async def update_event_labels(
 
 @router.get("/filter")
 async def filter_events(
+    request: Request,
     category: Optional[str] = None,
-    labels: Optional[List[str]] = None,
+    labels: Optional[List[str]] = Query(None),
     start_date: Optional[str] = None,
-    end_date: Optional[str] = None
+    end_date: Optional[str] = None,
+    fields: Optional[str] = None
 ):
     """Filter events op category en labels met caching"""
+    requested = check_fields(fields)
     try:
         start_time = time.time()
-        cache_key = f"filter:{category}:{labels}:{start_date}:{end_date}"
+        labels = canonical_labels(labels)
+        start_date = canonical_timestamp(start_date)
+        end_date = canonical_timestamp(end_date, round_up=True)
+        cache_key = build_cache_key(
+            "filter", category=category, labels=labels, start=start_date, end=end_date, fields=requested
+        )
         logger.info(f"Using cache key: {cache_key}")
-        
-        # Headers voor response
-        headers = {"X-Cache-Status": "MISS", "X-Response-Time": "0"}
-        
-        # Check cache eerst
-        cached_data = await get_cached_data(cache_key)
-        logger.info(f"Cache lookup result: {cached_data is not None}")
-        
-        if cached_data:
-            process_time = (time.time() - start_time) * 1000
-            headers.update({
-                "X-Cache-Status": "HIT",
-                "X-Response-Time": f"{process_time:.2f}ms"
-            })
-            return JSONResponse(
-                content=cached_data,
-                headers=headers
-            )
-
-        # Database query (cache miss)
-        query = supabase.table('calendar_events').select('*')
 
-        if category:
-            query = query.eq('category', category)
-        if labels:
-            query = query.contains('labels', labels)
-        if start_date:
-            query = query.gte('start_time', start_date)
-        if end_date:
-            query = query.lte('end_time', end_date)
-
-        result = query.execute()
-        
-        # Convert to dict before caching/returning
-        events = [
-            {
-                "summary": event["summary"],
-                "description": event.get("description", ""),
-                "start_time": event["start_time"],
-                "end_time": event["end_time"],
-                "location": event.get("location", ""),
-                "calendar_name": event["calendar_name"],
-                "is_recurring": event["is_recurring"],
-                "category": event.get("category"),
-                "labels": event.get("labels", [])
-            }
-            for event in result.data
-        ]
-
-        # Cache the result
-        await set_cached_data(cache_key, events)
-        
+        async def load_filtered():
+            columns = select_columns(requested or FILTER_DEFAULT_FIELDS, required=())
+            query = db.table('calendar_events').select(columns)
+
+            if category:
+                query = query.eq('category', category)
+            if labels:
+                query = query.contains('labels', labels)
+            if start_date:
+                query = query.gte('start_time', start_date)
+            if end_date:
+                query = query.lte('end_time', end_date)
+
+            rows = (await db.execute(query)).data
+            if requested:
+                return [project(event, requested) for event in rows]
+
+            # Convert to dict before caching/returning
+            return [
+                {
+                    "summary": event["summary"],
+                    "description": event.get("description", ""),
+                    "start_time": event["start_time"],
+                    "end_time": event["end_time"],
+                    "location": event.get("location", ""),
+                    "calendar_name": event["calendar_name"],
+                    "is_recurring": event["is_recurring"],
+                    "category": event.get("category"),
+                    "labels": event.get("labels", [])
+                }
+                for event in rows
+            ]
+
+        tags = query_tags(start_date=start_date, end_date=end_date, category=category, labels=labels)
+        response = await cached_json_response(request, cache_key, load_filtered, CacheTTL.SHORT, tags)
+
         process_time = (time.time() - start_time) * 1000
-        headers.update({
-            "X-Response-Time": f"{process_time:.2f}ms"
-        })
-        
-        return JSONResponse(
-            content=events,
-            headers=headers
-        )
+        response.headers["X-Response-Time"] = f"{process_time:.2f}ms"
+        return response
 
     except Exception as e:
         logger.error(f"Error filtering events: {str(e)}")
@@ -308,6 +470,16 @@ async def test_cache():
         logger.error(f"Cache test error: {str(e)}")
         return {"error": str(e)}
 
+@router.get("/cache/stats")
+async def cache_stats():
+    """Statistieken van de in-process (L1) cache"""
+    return get_cache_stats()
+
+@router.get("/cache/sizes")
+async def cache_sizes(limit: int = 20, prefix: Optional[str] = None):
+    """Grootte per cache key: encoded payload vs. opgeslagen (gecomprimeerde) bytes"""
+    return get_payload_sizes(limit, prefix)
+
 @router.post("/cache/clear")
 async def clear_cache(pattern: Optional[str] = None):
     """Clear cache entries"""
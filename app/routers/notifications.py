@@ -1,7 +1,8 @@
 from fastapi import APIRouter, HTTPException
 from datetime import datetime
 
-from app.config import supabase, logger
+from app.config import logger
+from app.services import supabase_service as db
 from app.schemas import NotificationSettings
 
 router = APIRouter()
@@ -21,16 +22,16 @@ async def setup_notifications(settings: NotificationSettings):
         }
 
         # Eerst proberen te updaten
-        result = supabase.table('notification_settings')\
+        query = db.table('notification_settings')\
             .update(notification_data)\
-            .eq('email', settings.email)\
-            .execute()
+            .eq('email', settings.email)
+        result = await db.execute(query)
 
         # Als er geen bestaande record is, maak een nieuwe aan
         if not result.data:
-            result = supabase.table('notification_settings')\
-                .insert(notification_data)\
-                .execute()
+            result = await db.execute(
+                db.table('notification_settings').insert(notification_data)
+            )
 
         return {
             "message": "Notification settings saved",
@@ -44,10 +45,10 @@ async def setup_notifications(settings: NotificationSettings):
 async def get_notification_settings(email: str):
     """Haal notificatie-instellingen op"""
     try:
-        result = supabase.table('notification_settings')\
-                         .select('*')\
-                         .eq('email', email)\
-                         .execute()
+        query = db.table('notification_settings')\
+                  .select('*')\
+                  .eq('email', email)
+        result = await db.execute(query)
 
         if not result.data:
             raise HTTPException(status_code=404, detail="No notification settings found")
@@ -1,55 +1,59 @@
-from fastapi import APIRouter, HTTPException
-from datetime import datetime
+from fastapi import APIRouter, HTTPException, Request
+from typing import Optional
 
-from app.config import supabase, logger
+from app.config import logger
 from app.schemas import CalendarStats
+from app.services.analytics import compute_analytics, load_rows
+from app.services.cache_service import CacheTTL, invalidate_cache, query_tags
+from app.services.response_cache import cached_json_response
+from app.services.stats_aggregates import stats_aggregates
+from app.utils.cache_keys import build_cache_key, canonical_timestamp
 
 router = APIRouter()
 
 @router.get("/", response_model=CalendarStats)
-async def get_stats():
-    """Haal statistieken op over alle events"""
+async def get_stats(request: Request):
+    """Haal statistieken op over alle events (incrementeel bijgehouden tellers)"""
     try:
-        result = supabase.table('calendar_events').select('*').execute()
-        events = result.data
-
-        stats = {
-            'total_events': len(events),
-            'events_per_calendar': {},
-            'busy_days': [],
-            'common_locations': []
-        }
-
-        # Events per agenda
-        for event in events:
-            calendar = event['calendar_name']
-            stats['events_per_calendar'][calendar] = stats['events_per_calendar'].get(calendar, 0) + 1
-
-        # Drukste dagen (top 3)
-        day_counts = {}
-        for event in events:
-            if 'T' in event['start_time']:  # Alleen events met tijd
-                day = datetime.fromisoformat(event['start_time']).strftime('%A')
-                day_counts[day] = day_counts.get(day, 0) + 1
-
-        stats['busy_days'] = [
-            {"day": day, "count": count}
-            for day, count in sorted(day_counts.items(), key=lambda x: x[1], reverse=True)[:3]
-        ]
-
-        # Meest voorkomende locaties (top 5)
-        location_counts = {}
-        for event in events:
-            if event.get('location'):
-                location_counts[event['location']] = location_counts.get(event['location'], 0) + 1
-
-        stats['common_locations'] = [
-            {"location": loc, "count": cnt}
-            for loc, cnt in sorted(location_counts.items(), key=lambda x: x[1], reverse=True)[:5]
-        ]
-
-        return CalendarStats(**stats)
+        async def load_stats():
+            return CalendarStats(**await stats_aggregates.get_stats()).model_dump()
 
+        # Elke event-wijziging raakt de statistieken: alleen wildcard-tags
+        return await cached_json_response(request, build_cache_key("stats"), load_stats, CacheTTL.SHORT, query_tags())
     except Exception as e:
         logger.error(f"Error fetching stats: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/rebuild")
+async def rebuild_stats():
+    """Tel de statistieken opnieuw vanuit de database"""
+    try:
+        total_events = await stats_aggregates.rebuild()
+        await invalidate_cache(build_cache_key("stats"))
+        return {"message": "Stats rebuilt", "total_events": total_events}
+    except Exception as e:
+        logger.error(f"Error rebuilding stats: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/analytics")
+async def get_analytics(
+    request: Request,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    calendar_name: Optional[str] = None
+):
+    """Bezetting per weekdag x uur en geboekte minuten per categorie en agenda"""
+    try:
+        start_date = canonical_timestamp(start_date)
+        end_date = canonical_timestamp(end_date, round_up=True)
+        cache_key = build_cache_key("analytics", start=start_date, end=end_date, calendar=calendar_name)
+
+        async def load_analytics():
+            rows = await load_rows(start_date, end_date, calendar_name)
+            return compute_analytics(rows, start_date, end_date)
+
+        tags = query_tags(calendar_name=calendar_name, start_date=start_date, end_date=end_date)
+        return await cached_json_response(request, cache_key, load_analytics, CacheTTL.MEDIUM, tags)
+    except Exception as e:
+        logger.error(f"Error computing analytics: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,36 @@
+from fastapi import APIRouter, HTTPException
+from typing import List
+
+from app.config import logger
+from app.schemas import SyncJob
+from app.services.sync_jobs import sync_scheduler
+
+router = APIRouter()
+
+@router.post("/jobs", response_model=SyncJob, status_code=202)
+async def create_sync_job(full_sync: bool = False):
+    """Start een achtergrond-sync met de laatst bekende Google credentials"""
+    try:
+        return await sync_scheduler.enqueue(full_sync=full_sync)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error enqueueing sync job: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/jobs", response_model=List[SyncJob])
+async def list_sync_jobs(limit: int = 20):
+    """Haal de meest recente sync jobs op"""
+    try:
+        return await sync_scheduler.list_jobs(limit)
+    except Exception as e:
+        logger.error(f"Error listing sync jobs: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/jobs/{job_id}", response_model=SyncJob)
+async def get_sync_job(job_id: str):
+    """Haal status en voortgang van een sync job op"""
+    job = await sync_scheduler.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Sync job {job_id} not found")
+    return job
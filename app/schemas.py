@@ -22,6 +22,26 @@ class SearchResult(BaseModel):
     events: List[Event]
     total_count: int
     query: str
+    limit: Optional[int] = None
+    offset: int = 0
+
+class EventChanges(BaseModel):
+    upserted: List[dict]
+    deleted: List[dict]
+    cursor: str
+    has_more: bool = False
+
+class EventConflict(BaseModel):
+    first: dict
+    second: dict
+    overlap_start: str
+    overlap_end: str
+    overlap_minutes: float
+
+class EventConflicts(BaseModel):
+    conflicts: List[EventConflict]
+    total_count: int
+    limit: Optional[int] = None
 
 class CalendarStats(BaseModel):
     total_events: int
@@ -75,3 +95,24 @@ class AIAnalysis(BaseModel):
 class ErrorResponse(BaseModel):
     detail: str = Field(..., description="Error message")
     status: int = Field(..., description="HTTP status code")
+
+class SyncJobStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+
+class SyncJob(BaseModel):
+    id: str
+    status: SyncJobStatus = SyncJobStatus.QUEUED
+    trigger: str = Field("manual", description="manual, oauth of schedule")
+    full_sync: bool = False
+    created_at: str
+    started_at: Optional[str] = None
+    finished_at: Optional[str] = None
+    calendars_total: int = 0
+    calendars_done: int = 0
+    events_written: int = 0
+    duration_ms: Optional[float] = None
+    error: Optional[str] = None
+    result: Optional[dict] = None
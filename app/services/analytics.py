@@ -0,0 +1,169 @@
+import datetime
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import numpy as np
+
+from app.config import logger
+from app.services import supabase_service as db
+from app.utils.time_utils import parse_utc
+
+ANALYTICS_COLUMNS = 'start_time, end_time, category, calendar_name'
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+HOUR = 3600
+DAY = 24 * HOUR
+WEEK = 7 * DAY
+WEEK_BUCKETS = 7 * 24
+# 1970-01-01 was een donderdag: +3 dagen laat de week op maandag 00:00 beginnen
+WEEK_ALIGN = 3 * DAY
+# Zo levert PostgREST timestamptz; andere notaties gaan via parse_utc
+UTC_SUFFIX = '+00:00'
+
+def to_epoch_seconds(values: Sequence[Optional[str]]) -> Tuple[np.ndarray, np.ndarray]:
+    """Zet tijdstrings om naar epoch-seconden (UTC) plus een masker van geldige waarden.
+
+    UTC-waarden gaan in één keer via datetime64; alleen afwijkende notaties
+    worden los geparsed. Tijden zonder offset gelden als UTC, net als in
+    PostgREST-filters op timestamptz.
+    """
+    epochs = np.zeros(len(values), dtype=np.int64)
+    valid = np.zeros(len(values), dtype=bool)
+    cut = len(UTC_SUFFIX)
+    stripped = [value[:-cut] if value and value.endswith(UTC_SUFFIX) else None for value in values]
+    utc = np.array([value is not None for value in stripped], dtype=bool)
+    if utc.any():
+        try:
+            fast = np.array([value for value in stripped if value is not None], dtype='datetime64[ms]')
+            epochs[utc] = fast.astype(np.int64) // 1000
+            valid[utc] = True
+        except ValueError:
+            utc[:] = False
+
+    for i in np.flatnonzero(~utc):
+        parsed = parse_utc(values[i])
+        if parsed is None:
+            continue
+        epochs[i] = int(parsed.timestamp())
+        valid[i] = True
+    return epochs, valid
+
+def _last_sunday(year: int, month: int) -> datetime.date:
+    last = datetime.date(year, month + 1, 1) - datetime.timedelta(days=1)
+    return last - datetime.timedelta(days=(last.weekday() - 6) % 7)
+
+def _local_offsets(epochs: np.ndarray) -> np.ndarray:
+    """UTC-offset (seconden) van Europe/Amsterdam per tijdstip.
+
+    Zomertijd loopt (EU-regel) van de laatste zondag van maart tot de laatste
+    zondag van oktober, telkens om 01:00 UTC. De overgangen worden per jaar
+    berekend en met searchsorted aan de tijdstippen gekoppeld.
+    """
+    if not len(epochs):
+        return np.zeros(0, dtype=np.int64)
+    first = datetime.datetime.fromtimestamp(int(epochs.min()), datetime.timezone.utc).year
+    last = datetime.datetime.fromtimestamp(int(epochs.max()), datetime.timezone.utc).year
+    transitions = []
+    for year in range(first, last + 1):
+        for month in (3, 10):
+            day = _last_sunday(year, month)
+            moment = datetime.datetime(day.year, day.month, day.day, 1, tzinfo=datetime.timezone.utc)
+            transitions.append(int(moment.timestamp()))
+    # Oneven aantal overgangen ervoor = zomertijd
+    summer = np.searchsorted(np.array(transitions, dtype=np.int64), epochs, side='right') % 2 == 1
+    return np.where(summer, 2 * HOUR, HOUR).astype(np.int64)
+
+def _accumulated(t: np.ndarray) -> np.ndarray:
+    """Som over alle tijdstippen van G_k(t), voor alle 168 buckets k tegelijk"""
+    weeks, rest = np.divmod(t, WEEK)
+    bucket = rest // HOUR
+    counts = np.bincount(bucket, minlength=WEEK_BUCKETS)
+    partial = np.bincount(bucket, weights=rest % HOUR, minlength=WEEK_BUCKETS)
+    # Tijdstippen in een latere bucket dan k tellen een vol uur mee voor k
+    later = counts[::-1].cumsum()[::-1] - counts
+    return float(weeks.sum()) * HOUR + later * HOUR + partial
+
+def weekly_occupancy(starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """Bezette seconden per (weekdag, uur) voor intervallen [start, end) in lokale tijd.
+
+    Voor uur-van-de-week k telt G_k(t) = floor(t / W) * H + clip(t mod W - k * H, 0, H)
+    de seconden in [0, t) die in bucket k vallen; de overlap van een interval
+    met bucket k is G_k(end) - G_k(start). Opgeteld over alle events is dat
+    som G_k(ends) - som G_k(starts), en die sommen volgen per bucket uit twee
+    bincounts. Er is dus geen (events x 168) tussenmatrix nodig.
+    """
+    if not len(starts):
+        return np.zeros((7, 24))
+    starts = starts + WEEK_ALIGN
+    ends = ends + WEEK_ALIGN
+    return (_accumulated(ends) - _accumulated(starts)).reshape(7, 24)
+
+def factorize(labels: Sequence[Optional[str]], empty_label: str) -> Tuple[np.ndarray, List[str]]:
+    """Codes per rij plus de bijbehorende namen (zoals een kleine categorische kolom)"""
+    index: Dict[str, int] = {}
+    codes = np.fromiter(
+        (index.setdefault(label or empty_label, len(index)) for label in labels),
+        dtype=np.int64,
+        count=len(labels)
+    )
+    return codes, list(index)
+
+def minutes_per_group(codes: np.ndarray, names: List[str], seconds: np.ndarray) -> Dict[str, float]:
+    """Opgetelde minuten per label (agenda of categorie)"""
+    totals = np.bincount(codes, weights=seconds, minlength=len(names)) / 60
+    return {name: round(float(total), 1) for name, total in sorted(zip(names, totals)) if total > 0}
+
+async def load_rows(start_date: Optional[str], end_date: Optional[str], calendar_name: Optional[str]) -> List[dict]:
+    """Events die het bereik overlappen, in pagina's opgehaald"""
+    def build_query():
+        query = db.table('calendar_events').select(ANALYTICS_COLUMNS)
+        if start_date:
+            query = query.gt('end_time', start_date)
+        if end_date:
+            query = query.lt('start_time', end_date)
+        if calendar_name:
+            query = query.eq('calendar_name', calendar_name)
+        # google_event_id als tiebreaker: zonder unieke volgorde kan een rij tussen pagina's wegvallen
+        return query.order('start_time').order('google_event_id')
+
+    return await db.fetch_all(build_query)
+
+def compute_analytics(rows: List[dict], start_date: Optional[str] = None, end_date: Optional[str] = None) -> Dict[str, Any]:
+    """Heatmap (weekdag x uur) en geboekte minuten per categorie en agenda"""
+    started = time.perf_counter()
+    starts, starts_valid = to_epoch_seconds([row.get('start_time') for row in rows])
+    ends, ends_valid = to_epoch_seconds([row.get('end_time') for row in rows])
+
+    # Knip intervallen af op het gevraagde bereik
+    range_start = to_epoch_seconds([start_date])[0][0] if start_date else None
+    range_end = to_epoch_seconds([end_date])[0][0] if end_date else None
+    if range_start is not None:
+        starts = np.maximum(starts, range_start)
+    if range_end is not None:
+        ends = np.minimum(ends, range_end)
+
+    keep = starts_valid & ends_valid & (ends > starts)
+    starts, ends = starts[keep], ends[keep]
+    category_codes, category_names = factorize([row.get('category') for row in rows], 'geen')
+    calendar_codes, calendar_names = factorize([row.get('calendar_name') for row in rows], 'onbekend')
+    seconds = (ends - starts).astype(np.float64)
+
+    offsets = _local_offsets(starts)
+    local_starts = starts + offsets
+    # Offset van de start voor beide kanten: de duur blijft gelijk rond een DST-wissel
+    local_ends = ends + offsets
+    heatmap = weekly_occupancy(local_starts, local_ends) / 60
+
+    result = {
+        'range': {'start': start_date, 'end': end_date},
+        'events': int(keep.sum()),
+        'total_minutes': round(float(seconds.sum()) / 60, 1),
+        'heatmap': {
+            'weekdays': WEEKDAYS,
+            'hours': list(range(24)),
+            'minutes': np.round(heatmap, 1).tolist()
+        },
+        'minutes_per_category': minutes_per_group(category_codes[keep], category_names, seconds),
+        'minutes_per_calendar': minutes_per_group(calendar_codes[keep], calendar_names, seconds)
+    }
+    result['compute_ms'] = round((time.perf_counter() - started) * 1000, 2)
+    logger.info(f"Analytics computed for {result['events']} events in {result['compute_ms']}ms")
+    return result
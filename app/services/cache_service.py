@@ -1,9 +1,29 @@
-import redis
-from datetime import timedelta
+import asyncio
+import redis.asyncio as aioredis
+from cachetools import LRUCache, TTLCache
+from datetime import datetime, timedelta
 import json
-from app.config import REDIS_URL, logger, CACHE_TTL_SHORT, CACHE_TTL_MEDIUM, CACHE_TTL_LONG
+import struct
+import time
+import uuid
+import zlib
+from app.config import (
+    REDIS_URL, CACHE_ENABLED, REDIS_MAX_CONNECTIONS, REDIS_SOCKET_TIMEOUT,
+    L1_CACHE_SIZE, L1_CACHE_TTL, L1_GENERATION_CHECK_INTERVAL,
+    CACHE_LOCK_ENABLED, CACHE_LOCK_TIMEOUT, CACHE_LOCK_WAIT, CACHE_HARD_TTL_FACTOR,
+    CACHE_CODEC, CACHE_COMPRESS_MIN_BYTES, CACHE_COMPRESS_LEVEL, CACHE_SIZE_METRICS_KEYS,
+    logger, CACHE_TTL_SHORT, CACHE_TTL_MEDIUM, CACHE_TTL_LONG
+)
 from enum import Enum
-from typing import Optional, Any
+from typing import Optional, Any, Awaitable, Callable, Dict, List, Tuple
+from app.schemas import EventLabel
+from app.services import event_changes
+from app.utils.time_utils import parse_utc
+
+try:
+    import msgpack
+except ImportError:  # optioneel; zonder msgpack valt de cache terug op JSON
+    msgpack = None
 
 # Uitgebreide debug logging
 logger.info("="*50)
@@ -13,83 +33,769 @@ logger.info("="*50)
 
 if not REDIS_URL:
     logger.warning("No REDIS_URL configured, caching disabled")
-    redis_client = None
-else:
-    try:
-        redis_client = redis.from_url(
-            REDIS_URL,
-            decode_responses=True,
-            socket_timeout=5,
-            retry_on_timeout=True
-        )
-        
-        # Test connection
-        ping = redis_client.ping()
-        logger.info(f"Redis connection test: {ping}")
-        
-    except Exception as e:
-        logger.error(f"Redis initialization failed: {str(e)}")
-        redis_client = None
+elif not CACHE_ENABLED:
+    logger.warning("CACHE_ENABLED is false, caching disabled")
+
+# De client wordt pas bij het eerste gebruik aangemaakt (binnen de event loop),
+# zodat importeren geen netwerkverbinding opent.
+_redis_client: Optional[aioredis.Redis] = None
+
+def redis_available() -> bool:
+    """True als Redis geconfigureerd en ingeschakeld is"""
+    return bool(REDIS_URL) and CACHE_ENABLED
+
+def get_redis() -> Optional[aioredis.Redis]:
+    """Geef de gedeelde async Redis client (met connection pool) terug"""
+    global _redis_client
+    if not redis_available():
+        return None
+    if _redis_client is None:
+        try:
+            pool = aioredis.ConnectionPool.from_url(
+                REDIS_URL,
+                max_connections=REDIS_MAX_CONNECTIONS,
+                # Bytes: response bodies worden (gecomprimeerd) als ruwe bytes opgeslagen
+                decode_responses=False,
+                socket_timeout=REDIS_SOCKET_TIMEOUT,
+                socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+                retry_on_timeout=True,
+                health_check_interval=30
+            )
+            _redis_client = aioredis.Redis(connection_pool=pool)
+            logger.info(f"Redis connection pool created (max {REDIS_MAX_CONNECTIONS} connections)")
+        except Exception as e:
+            logger.error(f"Redis initialization failed: {str(e)}")
+            return None
+    return _redis_client
+
+async def close_redis():
+    """Sluit de connection pool bij het afsluiten van de app"""
+    global _redis_client
+    if _redis_client is not None:
+        await _redis_client.aclose()
+        _redis_client = None
 
 class CacheTTL(Enum):
     SHORT = "short"   # 5 min
     MEDIUM = "medium" # 1 uur
     LONG = "long"     # 1 dag
 
+TTL_SECONDS = {
+    CacheTTL.SHORT: CACHE_TTL_SHORT,
+    CacheTTL.MEDIUM: CACHE_TTL_MEDIUM,
+    CacheTTL.LONG: CACHE_TTL_LONG
+}
+
+# Codec-laag. Elke waarde in Redis is een frame: header (versie, codec id,
+# flags, soft expiry) gevolgd door de payload. Lezers kiezen de codec op basis
+# van het id in de frame, dus het schrijfformaat kan wisselen zonder bestaande
+# entries te breken; een frame met een andere versie geldt als misser.
+FRAME_VERSION = 2
+FRAME_HEADER = struct.Struct('!BBBd')
+FLAG_ZLIB = 0x01  # payload is door de frame-laag gecomprimeerd
+FLAG_GZIP = 0x02  # payload is een gzip response body (zie response_cache)
+
+class EntryCodec:
+    """Zet een waarde om naar (flags, payload) en terug.
+
+    Nieuwe codecs krijgen een vast, uniek `id` en worden geregistreerd met
+    register_codec. Met `compressible` comprimeert de frame-laag payloads
+    vanaf CACHE_COMPRESS_MIN_BYTES met zlib.
+    """
+    id = 0
+    name = ''
+    compressible = True
+
+    def encode(self, value: Any) -> Tuple[int, bytes]:
+        raise NotImplementedError
+
+    def decode(self, flags: int, payload: bytes) -> Any:
+        raise NotImplementedError
+
+class JsonCodec(EntryCodec):
+    """De waarde als JSON"""
+    id = 1
+    name = 'json'
+
+    def encode(self, value: Any) -> Tuple[int, bytes]:
+        return 0, json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+    def decode(self, flags: int, payload: bytes) -> Any:
+        return json.loads(payload)
+
+class MsgpackCodec(EntryCodec):
+    """De waarde als msgpack: compacter en sneller dan JSON"""
+    id = 2
+    name = 'msgpack'
+
+    def encode(self, value: Any) -> Tuple[int, bytes]:
+        return 0, msgpack.packb(value, use_bin_type=True)
+
+    def decode(self, flags: int, payload: bytes) -> Any:
+        return msgpack.unpackb(payload, raw=False, strict_map_key=False)
+
+_codecs: Dict[int, EntryCodec] = {}
+
+def register_codec(codec: EntryCodec) -> EntryCodec:
+    """Maak een codec bekend zodat frames met zijn id gelezen kunnen worden"""
+    if codec.id in _codecs and _codecs[codec.id] is not codec:
+        raise ValueError(f"Cache codec id {codec.id} is already registered")
+    _codecs[codec.id] = codec
+    return codec
+
+JSON_CODEC = register_codec(JsonCodec())
+MSGPACK_CODEC = register_codec(MsgpackCodec()) if msgpack is not None else None
+
+if CACHE_CODEC == 'msgpack' and MSGPACK_CODEC is None:
+    logger.warning("CACHE_CODEC=msgpack but msgpack is not installed, using json")
+DEFAULT_CODEC = MSGPACK_CODEC if CACHE_CODEC == 'msgpack' and MSGPACK_CODEC else JSON_CODEC
+
+class PayloadSizes:
+    """Grootte van de laatst geschreven waarde per key (begrensd, LRU)"""
+
+    def __init__(self, maxsize: int):
+        self._keys = LRUCache(maxsize=max(1, maxsize))
+        self.writes = 0
+        self.compressed_writes = 0
+        self.encoded_bytes = 0
+        self.stored_bytes = 0
+
+    def record(self, key: str, codec: str, encoded: int, stored: int, compressed: bool):
+        self.writes += 1
+        self.compressed_writes += int(compressed)
+        self.encoded_bytes += encoded
+        self.stored_bytes += stored
+        self._keys[key] = {
+            'key': key,
+            'codec': codec,
+            'encoded_bytes': encoded,
+            'stored_bytes': stored,
+            'compressed': compressed,
+            'ratio': round(stored / encoded, 3) if encoded else 1.0
+        }
+
+    def largest(self, limit: int = 20, prefix: Optional[str] = None) -> List[Dict[str, Any]]:
+        entries = [entry for key, entry in self._keys.items() if not prefix or key.startswith(prefix)]
+        return sorted(entries, key=lambda entry: entry['stored_bytes'], reverse=True)[:limit]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'codec': DEFAULT_CODEC.name,
+            'writes': self.writes,
+            'compressed_writes': self.compressed_writes,
+            'encoded_bytes': self.encoded_bytes,
+            'stored_bytes': self.stored_bytes,
+            'ratio': round(self.stored_bytes / self.encoded_bytes, 3) if self.encoded_bytes else 1.0
+        }
+
+_payload_sizes = PayloadSizes(CACHE_SIZE_METRICS_KEYS)
+
+def _encode_frame(key: str, value: Any, codec: Optional[EntryCodec] = None, soft_expiry: float = 0.0) -> bytes:
+    codec = codec or DEFAULT_CODEC
+    flags, payload = codec.encode(value)
+    encoded = len(payload)
+    if codec.compressible and 0 < CACHE_COMPRESS_MIN_BYTES <= encoded:
+        compressed = zlib.compress(payload, CACHE_COMPRESS_LEVEL)
+        # Alleen bewaren als het echt kleiner is
+        if len(compressed) < encoded:
+            payload, flags = compressed, flags | FLAG_ZLIB
+    frame = FRAME_HEADER.pack(FRAME_VERSION, codec.id, flags, soft_expiry) + payload
+    _payload_sizes.record(key, codec.name, encoded, len(frame), bool(flags & FLAG_ZLIB))
+    return frame
+
+def _decode_frame(raw: Optional[bytes]) -> Optional[Tuple[float, Any]]:
+    """(soft expiry, waarde) uit een frame, of None bij een leeg of onbekend frame"""
+    if not raw or len(raw) < FRAME_HEADER.size:
+        return None
+    version, codec_id, flags, soft_expiry = FRAME_HEADER.unpack_from(raw)
+    codec = _codecs.get(codec_id)
+    if version != FRAME_VERSION or codec is None:
+        return None
+    payload = raw[FRAME_HEADER.size:]
+    if flags & FLAG_ZLIB:
+        payload = zlib.decompress(payload)
+        flags &= ~FLAG_ZLIB
+    return soft_expiry, codec.decode(flags, payload)
+
+def get_payload_sizes(limit: int = 20, prefix: Optional[str] = None) -> Dict[str, Any]:
+    """Totalen en de grootste recent geschreven keys (encoded vs. opgeslagen bytes)"""
+    return {**_payload_sizes.stats(), 'keys': _payload_sizes.largest(limit, prefix)}
+
+class LocalCache(TTLCache):
+    """In-process L1 cache (TTL + LRU) met hit/miss/eviction statistieken"""
+
+    def __init__(self, maxsize: int, ttl: float):
+        super().__init__(maxsize=maxsize, ttl=ttl)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def popitem(self):
+        # Alleen aangeroepen als de cache vol is (LRU eviction)
+        self.evictions += 1
+        return super().popitem()
+
+    def clear(self):
+        # MutableMapping.clear() gebruikt popitem(); dat is geen eviction
+        evictions = self.evictions
+        super().clear()
+        self.evictions = evictions
+
+    def lookup(self, key: str):
+        value = self.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'size': len(self),
+            'maxsize': self.maxsize,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_rate': round(self.hits / total, 3) if total else 0.0
+        }
+
+# L1 staat voor Redis (L2). Alle workers delen een generatie-teller in Redis;
+# elke invalidatie verhoogt hem en een worker die een nieuwe generatie ziet
+# leegt zijn L1. De teller wordt hooguit eens per
+# L1_GENERATION_CHECK_INTERVAL seconden opgevraagd, zodat hot reads meestal
+# helemaal niet over het netwerk gaan.
+GENERATION_KEY = "cache:generation"
+_local_cache = LocalCache(maxsize=max(1, L1_CACHE_SIZE), ttl=L1_CACHE_TTL)
+_local_generation: Optional[str] = None
+_generation_checked_at = 0.0
+
+def _l1_enabled() -> bool:
+    return L1_CACHE_SIZE > 0 and redis_available()
+
+async def _sync_generation(redis_client: aioredis.Redis):
+    """Leeg L1 als een andere worker intussen de cache geïnvalideerd heeft"""
+    global _local_generation, _generation_checked_at
+    now = time.monotonic()
+    if now - _generation_checked_at < L1_GENERATION_CHECK_INTERVAL:
+        return
+    _generation_checked_at = now
+    try:
+        generation = await redis_client.get(GENERATION_KEY)
+    except Exception as e:
+        logger.error(f"Cache generation check failed: {str(e)}")
+        _local_cache.clear()
+        return
+    generation = generation.decode() if generation else None
+    if generation != _local_generation:
+        if _local_generation is not None:
+            logger.info(f"Cache generation changed to {generation}, clearing L1")
+        _local_cache.clear()
+        _local_generation = generation
+
+async def _bump_generation(redis_client: aioredis.Redis):
+    """Verhoog de generatie zodat alle workers hun L1 legen"""
+    global _local_generation, _generation_checked_at
+    _local_cache.clear()
+    # Loads die al liepen leveren mogelijk oude data: nieuwe aanvragen sluiten er niet meer bij aan
+    _inflight.clear()
+    try:
+        # Een unieke waarde i.p.v. INCR: overleeft ook een verwijderde key zonder te botsen
+        _local_generation = uuid.uuid4().hex
+        await redis_client.set(GENERATION_KEY, _local_generation)
+        _generation_checked_at = time.monotonic()
+    except Exception as e:
+        logger.error(f"Cache generation bump failed: {str(e)}")
+
+def drop_local_entry(key: str):
+    """Haal één key uit L1, zodat de volgende lookup Redis leest"""
+    _local_cache.pop(key, None)
+
+def get_cache_stats() -> Dict[str, Any]:
+    """Statistieken van de L1 cache en de geschreven payloads"""
+    return {
+        'l1_enabled': _l1_enabled(),
+        'generation': _local_generation,
+        **_local_cache.stats(),
+        'payloads': _payload_sizes.stats()
+    }
+
 async def get_cached_data(key: str):
-    """Haal data op uit Redis cache"""
+    """Haal data op uit de L1 cache, anders uit Redis"""
+    redis_client = get_redis()
     if not redis_client:
-        logger.warning("Redis client not initialized")
         return None
         
     try:
-        data = redis_client.get(key)
-        hit = bool(data)
-        logger.info(f"Cache {'HIT' if hit else 'MISS'} for key: {key}")
-        return json.loads(data) if data else None
+        if _l1_enabled():
+            await _sync_generation(redis_client)
+            local = _local_cache.lookup(key)
+            if local is not None:
+                logger.info(f"Cache L1 HIT for key: {key}")
+                return local
+
+        entry = _decode_frame(await redis_client.get(key))
+        logger.info(f"Cache {'HIT' if entry else 'MISS'} for key: {key}")
+        if entry is None:
+            return None
+        value = entry[1]
+        if _l1_enabled():
+            _local_cache[key] = value
+        return value
     except Exception as e:
         logger.error(f"Cache get error: {str(e)}")
         return None
 
-async def set_cached_data(key: str, data: Any, ttl_type: CacheTTL = CacheTTL.SHORT):
+async def set_cached_data(key: str, data: Any, ttl_type: CacheTTL = CacheTTL.SHORT, expire_seconds: Optional[int] = None):
     """Sla data op in Redis cache met verschillende TTLs"""
+    redis_client = get_redis()
     if not redis_client:
-        logger.warning("Redis client not initialized")
         return False
         
     try:
-        json_data = json.dumps(data)
-        
-        # TTL bepalen
-        ttl_mapping = {
-            CacheTTL.SHORT: CACHE_TTL_SHORT,
-            CacheTTL.MEDIUM: CACHE_TTL_MEDIUM,
-            CacheTTL.LONG: CACHE_TTL_LONG
-        }
-        expire_seconds = ttl_mapping.get(ttl_type, CACHE_TTL_SHORT)
+        frame = _encode_frame(key, data)
+        if expire_seconds is None:
+            expire_seconds = TTL_SECONDS.get(ttl_type, CACHE_TTL_SHORT)
         
-        success = redis_client.setex(key, expire_seconds, json_data)
+        success = await redis_client.setex(key, expire_seconds, frame)
+        if _l1_enabled():
+            _local_cache[key] = data
         logger.info(f"Cache set with TTL {ttl_type.value}: {success}")
         return success
     except Exception as e:
         logger.error(f"Cache set error: {str(e)}")
         return False
 
+# Keys die geen cache zijn (job-status, tellers) maar wel in deze Redis DB
+# staan; invalidate_cache laat ze staan. Modules registreren hun prefix zelf.
+_persistent_prefixes: List[bytes] = []
+
+def register_persistent_prefix(prefix: str):
+    """Bescherm keys met dit prefix tegen invalidate_cache"""
+    _persistent_prefixes.append(prefix.encode('utf-8'))
+
+def _is_persistent(key: bytes) -> bool:
+    return any(key.startswith(prefix) for prefix in _persistent_prefixes)
+
 async def invalidate_cache(pattern: str = None):
-    """Verwijder specifieke of alle cache entries"""
+    """Verwijder specifieke of alle cache entries (SCAN, nooit KEYS of FLUSHDB)"""
+    redis_client = get_redis()
     if not redis_client:
         return
         
     try:
-        if pattern:
-            # Verwijder keys die matchen met pattern
-            keys = redis_client.keys(pattern)
-            if keys:
-                redis_client.delete(*keys)
-                logger.info(f"Invalidated {len(keys)} keys matching {pattern}")
+        # Zonder pattern: alle keys, behalve de geregistreerde persistente prefixes
+        removed = 0
+        batch = []
+        async for key in redis_client.scan_iter(match=pattern or '*', count=500):
+            if _is_persistent(key):
+                continue
+            batch.append(key)
+            if len(batch) >= 500:
+                removed += await redis_client.unlink(*batch)
+                batch = []
+        if batch:
+            removed += await redis_client.unlink(*batch)
+        logger.info(f"Invalidated {removed} keys matching {pattern}" if pattern else f"Cleared entire cache ({removed} keys)")
+        await _bump_generation(redis_client)
+        await _new_version_epoch(redis_client)
+    except Exception as e:
+        logger.error(f"Cache invalidation error: {str(e)}")
+
+# Tag-based invalidatie. Elke entry wordt per dimensie getagd met wat hij
+# filtert (cal:<agenda>, month:<YYYY-MM>, cat:<categorie>, label:<label>) of met
+# de wildcard (cal:*) als hij op die dimensie niet filtert. Een gewijzigd event
+# raakt een entry alleen als die op álle dimensies overlapt, dus per event
+# berekent Redis de doorsnede over de dimensies van de unie
+# "tags van het event + wildcard".
+TAG_DIMENSIONS = ('cal', 'month', 'cat', 'label')
+TAG_PREFIX = "tag:"
+ALL_LABELS = tuple(label.value for label in EventLabel)
+MAX_TAG_MONTHS = 24
+
+def _month_buckets(start: Optional[datetime], end: Optional[datetime]) -> Optional[List[str]]:
+    """Maanden die [start, end] raakt, of None als het bereik open of te groot is"""
+    if not start or not end or end < start:
+        return None
+    months = []
+    year, month = start.year, start.month
+    while (year, month) <= (end.year, end.month):
+        months.append(f"{year:04d}-{month:02d}")
+        if len(months) > MAX_TAG_MONTHS:
+            return None
+        month += 1
+        if month > 12:
+            year, month = year + 1, 1
+    return months
+
+def query_tags(
+    calendar_name: Optional[str] = None,
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    category: Optional[str] = None,
+    labels: Optional[List[str]] = None
+) -> List[str]:
+    """Tags voor een cache entry op basis van de query-filters"""
+    tags = [f"cal:{calendar_name}" if calendar_name else "cal:*"]
+
+    # Beide in UTC: een datum zonder offset naast een tijd met offset is anders onvergelijkbaar
+    months = _month_buckets(parse_utc(start_date), parse_utc(end_date))
+    if months:
+        tags.extend(f"month:{month}" for month in months)
+    else:
+        tags.append("month:*")
+
+    tags.append(f"cat:{category}" if category else "cat:*")
+
+    if labels:
+        tags.extend(f"label:{label}" for label in labels)
+    else:
+        tags.append("label:*")
+    return tags
+
+def event_tags(row: dict, labels_known: bool = True) -> Dict[str, List[str]]:
+    """Tags per dimensie die een event-rij raakt, inclusief de wildcard"""
+    start = parse_utc(row.get('start_time'))
+    end = parse_utc(row.get('end_time')) or start
+    # Een dag marge aan beide kanten vangt tijdzoneverschillen rond de maandgrens op
+    months = _month_buckets(start - timedelta(days=1), end + timedelta(days=1)) if start else None
+
+    labels = row.get('labels') if labels_known else None
+    if labels is None:
+        labels = ALL_LABELS
+
+    return {
+        'cal': [f"cal:{row['calendar_name']}"] if row.get('calendar_name') else [],
+        'month': [f"month:{month}" for month in months] if months else [],
+        'cat': [f"cat:{row['category']}"] if row.get('category') else [],
+        'label': [f"label:{label}" for label in labels]
+    }
+
+def _tag_window() -> int:
+    # Eén venster duurt zo lang als de langst levende entry (hard TTL van LONG)
+    return _ttl_pair(CacheTTL.LONG)[1]
+
+def _tag_set_keys(tag: str, now: Optional[float] = None) -> List[str]:
+    """Tag-sets van het huidige en het vorige venster.
+
+    Tag-sets roteren per venster: een key wordt in de set van het huidige
+    venster geregistreerd en leeft nooit langer dan één venster, dus elke
+    levende key staat in een van deze twee sets. Oudere sets verlopen vanzelf;
+    zo groeien ook de wildcard-sets (cal:* enz.) niet met alle keys ooit.
+    """
+    window = int((now or time.time()) // _tag_window())
+    return [f"{TAG_PREFIX}{tag}@{window}", f"{TAG_PREFIX}{tag}@{window - 1}"]
+
+async def _register_tags(redis_client: aioredis.Redis, key: str, tags: List[str]):
+    """Voeg een cache key toe aan zijn tag-sets (van het huidige venster)"""
+    expire_seconds = 2 * _tag_window()
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for tag in tags:
+            tag_set = _tag_set_keys(tag)[0]
+            pipe.sadd(tag_set, key)
+            pipe.expire(tag_set, expire_seconds)
+        await pipe.execute()
+
+async def invalidate_events(rows: List[dict], labels_known: bool = True) -> int:
+    """Invalideer alleen de cache entries die door deze event-rijen geraakt worden.
+
+    Geef zowel de oude als de nieuwe versie van een gewijzigd event mee. Met
+    labels_known=False (bijv. sync, waar de oude labels onbekend zijn) wordt
+    aangenomen dat het event elk label kan hebben.
+    """
+    redis_client = get_redis()
+    if not redis_client or not rows:
+        return 0
+
+    # Dedupliceer: veel events delen agenda, maand, categorie en labels
+    combinations = set()
+    for row in rows:
+        tags = event_tags(row, labels_known)
+        combinations.add(tuple(tuple(tags[dim]) for dim in TAG_DIMENSIONS))
+
+    try:
+        now = time.time()
+        scratch = f"tmp:invalidate:{uuid.uuid4().hex}"
+        tag_sets = set()
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for i, combination in enumerate(combinations):
+                dim_keys = []
+                for dim, tags in zip(TAG_DIMENSIONS, combination):
+                    dim_key = f"{scratch}:{i}:{dim}"
+                    sources = [tag_set for tag in [*tags, f"{dim}:*"] for tag_set in _tag_set_keys(tag, now)]
+                    tag_sets.update(sources)
+                    pipe.sunionstore(dim_key, sources)
+                    dim_keys.append(dim_key)
+                pipe.sinter(dim_keys)
+                pipe.unlink(*dim_keys)
+            results = await pipe.execute()
+
+        # Elke combinatie levert 4x SUNIONSTORE, 1x SINTER en 1x UNLINK op
+        step = len(TAG_DIMENSIONS) + 2
+        keys = set()
+        for i in range(len(combinations)):
+            keys.update(results[i * step + len(TAG_DIMENSIONS)])
+
+        if keys:
+            async with redis_client.pipeline(transaction=False) as pipe:
+                pipe.unlink(*keys)
+                # Ook uit de tag-sets halen waarin ze gevonden zijn, zodat die niet blijven groeien
+                for tag_set in tag_sets:
+                    pipe.srem(tag_set, *keys)
+                await pipe.execute()
+        await _bump_generation(redis_client)
+        logger.info(f"Invalidated {len(keys)} cache entries for {len(rows)} changed events")
+        return len(keys)
+    except Exception as e:
+        logger.error(f"Tag invalidation error: {str(e)}")
+        return 0
+
+# Dataversies voor ETags. ver:<tag> telt de wijzigingen aan data met die tag.
+# Een response hangt af van de versies van zijn concrete tags (zie
+# query_tags): een event dat hem raakt overlapt op elke gefilterde dimensie,
+# dus verhoogt minstens één daarvan. Responses zonder filters hangen af van
+# ver:all, dat bij elke wijziging omhoog gaat. ver:epoch (een uuid) wisselt
+# bij een volledige invalidatie of flush, zodat tellers die opnieuw bij 0
+# beginnen geen oude ETag kunnen opleveren.
+VERSION_PREFIX = "ver:"
+VERSION_EPOCH_KEY = "ver:epoch"
+VERSION_ALL_TAG = "all"
+
+def version_tags(tags: List[str]) -> List[str]:
+    """Tags waarvan de versie van een response afhangt"""
+    concrete = sorted({tag for tag in tags if not tag.endswith(':*')})
+    return concrete or [VERSION_ALL_TAG]
+
+def changed_tags(rows: List[dict], labels_known: bool = True) -> List[str]:
+    """Tags waarvan de versie door deze event-rijen verandert"""
+    tags = {VERSION_ALL_TAG}
+    for row in rows:
+        for dim_tags in event_tags(row, labels_known).values():
+            tags.update(dim_tags)
+    return sorted(tags)
+
+async def _new_version_epoch(redis_client: aioredis.Redis):
+    try:
+        await redis_client.set(VERSION_EPOCH_KEY, uuid.uuid4().hex)
+    except Exception as e:
+        logger.error(f"Data version epoch reset failed: {str(e)}")
+
+async def get_data_version(tags: List[str]) -> Optional[str]:
+    """Huidige versie van de data achter deze tags, of None zonder Redis"""
+    redis_client = get_redis()
+    if not redis_client:
+        return None
+    keys = [VERSION_EPOCH_KEY] + [f"{VERSION_PREFIX}{tag}" for tag in version_tags(tags)]
+    try:
+        values = await redis_client.mget(keys)
+        if values[0] is None:
+            await redis_client.set(VERSION_EPOCH_KEY, uuid.uuid4().hex, nx=True)
+            values = await redis_client.mget(keys)
+        return ':'.join(value.decode() if value else '0' for value in values)
+    except Exception as e:
+        logger.error(f"Data version lookup failed: {str(e)}")
+        return None
+
+async def bump_data_versions(tags: List[str]):
+    """Verhoog de versie van deze tags (zonder TTL: een ETag kan lang meegaan)"""
+    redis_client = get_redis()
+    if not redis_client or not tags:
+        return
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for tag in tags:
+                pipe.incr(f"{VERSION_PREFIX}{tag}")
+            await pipe.execute()
+    except Exception as e:
+        logger.error(f"Data version bump failed: {str(e)}")
+
+async def _invalidate_changed_events(change: event_changes.EventChange):
+    """Listener: invalideer de geraakte cache entries en verhoog hun dataversies"""
+    rows = change.upserted + change.previous + change.deleted
+    await invalidate_events(rows, labels_known=change.labels_known)
+    await bump_data_versions(changed_tags(rows, change.labels_known))
+
+# Als laatste: afgeleide data (zoals de statistieken) is dan al bijgewerkt
+event_changes.subscribe(_invalidate_changed_events, last=True)
+
+# Stale-while-revalidate: entries van get_or_load bevatten hun soft expiry.
+# Tot de soft TTL zijn ze vers; daarna worden ze nog tot de hard TTL (de Redis
+# TTL, CACHE_HARD_TTL_FACTOR x de soft TTL) direct geserveerd terwijl een
+# achtergrond-refresh de waarde vernieuwt.
+def _ttl_pair(ttl_type: CacheTTL) -> Tuple[int, int]:
+    soft = TTL_SECONDS.get(ttl_type, CACHE_TTL_SHORT)
+    return soft, max(soft, int(soft * CACHE_HARD_TTL_FACTOR))
+
+async def _get_entry(key: str) -> Optional[Tuple[float, Any]]:
+    """(soft expiry, waarde) uit L1 of Redis, of None"""
+    redis_client = get_redis()
+    if not redis_client:
+        return None
+
+    try:
+        if _l1_enabled():
+            await _sync_generation(redis_client)
+            local = _local_cache.lookup(key)
+            if local is not None:
+                logger.info(f"Cache L1 HIT for key: {key}")
+                return local
+
+        entry = _decode_frame(await redis_client.get(key))
+        logger.info(f"Cache {'HIT' if entry else 'MISS'} for key: {key}")
+        if entry is None:
+            return None
+        if _l1_enabled():
+            _local_cache[key] = entry
+        return entry
+    except Exception as e:
+        logger.error(f"Cache get error for {key}: {str(e)}")
+        return None
+
+async def _set_entry(key: str, value: Any, codec: Optional[EntryCodec], ttl_type: CacheTTL, tags: Optional[List[str]] = None):
+    redis_client = get_redis()
+    if not redis_client:
+        return False
+
+    soft, hard = _ttl_pair(ttl_type)
+    soft_expiry = time.time() + soft
+    try:
+        frame = _encode_frame(key, value, codec, soft_expiry)
+        await redis_client.setex(key, hard, frame)
+        if _l1_enabled():
+            _local_cache[key] = (soft_expiry, value)
+        logger.info(f"Cache set with TTL {ttl_type.value}: {key} ({len(frame)} bytes)")
+    except Exception as e:
+        logger.error(f"Cache set error for {key}: {str(e)}")
+        return False
+
+    if tags:
+        try:
+            await _register_tags(redis_client, key, tags)
+        except Exception as e:
+            logger.error(f"Cache tag registration error for {key}: {str(e)}")
+    return True
+
+# Single-flight: per key hooguit één loader tegelijk in dit proces
+_inflight: Dict[str, asyncio.Task] = {}
+
+# Resultaat van een achtergrond-refresh die een andere worker laat verversen
+_DEFERRED = object()
+
+async def _wait_for_other_worker(key: str):
+    """Poll de cache terwijl een andere worker de waarde laadt"""
+    deadline = time.monotonic() + CACHE_LOCK_WAIT
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        entry = await _get_entry(key)
+        if entry is not None and entry[0] > time.time():
+            return entry[1]
+    return None
+
+async def _load_and_store(
+    key: str,
+    loader: Callable[[], Awaitable[Any]],
+    ttl_type: CacheTTL,
+    tags: Optional[List[str]] = None,
+    codec: Optional[EntryCodec] = None,
+    background: bool = False
+):
+    redis_client = get_redis()
+    lock = None
+    if redis_client and CACHE_LOCK_ENABLED:
+        # Korte Redis lock zodat ook andere workers niet tegelijk dezelfde query doen
+        try:
+            lock = redis_client.lock(f"lock:{key}", timeout=CACHE_LOCK_TIMEOUT)
+            if not await lock.acquire(blocking=False):
+                lock = None
+                if background:
+                    # Een andere worker ververst deze key al
+                    return _DEFERRED
+                value = await _wait_for_other_worker(key)
+                if value is not None:
+                    return value
+        except Exception as e:
+            logger.error(f"Cache lock error for {key}: {str(e)}")
+            lock = None
+
+    try:
+        generation = await _current_generation(redis_client)
+        value = await loader()
+        if generation is not None and generation != await _current_generation(redis_client):
+            # Tijdens het laden is er geïnvalideerd: de waarde kan van vóór die wijziging zijn
+            logger.info(f"Cache invalidated during load, not storing: {key}")
         else:
-            # Verwijder alle keys
-            redis_client.flushdb()
-            logger.info("Cleared entire cache")
+            await _set_entry(key, value, codec, ttl_type, tags)
+        return value
+    finally:
+        if lock is not None:
+            try:
+                await lock.release()
+            except Exception as e:
+                logger.warning(f"Cache lock release failed for {key}: {str(e)}")
+
+async def _current_generation(redis_client: Optional[aioredis.Redis]) -> Optional[bytes]:
+    """De generatie in Redis (zie _bump_generation), of None als die onbekend is"""
+    if not redis_client:
+        return None
+    try:
+        return await redis_client.get(GENERATION_KEY) or b''
     except Exception as e:
-        logger.error(f"Cache invalidation error: {str(e)}") 
\ No newline at end of file
+        logger.error(f"Cache generation check failed: {str(e)}")
+        return None
+
+def _forget_inflight(key: str, task: asyncio.Task):
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    # Voorkom "exception was never retrieved" als alle wachtenden weg zijn
+    if not task.cancelled() and task.exception():
+        logger.error(f"Cache load failed for {key}: {str(task.exception())}")
+
+def _start_load(
+    key: str,
+    loader: Callable[[], Awaitable[Any]],
+    ttl_type: CacheTTL,
+    tags: Optional[List[str]] = None,
+    codec: Optional[EntryCodec] = None,
+    background: bool = False
+) -> asyncio.Task:
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_load_and_store(key, loader, ttl_type, tags, codec, background))
+        _inflight[key] = task
+        task.add_done_callback(lambda t: _forget_inflight(key, t))
+    else:
+        logger.info(f"Joining in-flight load for key: {key}")
+    return task
+
+async def get_or_load(
+    key: str,
+    loader: Callable[[], Awaitable[Any]],
+    ttl_type: CacheTTL = CacheTTL.SHORT,
+    tags: Optional[List[str]] = None,
+    codec: Optional[EntryCodec] = None
+) -> Tuple[Any, str]:
+    """Haal een waarde uit de cache of laad hem met single-flight semantiek.
+
+    Gelijktijdige missers op dezelfde key wachten op één gedeelde loader in
+    plaats van elk dezelfde query naar Supabase te sturen. Een entry voorbij
+    zijn soft TTL wordt direct geserveerd terwijl hij op de achtergrond
+    ververst wordt. `tags` (zie query_tags) bepalen welke wijzigingen de
+    entry invalideren; `codec` (standaard CACHE_CODEC) hoe de waarde in
+    Redis staat. Geeft
+    (waarde, "HIT" | "STALE" | "MISS") terug.
+    """
+    entry = await _get_entry(key)
+    if entry is not None:
+        soft_expiry, value = entry
+        if soft_expiry > time.time():
+            return value, "HIT"
+        _start_load(key, loader, ttl_type, tags, codec, background=True)
+        return value, "STALE"
+
+    # shield: een afgebroken request annuleert de gedeelde load niet
+    value = await asyncio.shield(_start_load(key, loader, ttl_type, tags, codec))
+    if value is _DEFERRED:
+        # Aangesloten bij een achtergrond-refresh die niets geladen heeft
+        value = await _load_and_store(key, loader, ttl_type, tags, codec)
+    return value, "MISS"
@@ -1,9 +1,15 @@
+import asyncio
 import datetime
+import hashlib
+import json
 from zoneinfo import ZoneInfo
 from datetime import timedelta
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
 
-from app.config import supabase, logger
+from app.config import logger, SYNC_PAGE_SIZE, SYNC_CONCURRENCY, SYNC_CALENDAR_TIMEOUT
+from app.services import supabase_service as db
+from app.services.event_writer import EventBatchWriter, QueuedEventWriter
 from app.utils.time_utils import convert_time
 
 def determine_category(event_data):
@@ -51,127 +57,326 @@ def determine_category(event_data):
         logger.error(f"Error determining category: {e}")
         return None
 
-async def save_event_to_supabase(event):
-    """Save event to Supabase"""
-    try:
-        # Debug de ruwe Google Calendar data
-        logger.info(f"=== Event: {event['summary']} ===")
-        logger.info(f"Raw start: {event.get('start')}")
-        
-        # Check of het een hele dag event is
-        is_all_day = 'date' in event.get('start', {})
-        
-        if is_all_day:
-            # Hele dag event (zoals verjaardagen)
-            start_date = event['start']['date']
-            end_date = event['end']['date']
-            # Zet om naar datetime met Amsterdam timezone
-            start_time = datetime.datetime.strptime(start_date, '%Y-%m-%d')
-            start_time = start_time.replace(hour=0, minute=0, tzinfo=ZoneInfo("Europe/Amsterdam"))
-            start_time_str = start_time.strftime('%Y-%m-%d %H:%M:%S%z')
-        else:
-            # Normaal event met tijd
-            start_time_raw = event['start']['dateTime']
-            # Parse direct als ISO format (bevat al timezone info)
-            start_time = datetime.datetime.fromisoformat(start_time_raw)
-            # Converteer naar Amsterdam
-            start_time = start_time.astimezone(ZoneInfo("Europe/Amsterdam"))
-            start_time_str = start_time.strftime('%Y-%m-%d %H:%M:%S%z')
-            
-        logger.info(f"Final start time: {start_time_str}")
+def compute_content_hash(event_data):
+    """Stabiele hash van een event-rij, zonder updated_at en de hash zelf"""
+    content = {k: v for k, v in event_data.items() if k not in ('updated_at', 'content_hash')}
+    encoded = json.dumps(content, sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(encoded.encode('utf-8')).hexdigest()
+
+def build_event_row(event):
+    """Zet een Google Calendar event om naar een calendar_events rij"""
+    # Debug de ruwe Google Calendar data
+    logger.info(f"=== Event: {event.get('summary')} ===")
+    logger.info(f"Raw start: {event.get('start')}")
+    
+    # Check of het een hele dag event is
+    is_all_day = 'date' in event.get('start', {})
+    
+    if is_all_day:
+        # Hele dag event (zoals verjaardagen)
+        start_date = event['start']['date']
+        end_date = event['end']['date']
+        # Zet om naar datetime met Amsterdam timezone
+        start_time = datetime.datetime.strptime(start_date, '%Y-%m-%d')
+        start_time = start_time.replace(hour=0, minute=0, tzinfo=ZoneInfo("Europe/Amsterdam"))
+        start_time_str = start_time.strftime('%Y-%m-%d %H:%M:%S%z')
+    else:
+        # Normaal event met tijd
+        start_time_raw = event['start']['dateTime']
+        # Parse direct als ISO format (bevat al timezone info)
+        start_time = datetime.datetime.fromisoformat(start_time_raw)
+        # Converteer naar Amsterdam
+        start_time = start_time.astimezone(ZoneInfo("Europe/Amsterdam"))
+        start_time_str = start_time.strftime('%Y-%m-%d %H:%M:%S%z')
         
-        # Zelfde voor end time
-        if is_all_day:
-            end_time = datetime.datetime.strptime(end_date, '%Y-%m-%d')
-            end_time = end_time.replace(hour=23, minute=59, tzinfo=ZoneInfo("Europe/Amsterdam"))
-            end_time_str = end_time.strftime('%Y-%m-%d %H:%M:%S%z')
-        else:
-            end_time_raw = event['end']['dateTime']
-            end_time = datetime.datetime.fromisoformat(end_time_raw)
-            end_time = end_time.astimezone(ZoneInfo("Europe/Amsterdam"))
-            end_time_str = end_time.strftime('%Y-%m-%d %H:%M:%S%z')
-
-        # Bepaal categorie direct met het datetime object
-        category = None
-        if start_time:
-            hour = start_time.hour
-            if start_time.weekday() >= 5:
-                category = "weekend"
-            elif 6 <= hour < 14:
-                category = "vroeg"
-            elif 14 <= hour < 23:
-                category = "laat"
-
-        # Event data
-        event_data = {
-            'google_event_id': event['id'],
-            'summary': event.get('summary', 'Geen titel'),
-            'description': event.get('description', ''),
-            'start_time': start_time_str,
-            'end_time': end_time_str,
-            'location': event.get('location', ''),
-            'status': event.get('status', 'confirmed'),
-            'calendar_id': event.get('organizer', {}).get('email', 'primary'),
-            'calendar_name': event.get('calendar_name', 'Primary'),
-            'recurring_event_id': event.get('recurringEventId', None),
-            'is_recurring': bool(event.get('recurringEventId')),
-            'attendees': event.get('attendees', []),
-            'conference_data': event.get('conferenceData', {}),
-            'color_id': event.get('colorId'),
-            'visibility': event.get('visibility', 'default'),
-            'updated_at': datetime.datetime.now(ZoneInfo("Europe/Amsterdam")).isoformat(),
-            'category': category,
-            'labels': []
-        }
-
-        # Debug logging
-        logger.info(f"Saving event: {event_data['summary']}")
-        logger.info(f"Time: {start_time_str}")
-        logger.info(f"Category: {category}")
-
-        result = supabase.table('calendar_events').upsert(event_data).execute()
-        return result
+    logger.info(f"Final start time: {start_time_str}")
+    
+    # Zelfde voor end time
+    if is_all_day:
+        end_time = datetime.datetime.strptime(end_date, '%Y-%m-%d')
+        end_time = end_time.replace(hour=23, minute=59, tzinfo=ZoneInfo("Europe/Amsterdam"))
+        end_time_str = end_time.strftime('%Y-%m-%d %H:%M:%S%z')
+    else:
+        end_time_raw = event['end']['dateTime']
+        end_time = datetime.datetime.fromisoformat(end_time_raw)
+        end_time = end_time.astimezone(ZoneInfo("Europe/Amsterdam"))
+        end_time_str = end_time.strftime('%Y-%m-%d %H:%M:%S%z')
+
+    # Bepaal categorie direct met het datetime object
+    category = None
+    if start_time:
+        hour = start_time.hour
+        if start_time.weekday() >= 5:
+            category = "weekend"
+        elif 6 <= hour < 14:
+            category = "vroeg"
+        elif 14 <= hour < 23:
+            category = "laat"
+
+    # Event data
+    event_data = {
+        'google_event_id': event['id'],
+        'summary': event.get('summary', 'Geen titel'),
+        'description': event.get('description', ''),
+        'start_time': start_time_str,
+        'end_time': end_time_str,
+        'location': event.get('location', ''),
+        'status': event.get('status', 'confirmed'),
+        'calendar_id': event.get('organizer', {}).get('email', 'primary'),
+        'calendar_name': event.get('calendar_name', 'Primary'),
+        'recurring_event_id': event.get('recurringEventId', None),
+        'is_recurring': bool(event.get('recurringEventId')),
+        'attendees': event.get('attendees', []),
+        'conference_data': event.get('conferenceData', {}),
+        'color_id': event.get('colorId'),
+        'visibility': event.get('visibility', 'default'),
+        'updated_at': datetime.datetime.now(ZoneInfo("Europe/Amsterdam")).isoformat(),
+        'category': category,
+        'labels': []
+    }
+
+    # Vingerafdruk van de Google-inhoud, zodat ongewijzigde events niet opnieuw geschreven worden
+    event_data['content_hash'] = compute_content_hash(event_data)
 
+    # Debug logging
+    logger.info(f"Prepared event: {event_data['summary']}")
+    logger.info(f"Time: {start_time_str}")
+    logger.info(f"Category: {category}")
+
+    return event_data
+
+async def get_sync_token(calendar_id):
+    """Haal de opgeslagen nextSyncToken van een agenda op"""
+    try:
+        query = db.table('calendar_sync_state')\
+            .select('sync_token')\
+            .eq('calendar_id', calendar_id)
+        result = await db.execute(query)
+        return result.data[0]['sync_token'] if result.data else None
     except Exception as e:
-        logger.error(f"Error saving event: {str(e)}")
-        logger.error(f"Event data: {event}")
+        logger.error(f"Error fetching sync token for {calendar_id}: {str(e)}")
         return None
 
-async def sync_calendar(credentials):
-    """Sync calendar events to Supabase"""
-    service = build('calendar', 'v3', credentials=credentials)
+async def store_sync_token(calendar_id, sync_token):
+    """Sla de nextSyncToken van een agenda op voor de volgende incrementele sync"""
+    try:
+        await db.execute(db.table('calendar_sync_state').upsert({
+            'calendar_id': calendar_id,
+            'sync_token': sync_token,
+            'updated_at': datetime.datetime.now(ZoneInfo("Europe/Amsterdam")).isoformat()
+        }))
+    except Exception as e:
+        logger.error(f"Error storing sync token for {calendar_id}: {str(e)}")
+
+async def clear_sync_token(calendar_id):
+    """Verwijder een verlopen sync token zodat de agenda opnieuw volledig gesynct wordt"""
+    try:
+        await db.execute(db.table('calendar_sync_state').delete().eq('calendar_id', calendar_id))
+    except Exception as e:
+        logger.error(f"Error clearing sync token for {calendar_id}: {str(e)}")
+
+def fetch_events(service, calendar_id, sync_token=None, time_min=None, time_max=None, page_token=None):
+    """Haal één pagina events op: delta's met een sync token, anders het volledige tijdvenster.
+
+    Google staat timeMin/timeMax/orderBy niet toe in combinatie met een syncToken,
+    en geeft zonder orderBy een nextSyncToken terug op de laatste pagina.
+    """
+    if sync_token:
+        return service.events().list(
+            calendarId=calendar_id,
+            syncToken=sync_token,
+            pageToken=page_token,
+            maxResults=SYNC_PAGE_SIZE,
+            singleEvents=True
+        ).execute()
+
+    return service.events().list(
+        calendarId=calendar_id,
+        timeMin=time_min,
+        timeMax=time_max,
+        pageToken=page_token,
+        maxResults=SYNC_PAGE_SIZE,
+        singleEvents=True
+    ).execute()
+
+async def iter_event_pages(service, calendar_id, sync_token=None, time_min=None, time_max=None):
+    """Loop als async generator door alle pagina's van een agenda.
+
+    De volgende pagina wordt al in een thread opgehaald terwijl de huidige
+    verwerkt wordt, zodat er nooit meer dan twee pagina's in geheugen zijn.
+    """
+    def fetch(page_token):
+        return asyncio.ensure_future(asyncio.to_thread(
+            fetch_events, service, calendar_id, sync_token, time_min, time_max, page_token
+        ))
+
+    pending = fetch(None)
+    try:
+        while pending is not None:
+            page = await pending
+            next_page_token = page.get('nextPageToken')
+            pending = fetch(next_page_token) if next_page_token else None
+            yield page
+    finally:
+        if pending is not None:
+            pending.cancel()
+
+async def sync_single_calendar(service, calendar_item, time_min, time_max, writer, full_sync=False):
+    """Sync één agenda pagina voor pagina naar de batch writer en geef tellingen terug.
+
+    De nieuwe sync token staat in `result['sync_token']`; die mag pas opgeslagen
+    worden als de writer alle rijen van deze agenda weggeschreven heeft.
+    """
+    calendar_id = calendar_item['id']
+    calendar_name = calendar_item['summary']
+
+    sync_token = None if full_sync else await get_sync_token(calendar_id)
+    result = {
+        'calendar': calendar_name,
+        'mode': 'incremental' if sync_token else 'full',
+        'pages': 0,
+        'events': 0,
+        'saved': 0,
+        'deleted': 0,
+        'skipped': 0
+    }
+
+    logger.info(f"Syncing calendar: {calendar_name} ({result['mode']})")
+
+    async def process_pages(token):
+        next_sync_token = None
+        async for page in iter_event_pages(service, calendar_id, token, time_min, time_max):
+            result['pages'] += 1
+            for event in page.get('items', []):
+                result['events'] += 1
+                if event.get('status') == 'cancelled':
+                    await writer.delete(event['id'], source=calendar_id)
+                    result['deleted'] += 1
+                    continue
+                event['calendar_name'] = calendar_name
+                try:
+                    row = build_event_row(event)
+                except Exception as e:
+                    logger.error(f"Error preparing event {event.get('id')}: {str(e)}")
+                    result['skipped'] += 1
+                    continue
+                await writer.add(row, source=calendar_id)
+                result['saved'] += 1
+            # Google geeft alleen op de laatste pagina een nextSyncToken terug
+            next_sync_token = page.get('nextSyncToken', next_sync_token)
+        return next_sync_token
+
+    try:
+        result['sync_token'] = await process_pages(sync_token)
+    except HttpError as e:
+        if not sync_token or e.resp.status != 410:
+            raise
+        # Sync token verlopen: token weggooien en volledig opnieuw syncen.
+        # Al verwerkte delta's worden daarbij gewoon opnieuw ge-upsert.
+        logger.warning(f"Sync token expired for {calendar_name}, falling back to full sync")
+        await clear_sync_token(calendar_id)
+        result['mode'] = 'full'
+        result['sync_token'] = await process_pages(None)
+
+    logger.info(
+        f"Fetched calendar {calendar_name}: {result['pages']} pages, "
+        f"{result['events']} events ({result['deleted']} deleted)"
+    )
+    return result
+
+def list_calendars(service):
+    """Haal alle agenda's van de gebruiker op (alle pagina's)"""
+    items = []
+    page_token = None
+    while True:
+        calendar_list = service.calendarList().list(pageToken=page_token).execute()
+        items.extend(calendar_list.get('items', []))
+        page_token = calendar_list.get('nextPageToken')
+        if not page_token:
+            return items
+
+async def sync_calendar(credentials, full_sync=False, progress=None):
+    """Sync calendar events to Supabase.
+
+    Standaard incrementeel: per agenda wordt de opgeslagen nextSyncToken gebruikt
+    zodat Google alleen wijzigingen teruggeeft. Geannuleerde events worden
+    verwijderd. Zonder token (of bij een verlopen token, HTTP 410) volgt een
+    volledige sync van het 30-dagen venster.
+
+    Agenda's worden gelijktijdig opgehaald (maximaal SYNC_CONCURRENCY tegelijk,
+    elk met een timeout van SYNC_CALENDAR_TIMEOUT seconden). Alle rijen gaan via
+    één gedeelde schrijf-stage die ze per chunk upsert.
+
+    `progress` is een optionele async callback die met keyword-argumenten
+    (calendars_total, calendars_done, events_written) aangeroepen wordt.
+    """
+    service = build('calendar', 'v3', credentials=credentials, cache_discovery=False)
 
     # Eerst halen we alle agenda's op
-    calendar_list = service.calendarList().list().execute()
+    calendar_items = await asyncio.to_thread(list_calendars, service)
+    if progress:
+        await progress(calendars_total=len(calendar_items))
 
     # Gebruik Amsterdam tijdzone
     amsterdam_tz = ZoneInfo("Europe/Amsterdam")
     now = datetime.datetime.now(amsterdam_tz)
     end_date = now + datetime.timedelta(days=30)
 
-    # Loop door alle agenda's
-    for calendar_item in calendar_list['items']:
-        calendar_id = calendar_item['id']
-        calendar_name = calendar_item['summary']
+    writer = EventBatchWriter()
+    write_stage = QueuedEventWriter(writer)
+    write_stage.start()
+    semaphore = asyncio.Semaphore(max(1, SYNC_CONCURRENCY))
+    calendars_done = 0
 
-        logger.info(f"Syncing calendar: {calendar_name}")
+    async def sync_with_progress(calendar_item):
+        nonlocal calendars_done
+        result = await sync_with_limit(calendar_item)
+        calendars_done += 1
+        if progress:
+            await progress(
+                calendars_done=calendars_done,
+                events_written=writer.summary()['rows_written']
+            )
+        return result
 
-        try:
-            events_result = service.events().list(
-                calendarId=calendar_id,
-                timeMin=now.isoformat(),
-                timeMax=end_date.isoformat(),
-                maxResults=100,
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
+    async def sync_with_limit(calendar_item):
+        async with semaphore:
+            try:
+                # httplib2 is niet thread-safe: elke agenda krijgt een eigen service
+                calendar_service = await asyncio.to_thread(
+                    build, 'calendar', 'v3', credentials=credentials, cache_discovery=False
+                )
+                return await asyncio.wait_for(
+                    sync_single_calendar(
+                        calendar_service, calendar_item, now.isoformat(), end_date.isoformat(),
+                        write_stage, full_sync
+                    ),
+                    timeout=SYNC_CALENDAR_TIMEOUT
+                )
+            except asyncio.TimeoutError:
+                logger.error(f"Timeout syncing calendar {calendar_item['summary']} after {SYNC_CALENDAR_TIMEOUT}s")
+                return {'calendar': calendar_item['summary'], 'error': 'timeout'}
+            except Exception as e:
+                logger.error(f"Error syncing calendar {calendar_item['summary']}: {str(e)}")
+                return {'calendar': calendar_item['summary'], 'error': str(e)}
 
-            events = events_result.get('items', [])
+    try:
+        results = await asyncio.gather(*(sync_with_progress(item) for item in calendar_items))
+    finally:
+        await write_stage.close()
 
-            for event in events:
-                event['calendar_name'] = calendar_name
-                await save_event_to_supabase(event)
+    # Alleen tokens opslaan van agenda's waarvan alles weggeschreven is,
+    # anders zouden mislukte wijzigingen bij de volgende delta ontbreken
+    failed = writer.failed_sources()
+    for calendar_item, result in zip(calendar_items, results):
+        sync_token = result.pop('sync_token', None)
+        if sync_token and 'error' not in result and calendar_item['id'] not in failed:
+            await store_sync_token(calendar_item['id'], sync_token)
 
-        except Exception as e:
-            logger.error(f"Error syncing calendar {calendar_name}: {str(e)}")
-            continue
+    return {
+        'calendars': results,
+        'total_pages': sum(r.get('pages', 0) for r in results),
+        'total_events': sum(r.get('events', 0) for r in results),
+        'writes': writer.summary(),
+        'chunks': writer.chunks
+    }
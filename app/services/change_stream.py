@@ -0,0 +1,178 @@
+import asyncio
+import json
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+
+from app.config import logger, STREAM_QUEUE_SIZE, STREAM_MAX_CLIENTS, STREAM_HEARTBEAT
+from app.services import event_changes
+from app.services.cache_service import get_redis, redis_available
+
+# Redis pub/sub kanaal waarmee workers elkaars wijzigingen doorgeven
+CHANNEL = "events:changes"
+# Na een overgelopen queue of een gemiste Redis-verbinding: haal de stand opnieuw op
+RESYNC = {'type': 'resync'}
+RECONNECT_DELAY = 5
+
+class TooManyClientsError(Exception):
+    """Het maximum aantal gelijktijdige streams (STREAM_MAX_CLIENTS) is bereikt"""
+
+def compact_change(change: event_changes.EventChange) -> List[dict]:
+    """Compacte notificatie per event: id, agenda, tijden en soort wijziging"""
+    previous = {row.get('google_event_id'): row.get('calendar_name') for row in change.previous}
+    items = []
+    for row in change.upserted:
+        item = {
+            'op': 'upsert',
+            'id': row.get('google_event_id'),
+            'calendar': row.get('calendar_name'),
+            'start_time': row.get('start_time'),
+            'end_time': row.get('end_time')
+        }
+        if previous.get(item['id']) and previous[item['id']] != item['calendar']:
+            item['moved_from'] = previous[item['id']]
+        items.append(item)
+    for row in change.deleted:
+        items.append({'op': 'delete', 'id': row.get('google_event_id'), 'calendar': row.get('calendar_name')})
+    return items
+
+class Subscription:
+    """Eén verbonden client: een agendafilter en een begrensde queue"""
+
+    def __init__(self, calendars: Optional[Set[str]], queue_size: int = STREAM_QUEUE_SIZE):
+        self.calendars = calendars
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_size))
+        self.overflows = 0
+
+    def message_for(self, items: List[dict]) -> Optional[Dict[str, Any]]:
+        """De wijzigingen die deze client wil zien, of None"""
+        upserted, deleted = [], []
+        for item in items:
+            visible = self.calendars is None or item['calendar'] in self.calendars
+            if item['op'] == 'delete':
+                if visible:
+                    deleted.append({'id': item['id'], 'calendar': item['calendar']})
+            elif visible:
+                upserted.append({name: value for name, value in item.items() if name != 'op'})
+            elif item.get('moved_from') in self.calendars:
+                # Naar een agenda buiten het filter verplaatst: voor deze client verdwenen
+                deleted.append({'id': item['id'], 'calendar': item['moved_from']})
+        if not upserted and not deleted:
+            return None
+        return {'type': 'change', 'upserted': upserted, 'deleted': deleted}
+
+    def offer(self, message: Dict[str, Any]):
+        """Zet een bericht klaar zonder te wachten; een trage client krijgt een resync"""
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            # De achterstand weggooien: de client haalt de stand zelf opnieuw op
+            self.overflows += 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+class ChangeBroadcaster:
+    """Verdeelt event-wijzigingen over verbonden clients (server-sent events).
+
+    Met Redis gaat elke wijziging via pub/sub, zodat clients van alle workers
+    hem krijgen; zonder Redis alleen naar de clients van dit proces. Elke
+    client heeft een begrensde queue: loopt die vol, dan wordt de achterstand
+    vervangen door één resync-bericht in plaats van verder te bufferen.
+    """
+
+    def __init__(self, max_clients: int = STREAM_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self._subscriptions: Set[Subscription] = set()
+        self._reader: Optional[asyncio.Task] = None
+
+    def subscribe(self, calendars: Optional[Set[str]] = None) -> Subscription:
+        if len(self._subscriptions) >= self.max_clients:
+            raise TooManyClientsError(f"Too many stream clients (max {self.max_clients})")
+        subscription = Subscription(calendars)
+        self._subscriptions.add(subscription)
+        if self._reader is None and redis_available():
+            # Lazy: pas binnen de event loop en alleen als er clients zijn
+            self._reader = asyncio.create_task(self._read_redis())
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        self._subscriptions.discard(subscription)
+
+    def dispatch(self, items: List[dict]):
+        for subscription in list(self._subscriptions):
+            message = subscription.message_for(items)
+            if message:
+                subscription.offer(message)
+
+    async def on_change(self, change: event_changes.EventChange):
+        """Listener voor event_changes"""
+        items = compact_change(change)
+        if not items:
+            return
+        redis_client = get_redis()
+        if redis_client:
+            try:
+                # Ook de eigen clients krijgen hem via het kanaal (zie _read_redis)
+                await redis_client.publish(CHANNEL, json.dumps(items))
+                return
+            except Exception as e:
+                logger.error(f"Error publishing event changes: {str(e)}")
+        self.dispatch(items)
+
+    async def _read_redis(self):
+        while True:
+            try:
+                pubsub = get_redis().pubsub()
+                await pubsub.subscribe(CHANNEL)
+                try:
+                    async for message in pubsub.listen():
+                        if message.get('type') == 'message':
+                            self.dispatch(json.loads(message['data']))
+                finally:
+                    await pubsub.aclose()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Event change subscription failed: {str(e)}")
+                # Wat intussen gepubliceerd is, is gemist
+                for subscription in list(self._subscriptions):
+                    subscription.offer(RESYNC)
+                await asyncio.sleep(RECONNECT_DELAY)
+
+    async def close(self):
+        """Stop de Redis-lezer bij het afsluiten van de app"""
+        if self._reader is not None:
+            self._reader.cancel()
+            try:
+                await self._reader
+            except asyncio.CancelledError:
+                pass
+            self._reader = None
+
+def format_event(message: Dict[str, Any]) -> bytes:
+    """Eén server-sent event"""
+    data = json.dumps(message, ensure_ascii=False, separators=(',', ':'))
+    return f"event: {message['type']}\ndata: {data}\n\n".encode('utf-8')
+
+async def event_stream(
+    subscription: Subscription,
+    is_disconnected: Callable[[], Awaitable[bool]]
+) -> AsyncIterator[bytes]:
+    """Berichten van een subscription als text/event-stream, met keepalives"""
+    try:
+        yield f"retry: {RECONNECT_DELAY * 1000}\n\n".encode('utf-8')
+        while True:
+            try:
+                message = await asyncio.wait_for(subscription.queue.get(), timeout=STREAM_HEARTBEAT)
+            except asyncio.TimeoutError:
+                if await is_disconnected():
+                    return
+                # Commentregel: houdt proxies en de verbinding open
+                yield b": keepalive\n\n"
+                continue
+            yield format_event(message)
+    finally:
+        change_broadcaster.unsubscribe(subscription)
+
+change_broadcaster = ChangeBroadcaster()
+# Na de cache-invalidatie: een client die op een notificatie opnieuw ophaalt, krijgt verse data
+event_changes.subscribe(change_broadcaster.on_change, last=True)
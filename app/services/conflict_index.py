@@ -0,0 +1,162 @@
+import bisect
+import heapq
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+from zoneinfo import ZoneInfo
+
+from app.config import CONFLICT_INDEX_MAX_AGE
+from app.services import event_changes
+from app.services.event_store import to_epoch_us
+from app.services.read_model import ReadModel
+from app.utils.time_utils import parse_utc
+
+CONFLICT_COLUMNS = 'google_event_id, summary, start_time, end_time, location, calendar_name, category'
+# Hele-dag events (00:00 - 23:59 lokale tijd) overlappen met alles op die dag
+ALL_DAY_MIN_DURATION = timedelta(hours=23)
+_TIMEZONE = ZoneInfo("Europe/Amsterdam")
+
+class Interval(NamedTuple):
+    """Een event als [start, end) in epoch-microseconden; sorteert op start"""
+    start: int
+    end: int
+    event_id: str
+
+def is_all_day(start: datetime, end: datetime) -> bool:
+    """Zo slaat de sync hele-dag events op: van 00:00 tot 23:59 (lokale tijd)"""
+    local_start, local_end = start.astimezone(_TIMEZONE), end.astimezone(_TIMEZONE)
+    return (
+        (local_start.hour, local_start.minute) == (0, 0)
+        and (local_end.hour, local_end.minute) in ((23, 59), (0, 0))
+        and end - start >= ALL_DAY_MIN_DURATION
+    )
+
+class ConflictIndex(ReadModel):
+    """Op starttijd gesorteerde intervallen van alle events, voor overlapdetectie.
+
+    conflicts() loopt met een sweep line over het gevraagde venster: per
+    agenda een heap met de einden van de events die nog lopen. Elk nieuw event
+    overlapt met alles wat in de heaps van de andere agenda's overblijft,
+    zodat alleen echte overlappingen worden bekeken: O(n log n + k) in plaats
+    van alle paren te vergelijken.
+
+    Net als de zoekindex wordt hij bij de eerste aanvraag opgebouwd, via
+    event_changes bijgewerkt en na CONFLICT_INDEX_MAX_AGE seconden opnieuw
+    geladen (zie ReadModel).
+    """
+
+    NAME = "Conflict index"
+    COLUMNS = CONFLICT_COLUMNS
+
+    def __init__(self, max_age: float = CONFLICT_INDEX_MAX_AGE):
+        super().__init__(max_age)
+
+    def _reset(self):
+        self._intervals: List[Interval] = []
+        self._events: Dict[str, Tuple[Interval, dict, bool]] = {}
+        # Langste event tot nu toe: begrenst hoe ver vóór het venster een overlap kan beginnen
+        self._max_duration = 0
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def add(self, row: dict):
+        """Voeg een event toe of vervang de bestaande versie"""
+        interval = self._index(row)
+        if interval is not None:
+            bisect.insort(self._intervals, interval)
+
+    def _fill(self, rows: List[dict]):
+        # De rijen komen op id binnen: alles verzamelen en één keer op starttijd sorteren
+        for row in rows:
+            self._index(row)
+        self._intervals = sorted(entry[0] for entry in self._events.values())
+
+    def _index(self, row: dict) -> Optional[Interval]:
+        """Neem een event op in _events; geeft zijn interval terug (None zonder duur)"""
+        event_id = row.get('google_event_id')
+        if not event_id:
+            return None
+        self.remove(event_id)
+
+        start, end = parse_utc(row.get('start_time')), parse_utc(row.get('end_time'))
+        if start is None or end is None or end <= start:
+            # Zonder (positieve) duur kan een event niets overlappen
+            return None
+        doc = {column.strip(): row.get(column.strip()) for column in CONFLICT_COLUMNS.split(',')}
+        doc['start_time'], doc['end_time'] = start.isoformat(), end.isoformat()
+        interval = Interval(to_epoch_us(doc['start_time']), to_epoch_us(doc['end_time']), event_id)
+        self._events[event_id] = (interval, doc, is_all_day(start, end))
+        self._max_duration = max(self._max_duration, interval.end - interval.start)
+        return interval
+
+    def remove(self, event_id: str):
+        entry = self._events.pop(event_id, None)
+        if entry is None:
+            return
+        position = bisect.bisect_left(self._intervals, entry[0])
+        del self._intervals[position]
+
+    def apply(self, change: event_changes.EventChange):
+        for row in change.deleted:
+            self.remove(row.get('google_event_id'))
+        for row in change.upserted:
+            self.add(row)
+
+    def _window(self, start_min: Optional[str], end_max: Optional[str]) -> Iterable[Interval]:
+        """Intervallen die in [start_min, end_max] kunnen vallen, op starttijd"""
+        low, high = 0, len(self._intervals)
+        if start_min is not None:
+            # Een event dat vóór het venster begint, loopt hooguit _max_duration door
+            low = bisect.bisect_left(self._intervals, (to_epoch_us(start_min) - self._max_duration,))
+        if end_max is not None:
+            high = bisect.bisect_left(self._intervals, (to_epoch_us(end_max),))
+        return self._intervals[low:high]
+
+    def conflicts(
+        self,
+        calendars: Optional[Set[str]] = None,
+        start_min: Optional[str] = None,
+        end_max: Optional[str] = None,
+        include_all_day: bool = False
+    ) -> List[dict]:
+        """Alle paren overlappende events uit verschillende agenda's, op begin van de overlap.
+
+        calendars: alleen deze agenda's (None = alle), start_min/end_max:
+        alleen events die dit venster raken. Aansluitende events (het ene
+        eindigt als het andere begint) tellen niet als conflict.
+        """
+        window_start = to_epoch_us(start_min) if start_min is not None else None
+        # Per agenda een heap met (einde, id) van de events die nog lopen
+        active: Dict[Optional[str], List[Tuple[int, str]]] = {}
+        pairs = []
+        for start, end, event_id in self._window(start_min, end_max):
+            if window_start is not None and end <= window_start:
+                continue
+            _, doc, all_day = self._events[event_id]
+            calendar = doc.get('calendar_name')
+            if (calendars and calendar not in calendars) or (all_day and not include_all_day):
+                continue
+            for other_calendar, running in active.items():
+                # Afgelopen events vallen af; wat overblijft overlapt met dit event
+                while running and running[0][0] <= start:
+                    heapq.heappop(running)
+                if other_calendar != calendar:
+                    pairs.extend((other_id, other_end, event_id, end) for other_end, other_id in running)
+            heapq.heappush(active.setdefault(calendar, []), (end, event_id))
+
+        conflicts = []
+        for first_id, first_end, second_id, second_end in pairs:
+            first, second = self._events[first_id][1], self._events[second_id][1]
+            overlap_end = first if first_end <= second_end else second
+            overlap_start_us = self._events[second_id][0].start
+            conflicts.append({
+                'first': first,
+                'second': second,
+                'overlap_start': second['start_time'],
+                'overlap_end': overlap_end['end_time'],
+                'overlap_minutes': round((min(first_end, second_end) - overlap_start_us) / 60_000_000, 2)
+            })
+        return conflicts
+
+conflict_index = ConflictIndex()
+event_changes.subscribe(conflict_index.on_change)
@@ -0,0 +1,58 @@
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, List
+
+from app.config import logger
+
+# Kolommen van de oude versie die listeners nodig hebben (cache-tags, statistieken)
+SNAPSHOT_COLUMNS = 'google_event_id, calendar_name, start_time, end_time, category, labels, location'
+
+@dataclass
+class EventChange:
+    """Een batch gewijzigde events.
+
+    `upserted` zijn de nieuwe versies van toegevoegde of gewijzigde rijen,
+    `previous` de (deels bekende) oude versies daarvan en `deleted` de
+    verwijderde rijen. `labels_known` is False als de oude versies (en dus
+    hun labels) niet opgehaald konden worden.
+    """
+    upserted: List[dict] = field(default_factory=list)
+    previous: List[dict] = field(default_factory=list)
+    deleted: List[dict] = field(default_factory=list)
+    labels_known: bool = True
+
+    def __bool__(self) -> bool:
+        return bool(self.upserted or self.previous or self.deleted)
+
+Listener = Callable[[EventChange], Awaitable[None]]
+
+# Afgeleide data (cache, zoekindex, ...) abonneert zich hier op wijzigingen in
+# calendar_events; de sync-writer en de event-routes publiceren ze.
+_listeners: List[Listener] = []
+# Draaien na alle andere listeners, als de afgeleide data al bijgewerkt is
+_last_listeners: List[Listener] = []
+
+def subscribe(listener: Listener, last: bool = False) -> Listener:
+    """Registreer een async listener; bruikbaar als decorator.
+
+    Met last=True draait hij na de gewone listeners (bijv. cache-invalidatie,
+    zodat een herlaadde entry nooit nog de oude tellers ziet).
+    """
+    listeners = _last_listeners if last else _listeners
+    if listener not in listeners:
+        listeners.append(listener)
+    return listener
+
+def unsubscribe(listener: Listener):
+    for listeners in (_listeners, _last_listeners):
+        if listener in listeners:
+            listeners.remove(listener)
+
+async def publish(change: EventChange):
+    """Geef een wijziging door aan alle listeners; een falende listener stopt de rest niet"""
+    if not change:
+        return
+    for listener in _listeners + _last_listeners:
+        try:
+            await listener(change)
+        except Exception as e:
+            logger.error(f"Event change listener {getattr(listener, '__name__', listener)} failed: {str(e)}")
@@ -0,0 +1,138 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from app.config import logger, CHANGES_SAFETY_WINDOW, TOMBSTONE_RETENTION_DAYS
+from app.services import event_changes
+from app.services import supabase_service as db
+from app.services.pagination import InvalidCursorError, apply_keyset, decode_token, encode_token
+from app.utils.fields import project
+from app.utils.time_utils import parse_timestamp
+
+# Verwijderde events: google_event_id (primary key), calendar_name, deleted_at
+TOMBSTONE_TABLE = 'event_tombstones'
+TOMBSTONE_COLUMNS = 'google_event_id, calendar_name, deleted_at'
+# Oude tombstones hooguit eens per uur opruimen
+PURGE_INTERVAL = 3600
+
+Position = Tuple[str, str]
+
+class CursorExpiredError(Exception):
+    """De cursor is ouder dan de bewaartermijn van tombstones; de client moet opnieuw beginnen"""
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+def _sort_key(value: Optional[str]) -> datetime:
+    # Tijden komen met wisselende offsets terug; vergelijk ze als datetime
+    parsed = parse_timestamp(value)
+    if parsed is None:
+        return datetime.min.replace(tzinfo=timezone.utc)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+def parse_since(since: Optional[str]) -> Tuple[Optional[Position], Position]:
+    """Posities (upserts, deletes) uit een cursor of een ISO-tijdstip.
+
+    Zonder `since` begint de client met een lege replica: alle huidige events,
+    en alleen deletes vanaf nu.
+    """
+    if not since:
+        return None, ((_now() - timedelta(seconds=CHANGES_SAFETY_WINDOW)).isoformat(), '')
+    if parse_timestamp(since) is not None:
+        position = (_sort_key(since).isoformat(), '')
+        return position, position
+    value = decode_token(since)
+    try:
+        upserts, deletes = value['u'], value['d']
+        return (str(upserts[0]), str(upserts[1])) if upserts else None, (str(deletes[0]), str(deletes[1]))
+    except (TypeError, KeyError, IndexError):
+        raise InvalidCursorError(f"Invalid cursor: {since}")
+
+def _merge(upserted: List[dict], deleted: List[dict], limit: int) -> Tuple[List[tuple], bool]:
+    """De eerste `limit` wijzigingen uit beide lijsten, op tijd gesorteerd.
+
+    Zo loopt geen van beide lijsten voor op de andere: een delete wordt nooit
+    gevolgd door een oudere upsert van hetzelfde event in een latere pagina.
+    """
+    merged = sorted(
+        [(_sort_key(row.get('updated_at')), row['google_event_id'], 0, row) for row in upserted] +
+        [(_sort_key(row.get('deleted_at')), row['google_event_id'], 1, row) for row in deleted],
+        key=lambda item: item[:3]
+    )
+    return merged[:limit], len(merged) > limit
+
+def _advance(position: Optional[Position], rows: List[dict], column: str, complete: bool) -> Optional[Position]:
+    """Nieuwe positie na deze rijen.
+
+    Is de client bij, dan gaat de positie niet verder dan CHANGES_SAFETY_WINDOW
+    seconden terug: rijen met een tijdstempel van vóór hun commit (een lopende
+    sync) worden zo alsnog opgepikt, ten koste van wat dubbele wijzigingen.
+    """
+    if rows:
+        position = (rows[-1][column], rows[-1]['google_event_id'])
+    if complete:
+        horizon = _now() - timedelta(seconds=CHANGES_SAFETY_WINDOW)
+        if position is None or _sort_key(position[0]) > horizon:
+            position = (horizon.isoformat(), '')
+    return position
+
+async def fetch_changes(since: Optional[str], columns: str, fields: Sequence[str], limit: int) -> Dict[str, Any]:
+    """Gewijzigde en verwijderde events sinds `since`, met de cursor voor de volgende aanroep"""
+    upsert_position, delete_position = parse_since(since)
+    if _sort_key(delete_position[0]) < _now() - timedelta(days=TOMBSTONE_RETENTION_DAYS):
+        raise CursorExpiredError("Cursor is older than the tombstone retention; fetch all events again without since")
+
+    upsert_query = apply_keyset(db.table('calendar_events').select(columns), upsert_position, 'updated_at')
+    delete_query = apply_keyset(db.table(TOMBSTONE_TABLE).select(TOMBSTONE_COLUMNS), delete_position, 'deleted_at')
+    upsert_result, delete_result = await asyncio.gather(
+        db.execute(upsert_query.limit(limit + 1)),
+        db.execute(delete_query.limit(limit + 1))
+    )
+
+    page, has_more = _merge(upsert_result.data, delete_result.data, limit)
+    upserted = [row for _, _, kind, row in page if kind == 0]
+    deleted = [row for _, _, kind, row in page if kind == 1]
+    cursor = encode_token({
+        'u': _advance(upsert_position, upserted, 'updated_at', not has_more),
+        'd': _advance(delete_position, deleted, 'deleted_at', not has_more)
+    })
+
+    # Staat een event er twee keer in (gewijzigd en verwijderd), dan telt de laatste
+    latest = {event_id: kind for _, event_id, kind, _ in page}
+    return {
+        'upserted': [project(row, fields) for row in upserted if latest[row['google_event_id']] == 0],
+        'deleted': [row for row in deleted if latest[row['google_event_id']] == 1],
+        'cursor': cursor,
+        'has_more': has_more
+    }
+
+_last_purge = 0.0
+
+async def _purge_tombstones():
+    global _last_purge
+    if time.monotonic() - _last_purge < PURGE_INTERVAL:
+        return
+    _last_purge = time.monotonic()
+    cutoff = (_now() - timedelta(days=TOMBSTONE_RETENTION_DAYS)).isoformat()
+    try:
+        await db.execute(db.table(TOMBSTONE_TABLE).delete().lt('deleted_at', cutoff))
+    except Exception as e:
+        logger.error(f"Error purging tombstones: {str(e)}")
+
+async def record_tombstones(change: event_changes.EventChange):
+    """Listener: leg verwijderde events vast, zodat /changes ze kan doorgeven"""
+    deleted_at = _now().isoformat()
+    rows = [
+        {'google_event_id': row['google_event_id'], 'calendar_name': row.get('calendar_name'), 'deleted_at': deleted_at}
+        for row in change.deleted
+        if row.get('google_event_id')
+    ]
+    if not rows:
+        return
+    await db.execute(db.table(TOMBSTONE_TABLE).upsert(rows))
+    await _purge_tombstones()
+
+event_changes.subscribe(record_tombstones)
@@ -0,0 +1,264 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.config import logger, EVENT_STORE_ENABLED, EVENT_STORE_MAX_AGE
+from app.services import event_changes
+from app.services.pagination import InvalidCursorError, decode_cursor, encode_cursor
+from app.services.read_model import ReadModel
+from app.utils.fields import EVENT_FIELDS
+from app.utils.time_utils import parse_utc
+
+STORE_COLUMNS = ', '.join(EVENT_FIELDS)
+# Rijen zonder leesbare tijd sorteren achteraan en vallen buiten elk tijdfilter
+MISSING_TIME = np.iinfo(np.int64).max
+# Eén bit per label in een uint64 bitmasker
+MAX_LABELS = 64
+NO_CODE = -1
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+def to_epoch_us(value: str) -> int:
+    """Epoch in microseconden (exact, net als timestamptz)"""
+    parsed = parse_utc(value)
+    if parsed is None:
+        raise ValueError(f"Invalid timestamp: {value}")
+    return (parsed - _EPOCH) // _MICROSECOND
+
+class StoredEvent(NamedTuple):
+    event_id: str
+    row: dict
+    start: int
+    end: int
+    calendar: int
+    category: int
+    labels: int
+
+class Columns(NamedTuple):
+    """De events als kolommen, gesorteerd op (start, id)"""
+    starts: np.ndarray
+    ends: np.ndarray
+    calendars: np.ndarray
+    categories: np.ndarray
+    labels: np.ndarray
+    ids: np.ndarray
+    rows: List[dict]
+
+class EventStore(ReadModel):
+    """In-process leesmodel van calendar_events, opgeslagen als NumPy-kolommen.
+
+    Per event: start en einde (epoch), de agenda en categorie als code van een
+    geïnterneerde string, en de labels als bitmasker. Tijdbereiken worden met
+    binary search (searchsorted) op de gesorteerde starttijden afgebakend;
+    agenda, categorie en labels zijn vergelijkingen op die codes en maskers.
+
+    De store wordt bij het opstarten op de achtergrond geladen en daarna via
+    event_changes bijgewerkt; na EVENT_STORE_MAX_AGE seconden volgt een
+    volledige reload (zie ReadModel). Tot de eerste load klaar is gaan
+    queries naar Supabase.
+    """
+
+    NAME = "Event store"
+    COLUMNS = STORE_COLUMNS
+
+    def __init__(self, enabled: bool = EVENT_STORE_ENABLED, max_age: float = EVENT_STORE_MAX_AGE):
+        self.enabled = enabled
+        self._load_task: Optional[asyncio.Task] = None
+        super().__init__(max_age)
+
+    def _reset(self):
+        self._events: Dict[str, StoredEvent] = {}
+        self._calendars: Dict[str, int] = {}
+        self._categories: Dict[str, int] = {}
+        self._labels: Dict[str, int] = {}
+        # None: bij de volgende query opnieuw opbouwen (een batch wijzigingen sorteert één keer)
+        self._columns: Optional[Columns] = None
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def start(self):
+        """Begin bij het opstarten met laden, zonder de startup op te houden"""
+        if self.enabled:
+            self._start_load()
+
+    def available(self) -> bool:
+        """True als de store queries kan beantwoorden; start zo nodig een reload.
+
+        Tijdens een reload beantwoordt de vorige versie (met de wijzigingen
+        uit dit proces) de queries.
+        """
+        if not self.enabled:
+            return False
+        if not self.is_fresh:
+            self._start_load()
+        return self.built_at is not None
+
+    def _start_load(self):
+        if self._load_task is None or self._load_task.done():
+            self._load_task = asyncio.ensure_future(self.load())
+
+    async def load(self):
+        """Laad alle events opnieuw uit Supabase"""
+        try:
+            await self.build()
+        except ValueError as e:
+            # Te veel labels voor de bitmaskers: de routes blijven Supabase gebruiken
+            self._disable(e)
+        except Exception as e:
+            logger.error(f"Event store load failed: {str(e)}")
+
+    def _disable(self, error: ValueError):
+        logger.warning(f"Event store disabled: {str(error)}")
+        self.enabled = False
+        self.built_at = None
+
+    def _fill(self, rows: List[dict]):
+        super()._fill(rows)
+        self._build_columns()
+
+    def _label_bit(self, label: str) -> int:
+        bit = self._labels.get(label)
+        if bit is None:
+            if len(self._labels) >= MAX_LABELS:
+                raise ValueError(f"Event store supports at most {MAX_LABELS} distinct labels")
+            bit = self._labels[label] = len(self._labels)
+        return bit
+
+    def add(self, row: dict):
+        event_id = row.get('google_event_id')
+        if not event_id:
+            return
+        stored = {name: row.get(name) for name in EVENT_FIELDS}
+        times = {}
+        for name in ('start_time', 'end_time', 'updated_at'):
+            parsed = parse_utc(stored[name])
+            if parsed is not None:
+                # Zelfde notatie als PostgREST, ook voor rijen die de sync zelf opmaakt
+                stored[name] = parsed.isoformat()
+            times[name] = MISSING_TIME if parsed is None else (parsed - _EPOCH) // _MICROSECOND
+
+        mask = 0
+        for label in stored.get('labels') or []:
+            mask |= 1 << self._label_bit(label)
+        calendar, category = stored.get('calendar_name'), stored.get('category')
+        self._events[event_id] = StoredEvent(
+            event_id,
+            stored,
+            times['start_time'],
+            times['end_time'],
+            self._calendars.setdefault(calendar, len(self._calendars)) if calendar else NO_CODE,
+            self._categories.setdefault(category, len(self._categories)) if category else NO_CODE,
+            mask
+        )
+        self._columns = None
+
+    def apply(self, change: event_changes.EventChange):
+        for row in change.deleted:
+            if self._events.pop(row.get('google_event_id'), None) is not None:
+                self._columns = None
+        for row in change.upserted:
+            self.add(row)
+
+    async def on_change(self, change: event_changes.EventChange):
+        """Listener voor event_changes; tijdens een reload beantwoordt de vorige versie de queries"""
+        try:
+            await super().on_change(change)
+        except ValueError as e:
+            self._disable(e)
+
+    def _build_columns(self) -> Columns:
+        events = sorted(self._events.values(), key=lambda event: (event.start, event.event_id))
+        count = len(events)
+        self._columns = Columns(
+            starts=np.fromiter((event.start for event in events), dtype=np.int64, count=count),
+            ends=np.fromiter((event.end for event in events), dtype=np.int64, count=count),
+            calendars=np.fromiter((event.calendar for event in events), dtype=np.int32, count=count),
+            categories=np.fromiter((event.category for event in events), dtype=np.int16, count=count),
+            labels=np.fromiter((event.labels for event in events), dtype=np.uint64, count=count),
+            ids=np.array([event.event_id for event in events], dtype=str),
+            rows=[event.row for event in events]
+        )
+        return self._columns
+
+    def query(
+        self,
+        start_min: Optional[str] = None,
+        start_max: Optional[str] = None,
+        end_max: Optional[str] = None,
+        calendar_name: Optional[str] = None,
+        category: Optional[str] = None,
+        labels: Optional[Sequence[str]] = None,
+        after: Optional[Tuple[str, str]] = None,
+        limit: Optional[int] = None
+    ) -> List[dict]:
+        """Events op (start_time, google_event_id) gesorteerd, met dezelfde filters als de routes.
+
+        start_min: start_time >= ..., start_max: start_time <= ...,
+        end_max: end_time <= ..., labels: het event heeft ze allemaal,
+        after: keyset-positie (start_time, google_event_id) uit een cursor.
+        """
+        columns = self._columns if self._columns is not None else self._build_columns()
+        starts = columns.starts
+        low, high = 0, len(starts)
+
+        # Binary search op de starttijden bakent het bereik af
+        if start_min is not None:
+            low = int(np.searchsorted(starts, to_epoch_us(start_min), side='left'))
+        if after is not None:
+            try:
+                after_start = to_epoch_us(after[0])
+            except ValueError:
+                raise InvalidCursorError(f"Invalid cursor position: {after[0]}")
+            low = max(low, int(np.searchsorted(starts, after_start, side='left')))
+        if start_max is not None:
+            high = int(np.searchsorted(starts, to_epoch_us(start_max), side='right'))
+        end_limit = to_epoch_us(end_max) if end_max is not None else None
+        if end_limit is not None:
+            # Een event eindigt niet vóór zijn start, dus ook start <= end_max
+            high = min(high, int(np.searchsorted(starts, end_limit, side='right')))
+        if low >= high:
+            return []
+
+        window = slice(low, high)
+        mask = np.ones(high - low, dtype=bool)
+        if start_min is not None or after is not None:
+            mask &= starts[window] != MISSING_TIME
+        if after is not None:
+            # Bij gelijke starttijd beslist het id, net als in apply_keyset
+            mask &= (starts[window] != after_start) | (columns.ids[window] > after[1])
+        if end_limit is not None:
+            mask &= columns.ends[window] <= end_limit
+        for value, codes, column in (
+            (calendar_name, self._calendars, columns.calendars),
+            (category, self._categories, columns.categories)
+        ):
+            if value:
+                code = codes.get(value)
+                if code is None:
+                    return []
+                mask &= column[window] == code
+        if labels:
+            if any(label not in self._labels for label in labels):
+                return []
+            required = np.uint64(sum(1 << self._labels[label] for label in set(labels)))
+            mask &= (columns.labels[window] & required) == required
+
+        positions = low + np.flatnonzero(mask)
+        if limit is not None:
+            positions = positions[:limit]
+        return [columns.rows[position] for position in positions]
+
+    def page(self, limit: Optional[int], cursor: Optional[str], **filters) -> Tuple[List[dict], Optional[str]]:
+        """Zelfde resultaat als pagination.fetch_page, maar uit de store"""
+        rows = self.query(after=decode_cursor(cursor), limit=None if limit is None else limit + 1, **filters)
+        if limit is None or len(rows) <= limit:
+            return rows, None
+        rows = rows[:limit]
+        return rows, encode_cursor(rows[-1])
+
+event_store = EventStore()
+event_changes.subscribe(event_store.on_change)
@@ -0,0 +1,221 @@
+import asyncio
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set
+
+from app.config import (
+    logger, SYNC_UPSERT_CHUNK_SIZE, SYNC_UPSERT_MAX_RETRIES, SYNC_RETRY_BACKOFF, SYNC_WRITE_QUEUE_SIZE
+)
+from app.services import supabase_service as db
+from app.services.event_changes import EventChange, SNAPSHOT_COLUMNS, publish
+
+# PostgREST zet in_() filters in de URL; houd die kort genoeg
+ID_FILTER_BATCH_SIZE = 100
+
+def fetch_existing_rows(event_ids: List[str]) -> Optional[Dict[str, dict]]:
+    """Haal content_hash en snapshot-kolommen van bestaande rijen op, per google_event_id.
+
+    Bij een fout wordt None teruggegeven; alle rijen worden dan als gewijzigd
+    behandeld en gewoon geschreven.
+    """
+    rows = {}
+    try:
+        for i in range(0, len(event_ids), ID_FILTER_BATCH_SIZE):
+            batch = event_ids[i:i + ID_FILTER_BATCH_SIZE]
+            result = db.table('calendar_events')\
+                .select(f"content_hash, {SNAPSHOT_COLUMNS}")\
+                .in_('google_event_id', batch)\
+                .execute()
+            rows.update({row['google_event_id']: row for row in result.data})
+    except Exception as e:
+        logger.error(f"Error fetching existing rows: {str(e)}")
+        return None
+    return rows
+
+class EventBatchWriter:
+    """Verzamel event-rijen en schrijf ze per chunk naar Supabase.
+
+    Rijen en deletes worden per google_event_id gebufferd (de laatste wijziging
+    wint) en in chunks van `chunk_size` geschreven. Rijen waarvan de
+    content_hash gelijk is aan die in de database worden overgeslagen; na elke
+    geslaagde chunk wordt de wijziging gepubliceerd (zie event_changes). Een
+    mislukte chunk wordt los opnieuw geprobeerd; het resultaat van elke chunk
+    staat in `chunks`.
+    """
+
+    def __init__(self, chunk_size: int = SYNC_UPSERT_CHUNK_SIZE, max_retries: int = SYNC_UPSERT_MAX_RETRIES):
+        self.chunk_size = max(1, chunk_size)
+        self.max_retries = max(0, max_retries)
+        self.chunks: List[Dict[str, Any]] = []
+        self._rows: Dict[str, dict] = {}
+        self._deletes: Dict[str, Optional[str]] = {}
+        self._sources: Dict[str, Optional[str]] = {}
+        self._failed_sources: Set[str] = set()
+
+    async def add(self, row: dict, source: Optional[str] = None):
+        """Buffer een rij voor upsert; `source` is de agenda waar hij vandaan komt"""
+        event_id = row['google_event_id']
+        self._deletes.pop(event_id, None)
+        self._rows[event_id] = row
+        self._sources[event_id] = source
+        if len(self._rows) >= self.chunk_size:
+            await self._flush_rows()
+
+    async def delete(self, event_id: str, source: Optional[str] = None):
+        """Buffer een delete van een event"""
+        self._rows.pop(event_id, None)
+        self._deletes[event_id] = source
+        if len(self._deletes) >= self.chunk_size:
+            await self._flush_deletes()
+
+    async def flush(self):
+        """Schrijf alle gebufferde rijen en deletes weg"""
+        await self._flush_rows()
+        await self._flush_deletes()
+
+    def mark_failed(self, source: Optional[str]):
+        """Markeer een agenda als (deels) niet weggeschreven"""
+        if source:
+            self._failed_sources.add(source)
+
+    def failed_sources(self) -> Set[str]:
+        """Agenda's waarvan minstens één chunk definitief mislukt is"""
+        return set(self._failed_sources)
+
+    def summary(self) -> Dict[str, Any]:
+        """Totalen over alle chunks"""
+        upserts = [c for c in self.chunks if c['operation'] == 'upsert']
+        deletes = [c for c in self.chunks if c['operation'] == 'delete']
+        return {
+            'chunks': len(self.chunks),
+            'failed_chunks': sum(1 for c in self.chunks if not c['ok']),
+            'rows_written': sum(c['affected'] for c in upserts if c['ok']),
+            'rows_unchanged': sum(c['unchanged'] for c in upserts),
+            'rows_deleted': sum(c['affected'] for c in deletes if c['ok']),
+            'rows_failed': sum(c['rows'] for c in self.chunks if not c['ok'])
+        }
+
+    async def _flush_rows(self):
+        if not self._rows:
+            return
+        rows, self._rows = list(self._rows.values()), {}
+        sources = {self._sources.pop(row['google_event_id'], None) for row in rows}
+
+        # Alleen echt gewijzigde events schrijven (en dus updated_at ophogen)
+        existing = await db.run_sync(fetch_existing_rows, [row['google_event_id'] for row in rows])
+        known = existing or {}
+        changed = [
+            row for row in rows
+            if known.get(row['google_event_id'], {}).get('content_hash') != row.get('content_hash')
+        ]
+
+        def upsert():
+            if changed:
+                # updated_at pas vlak voor het schrijven: een rij kan lang in de buffer
+                # gestaan hebben, en /changes leest alleen CHANGES_SAFETY_WINDOW terug
+                updated_at = datetime.now(timezone.utc).isoformat()
+                for row in changed:
+                    row['updated_at'] = updated_at
+                db.table('calendar_events').upsert(changed).execute()
+            return len(changed)
+
+        chunk = await self._write_chunk('upsert', len(changed), sources, upsert, unchanged=len(rows) - len(changed))
+        if chunk['ok'] and changed:
+            # Oude en nieuwe versie: een event kan van agenda, maand of label wisselen
+            previous = [known[row['google_event_id']] for row in changed if row['google_event_id'] in known]
+            await publish(EventChange(upserted=changed, previous=previous, labels_known=existing is not None))
+
+    async def _flush_deletes(self):
+        if not self._deletes:
+            return
+        deletes, self._deletes = self._deletes, {}
+        event_ids = list(deletes)
+
+        deleted_rows = []
+
+        def delete():
+            deleted_rows.clear()
+            for i in range(0, len(event_ids), ID_FILTER_BATCH_SIZE):
+                batch = event_ids[i:i + ID_FILTER_BATCH_SIZE]
+                result = db.table('calendar_events').delete().in_('google_event_id', batch).execute()
+                deleted_rows.extend(result.data or [])
+            return len(deleted_rows)
+
+        await self._write_chunk('delete', len(event_ids), set(deletes.values()), delete)
+        if deleted_rows:
+            await publish(EventChange(deleted=deleted_rows))
+
+    async def _write_chunk(self, operation: str, row_count: int, sources: Set[Optional[str]], write, unchanged: int = 0):
+        """Voer één chunk uit met retries; alleen deze chunk wordt herhaald"""
+        chunk = {
+            'index': len(self.chunks),
+            'operation': operation,
+            'rows': row_count,
+            'affected': 0,
+            'unchanged': unchanged,
+            'ok': False,
+            'attempts': 0,
+            'error': None
+        }
+        self.chunks.append(chunk)
+
+        for attempt in range(self.max_retries + 1):
+            chunk['attempts'] = attempt + 1
+            try:
+                chunk['affected'] = await db.run_sync(write)
+                chunk['ok'] = True
+                chunk['error'] = None
+                logger.info(f"Chunk {chunk['index']} ({operation}, {row_count} rows) written")
+                return chunk
+            except Exception as e:
+                chunk['error'] = str(e)
+                logger.error(f"Chunk {chunk['index']} ({operation}) failed on attempt {attempt + 1}: {str(e)}")
+                if attempt < self.max_retries:
+                    await asyncio.sleep(SYNC_RETRY_BACKOFF * (2 ** attempt))
+
+        for source in sources:
+            self.mark_failed(source)
+        return chunk
+
+class QueuedEventWriter:
+    """Schrijf-stage voor gelijktijdige producers.
+
+    Meerdere agenda-taken zetten rijen op een begrensde queue; één consumer
+    geeft ze door aan de EventBatchWriter. Een volle queue remt de producers af
+    zodat het geheugengebruik begrensd blijft.
+    """
+
+    def __init__(self, writer: EventBatchWriter, maxsize: int = SYNC_WRITE_QUEUE_SIZE):
+        self.writer = writer
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, maxsize))
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def add(self, row: dict, source: Optional[str] = None):
+        await self._queue.put(('upsert', row, source))
+
+    async def delete(self, event_id: str, source: Optional[str] = None):
+        await self._queue.put(('delete', event_id, source))
+
+    async def close(self):
+        """Wacht tot de queue leeg is en schrijf de laatste chunk weg"""
+        await self._queue.put(None)
+        if self._task:
+            await self._task
+
+    async def _run(self):
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                break
+            operation, payload, source = item
+            try:
+                if operation == 'delete':
+                    await self.writer.delete(payload, source)
+                else:
+                    await self.writer.add(payload, source)
+            except Exception as e:
+                logger.error(f"Write stage error: {str(e)}")
+                self.writer.mark_failed(source)
+        await self.writer.flush()
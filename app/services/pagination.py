@@ -0,0 +1,102 @@
+import base64
+import json
+from typing import Any, AsyncIterator, Callable, List, Optional, Tuple
+
+from app.config import logger
+from app.services import supabase_service as db
+
+# Pagina-grootte waarmee NDJSON streams de database lezen
+STREAM_PAGE_SIZE = 500
+MAX_PAGE_SIZE = 1000
+
+class InvalidCursorError(ValueError):
+    """Een cursor die niet door encode_cursor gemaakt is"""
+
+def encode_token(value: Any) -> str:
+    """JSON-waarde als opake, URL-veilige string"""
+    raw = json.dumps(value, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_token(token: str) -> Any:
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise InvalidCursorError(f"Invalid cursor: {token}")
+
+def encode_cursor(row: dict) -> str:
+    """Opake cursor voor keyset-paginatie op (start_time, google_event_id)"""
+    return encode_token([row['start_time'], row['google_event_id']])
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[str, str]]:
+    if not cursor:
+        return None
+    value = decode_token(cursor)
+    if not isinstance(value, list) or len(value) != 2:
+        raise InvalidCursorError(f"Invalid cursor: {cursor}")
+    return str(value[0]), str(value[1])
+
+def _quote(value: str) -> str:
+    # PostgREST: waarden tussen dubbele quotes, zodat + , ( ) geen syntax zijn
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def apply_keyset(query, position: Optional[Tuple[str, str]], column: str = 'start_time'):
+    """Sorteer op (`column`, google_event_id) en begin na `position`"""
+    if position:
+        value, event_id = _quote(position[0]), _quote(position[1])
+        query = query.or_(
+            f"{column}.gt.{value},and({column}.eq.{value},google_event_id.gt.{event_id})"
+        )
+    return query.order(column).order('google_event_id')
+
+async def fetch_page(
+    build_query: Callable[[], Any],
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None
+) -> Tuple[List[dict], Optional[str]]:
+    """Eén pagina rijen plus de cursor voor de volgende (None als dit de laatste is).
+
+    `build_query` levert elke keer een nieuwe, gefilterde query builder; de
+    builders van postgrest zijn muteerbaar en dus niet herbruikbaar.
+    """
+    query = apply_keyset(build_query(), decode_cursor(cursor))
+    if limit is None:
+        return (await db.execute(query)).data, None
+
+    # Eén rij extra ophalen om te weten of er nog een pagina is
+    rows = (await db.execute(query.limit(limit + 1))).data
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, encode_cursor(rows[-1])
+
+async def stream_ndjson(
+    build_query: Callable[[], Any],
+    transform: Callable[[dict], Any],
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    page_size: int = STREAM_PAGE_SIZE
+) -> AsyncIterator[bytes]:
+    """Lees rijen per keyset-pagina en geef ze direct door als NDJSON regels.
+
+    Zowel de server als de client hoeven zo nooit het volledige resultaat in
+    het geheugen te hebben.
+    """
+    position = decode_cursor(cursor)
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = page_size if remaining is None else min(page_size, remaining)
+        query = apply_keyset(build_query(), position).limit(size)
+        try:
+            rows = (await db.execute(query)).data
+        except Exception as e:
+            # De status (200) is al verstuurd; de client ziet een afgebroken stream
+            logger.error(f"Error streaming events: {str(e)}")
+            return
+        for row in rows:
+            yield (json.dumps(transform(row), ensure_ascii=False, separators=(',', ':')) + '\n').encode('utf-8')
+        if len(rows) < size:
+            return
+        position = (rows[-1]['start_time'], rows[-1]['google_event_id'])
+        if remaining is not None:
+            remaining -= len(rows)
@@ -0,0 +1,92 @@
+import asyncio
+import time
+from typing import List, Optional
+
+from app.config import logger
+from app.services import event_changes
+from app.services import supabase_service as db
+
+class ReadModel:
+    """Basis voor in-process leesmodellen van calendar_events.
+
+    Het model wordt in één keer uit Supabase geladen (COLUMNS, op
+    google_event_id gepagineerd) en daarna via event_changes bijgewerkt.
+    Wijzigingen uit andere workers komen hier niet binnen; daarom volgt na
+    max_age seconden een volledige rebuild (0 = nooit).
+
+    Subklassen leveren _reset(), add(row), apply(change) en __len__; _fill()
+    kan een snellere bulk-opbouw geven dan losse add()-aanroepen.
+    """
+
+    NAME = "Read model"
+    COLUMNS = 'google_event_id'
+
+    def __init__(self, max_age: float):
+        self.max_age = max_age
+        self.built_at: Optional[float] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._pending: Optional[List[event_changes.EventChange]] = None
+        self._reset()
+
+    def _reset(self):
+        raise NotImplementedError
+
+    def add(self, row: dict):
+        raise NotImplementedError
+
+    def apply(self, change: event_changes.EventChange):
+        raise NotImplementedError
+
+    def __len__(self) -> int:
+        raise NotImplementedError
+
+    def _get_lock(self) -> asyncio.Lock:
+        # Pas binnen de draaiende event loop aanmaken (Python 3.9 bindt locks aan de loop)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    @property
+    def is_fresh(self) -> bool:
+        if self.built_at is None:
+            return False
+        return self.max_age <= 0 or time.monotonic() - self.built_at < self.max_age
+
+    async def on_change(self, change: event_changes.EventChange):
+        """Listener voor event_changes"""
+        if self._pending is not None:
+            # Een lopende build ziet deze wijziging mogelijk niet; daarna opnieuw toepassen
+            self._pending.append(change)
+        if self.built_at is not None:
+            self.apply(change)
+
+    async def ensure_built(self):
+        """Bouw het model (opnieuw) op als het nog niet bestaat of te oud is"""
+        if self.is_fresh:
+            return
+        async with self._get_lock():
+            if self.is_fresh:
+                return
+            await self.build()
+
+    async def build(self):
+        """Laad alle events opnieuw uit Supabase"""
+        started = time.perf_counter()
+        self._pending = []
+        try:
+            rows = await self._load_rows()
+            self._reset()
+            self._fill(rows)
+            for change in self._pending:
+                self.apply(change)
+            self.built_at = time.monotonic()
+        finally:
+            self._pending = None
+        logger.info(f"{self.NAME} built: {len(self)} events in {(time.perf_counter() - started) * 1000:.0f}ms")
+
+    async def _load_rows(self) -> List[dict]:
+        return await db.fetch_all(lambda: db.table('calendar_events').select(self.COLUMNS).order('google_event_id'))
+
+    def _fill(self, rows: List[dict]):
+        for row in rows:
+            self.add(row)
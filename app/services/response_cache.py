@@ -0,0 +1,179 @@
+import gzip
+import hashlib
+import json
+import struct
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+from fastapi import Request, Response
+
+from app.config import CACHE_GZIP_MIN_BYTES, HTTP_MAX_AGE_SHORT, HTTP_MAX_AGE_MEDIUM, HTTP_MAX_AGE_LONG
+from app.services.cache_service import (
+    CacheTTL, EntryCodec, FLAG_GZIP, drop_local_entry, get_data_version, get_or_load, register_codec
+)
+
+HTTP_MAX_AGE = {
+    CacheTTL.SHORT: HTTP_MAX_AGE_SHORT,
+    CacheTTL.MEDIUM: HTTP_MAX_AGE_MEDIUM,
+    CacheTTL.LONG: HTTP_MAX_AGE_LONG
+}
+# Een sterke ETag hoort bij één representatie; de gzip-variant krijgt een suffix
+GZIP_ETAG_SUFFIX = '-gz'
+
+class CachedBody(NamedTuple):
+    """Een kant-en-klare JSON response body, eventueel gzip-gecomprimeerd"""
+    body: bytes
+    gzipped: bool
+    # Response headers die bij deze body horen (bijv. X-Next-Cursor)
+    headers: Optional[Dict[str, str]] = None
+
+class JsonPayload(NamedTuple):
+    """Loader-resultaat met extra headers die mee gecachet moeten worden"""
+    data: Any
+    headers: Dict[str, str]
+
+_HEADER_LENGTH = struct.Struct('!H')
+
+class BodyCodec(EntryCodec):
+    """Slaat de body ongewijzigd op; een hit hoeft dus niets te parsen.
+
+    Payload: lengte van de headers (2 bytes), de headers als JSON, de body.
+    """
+    id = 17
+    name = 'body'
+    # Bodies zijn zelf al gzip, zodat ze zo naar de client kunnen
+    compressible = False
+
+    def encode(self, value: CachedBody) -> Tuple[int, bytes]:
+        headers = json.dumps(value.headers, separators=(",", ":")).encode("utf-8") if value.headers else b''
+        return (FLAG_GZIP if value.gzipped else 0), _HEADER_LENGTH.pack(len(headers)) + headers + value.body
+
+    def decode(self, flags: int, payload: bytes) -> CachedBody:
+        (length,) = _HEADER_LENGTH.unpack_from(payload)
+        start = _HEADER_LENGTH.size
+        headers = json.loads(payload[start:start + length]) if length else None
+        return CachedBody(payload[start + length:], bool(flags & FLAG_GZIP), headers)
+
+BODY_CODEC = register_codec(BodyCodec())
+
+def cache_control(ttl_type: CacheTTL) -> str:
+    """Cache-Control voor de browser, per CacheTTL tier"""
+    max_age = HTTP_MAX_AGE.get(ttl_type, HTTP_MAX_AGE_SHORT)
+    return f"private, max-age={max_age}" if max_age > 0 else "private, no-cache"
+
+async def version_etag(key: str, tags: Optional[List[str]]) -> Optional[str]:
+    """Sterke ETag uit de key en de dataversies van zijn tags; None zonder Redis"""
+    version = await get_data_version(tags or [])
+    if version is None:
+        return None
+    return f'"v{hashlib.sha1(f"{key}|{version}".encode("utf-8")).hexdigest()[:20]}"'
+
+def content_etag(body: bytes) -> str:
+    return f'"c{hashlib.sha1(body).hexdigest()[:20]}"'
+
+def matching_etag(request: Request, etag: Optional[str]) -> Optional[str]:
+    """De tag uit If-None-Match die bij `etag` hoort (in welke encoding ook), of None"""
+    header = request.headers.get('if-none-match')
+    if not etag or not header:
+        return None
+    if header.strip() == '*':
+        return etag
+    gzip_tail = GZIP_ETAG_SUFFIX + '"'
+    for tag in header.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        plain = tag[:-len(gzip_tail)] + '"' if tag.endswith(gzip_tail) else tag
+        if plain == etag:
+            return tag
+    return None
+
+def not_modified_response(etag: str, headers: Optional[Dict[str, str]] = None) -> Response:
+    """304 zonder body; de client gebruikt zijn eigen kopie"""
+    return Response(status_code=304, headers={**(headers or {}), "ETag": etag, "Vary": "Accept-Encoding"})
+
+def serialize_body(
+    data: Any,
+    headers: Optional[Dict[str, str]] = None,
+    etag: Optional[str] = None
+) -> CachedBody:
+    """Serialiseer data één keer naar de uiteindelijke response body.
+
+    Zonder `etag` krijgt de body een ETag op basis van zijn inhoud.
+    """
+    # Zelfde opmaak als FastAPI's JSONResponse
+    body = json.dumps(data, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+    headers = {**(headers or {}), "ETag": etag or content_etag(body)}
+    if CACHE_GZIP_MIN_BYTES > 0 and len(body) >= CACHE_GZIP_MIN_BYTES:
+        return CachedBody(gzip.compress(body, compresslevel=6), True, headers)
+    return CachedBody(body, False, headers)
+
+def accepts_gzip(request: Request) -> bool:
+    return 'gzip' in request.headers.get('accept-encoding', '').lower()
+
+def body_response(
+    request: Request,
+    cached: CachedBody,
+    headers: Optional[Dict[str, str]] = None
+) -> Response:
+    """Bouw een Response direct uit de gecachete bytes (Content-Length zet Starlette)"""
+    headers = {**(cached.headers or {}), **(headers or {})}
+    content = cached.body
+    if cached.gzipped:
+        headers['Vary'] = 'Accept-Encoding'
+        if accepts_gzip(request):
+            headers['Content-Encoding'] = 'gzip'
+            if 'ETag' in headers:
+                headers['ETag'] = headers['ETag'][:-1] + GZIP_ETAG_SUFFIX + '"'
+        else:
+            content = gzip.decompress(content)
+    return Response(content=content, media_type="application/json", headers=headers)
+
+async def cached_json_response(
+    request: Request,
+    key: str,
+    loader: Callable[[], Awaitable[Any]],
+    ttl_type: CacheTTL = CacheTTL.SHORT,
+    tags: Optional[List[str]] = None,
+    headers: Optional[Dict[str, str]] = None
+) -> Response:
+    """Serveer een JSON endpoint uit de cache als ruwe bytes.
+
+    `loader` levert JSON-serialiseerbare data (of een JsonPayload met extra
+    headers); die wordt bij een misser één keer naar bytes omgezet en zo
+    opgeslagen. Een hit gaat zonder json.loads,
+    validatie of opnieuw serialiseren direct naar de client. Zet
+    X-Cache-Status op HIT, STALE of MISS.
+
+    De ETag volgt uit de dataversies van `tags`. Past If-None-Match daarbij,
+    dan volgt een 304 zonder cache- of database-lookup. Zonder Redis (geen
+    versies) krijgt de body een ETag op inhoud en bespaart een 304 alleen
+    bandbreedte.
+    """
+    headers = {**(headers or {}), "Cache-Control": cache_control(ttl_type)}
+    etag = await version_etag(key, tags)
+    matched = matching_etag(request, etag)
+    if matched:
+        return not_modified_response(matched, {**headers, "X-Cache-Status": "NOT_MODIFIED"})
+
+    async def load_body() -> CachedBody:
+        # De versies zijn gelezen vóór het laden: de body is minstens zo nieuw als zijn ETag
+        result = await loader()
+        if isinstance(result, JsonPayload):
+            return serialize_body(result.data, result.headers, etag)
+        return serialize_body(result, etag=etag)
+
+    cached, cache_status = await get_or_load(key, load_body, ttl_type, tags, codec=BODY_CODEC)
+    if etag is not None and cache_status != "MISS" and (cached.headers or {}).get("ETag") != etag:
+        # Body van een oudere versie. L1 kan een invalidatie door een andere worker
+        # nog niet gezien hebben; Redis wel (de key is dan weg en wordt opnieuw geladen)
+        drop_local_entry(key)
+        cached, cache_status = await get_or_load(key, load_body, ttl_type, tags, codec=BODY_CODEC)
+    if etag is None:
+        matched = matching_etag(request, (cached.headers or {}).get("ETag"))
+        if matched:
+            return not_modified_response(matched, {**headers, "X-Cache-Status": cache_status})
+    else:
+        # Staat de body nog in Redis, dan heeft de versie-bump hem niet geïnvalideerd
+        # (bijv. een andere maand in dezelfde agenda): geldig, met de huidige ETag
+        headers["ETag"] = etag
+    return body_response(request, cached, {**headers, "X-Cache-Status": cache_status})
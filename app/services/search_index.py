@@ -0,0 +1,184 @@
+import bisect
+import math
+import re
+import unicodedata
+from typing import Dict, Iterator, List, Optional, Set, Tuple
+
+from app.config import SEARCH_INDEX_MAX_AGE
+from app.services import event_changes
+from app.services.read_model import ReadModel
+
+# Velden met hun gewicht: een treffer in de titel telt zwaarder dan in de beschrijving
+SEARCH_FIELDS = {'summary': 3.0, 'location': 1.5, 'description': 1.0}
+DOC_COLUMNS = 'google_event_id, summary, description, start_time, end_time, location, calendar_name, is_recurring'
+
+# BM25 parameters
+BM25_K1 = 1.2
+BM25_B = 0.75
+# Een prefix-treffer ("overl" -> "overleg") telt minder dan een exact woord
+PREFIX_WEIGHT = 0.5
+MAX_PREFIX_EXPANSIONS = 50
+
+_TOKEN_RE = re.compile(r"\w+")
+
+def tokenize(text: Optional[str]) -> List[str]:
+    """Kleine letters, zonder accenten, opgesplitst in woorden"""
+    if not text:
+        return []
+    normalized = unicodedata.normalize('NFKD', text.lower())
+    stripped = ''.join(ch for ch in normalized if not unicodedata.combining(ch))
+    return _TOKEN_RE.findall(stripped)
+
+class SearchIndex(ReadModel):
+    """In-process inverted index over calendar_events met BM25F ranking.
+
+    De index wordt bij de eerste zoekopdracht uit Supabase opgebouwd en daarna
+    bijgewerkt via event_changes; na SEARCH_INDEX_MAX_AGE seconden volgt een
+    volledige rebuild (zie ReadModel).
+    """
+
+    NAME = "Search index"
+    COLUMNS = DOC_COLUMNS
+
+    def __init__(self, max_age: float = SEARCH_INDEX_MAX_AGE):
+        super().__init__(max_age)
+
+    def _reset(self):
+        self._docs: Dict[str, dict] = {}
+        # term -> event id -> veld -> term frequency
+        self._postings: Dict[str, Dict[str, Dict[str, int]]] = {}
+        self._doc_terms: Dict[str, Set[str]] = {}
+        self._field_lengths: Dict[str, Dict[str, int]] = {}
+        self._total_lengths: Dict[str, int] = {name: 0 for name in SEARCH_FIELDS}
+        # Gesorteerde woordenlijst voor prefix-lookups
+        self._vocab: List[str] = []
+
+    def __len__(self) -> int:
+        return len(self._docs)
+
+    def add(self, row: dict):
+        """Voeg een event toe of vervang de bestaande versie"""
+        for term in self._index(row):
+            bisect.insort(self._vocab, term)
+
+    def _fill(self, rows: List[dict]):
+        # Bij een volledige build de woordenlijst één keer sorteren in plaats van per woord invoegen
+        for row in rows:
+            self._index(row)
+        self._vocab = sorted(self._postings)
+
+    def _index(self, row: dict) -> List[str]:
+        """Neem een event op in de postings; geeft de nieuwe woorden terug"""
+        event_id = row.get('google_event_id')
+        if not event_id:
+            return []
+        self.remove(event_id)
+
+        doc = {column.strip(): row.get(column.strip()) for column in DOC_COLUMNS.split(',')}
+        lengths = {}
+        terms = set()
+        new_terms = []
+        for name in SEARCH_FIELDS:
+            tokens = tokenize(doc.get(name))
+            lengths[name] = len(tokens)
+            self._total_lengths[name] += len(tokens)
+            for token in tokens:
+                postings = self._postings.get(token)
+                if postings is None:
+                    postings = self._postings[token] = {}
+                    new_terms.append(token)
+                fields = postings.setdefault(event_id, {})
+                fields[name] = fields.get(name, 0) + 1
+                terms.add(token)
+
+        self._docs[event_id] = doc
+        self._doc_terms[event_id] = terms
+        self._field_lengths[event_id] = lengths
+        return new_terms
+
+    def remove(self, event_id: str):
+        if event_id not in self._docs:
+            return
+        for token in self._doc_terms.pop(event_id):
+            postings = self._postings[token]
+            postings.pop(event_id, None)
+            if not postings:
+                del self._postings[token]
+                self._vocab.pop(bisect.bisect_left(self._vocab, token))
+        for name, length in self._field_lengths.pop(event_id).items():
+            self._total_lengths[name] -= length
+        del self._docs[event_id]
+
+    def apply(self, change: event_changes.EventChange):
+        for row in change.deleted:
+            self.remove(row.get('google_event_id'))
+        for row in change.upserted:
+            self.add(row)
+
+    def _expand(self, token: str) -> Iterator[Tuple[str, float]]:
+        """Het exacte woord plus woorden die met `token` beginnen"""
+        if token in self._postings:
+            yield token, 1.0
+        start = bisect.bisect_right(self._vocab, token)
+        for term in self._vocab[start:start + MAX_PREFIX_EXPANSIONS]:
+            if not term.startswith(token):
+                break
+            yield term, PREFIX_WEIGHT
+
+    def search(
+        self,
+        query: str,
+        limit: int = 50,
+        offset: int = 0,
+        calendar_name: Optional[str] = None,
+        include_description: bool = True
+    ) -> Tuple[int, List[dict]]:
+        """Zoek events; elk woord moet (als woord of prefix) voorkomen.
+
+        Geeft (totaal aantal treffers, events voor deze pagina) terug, op
+        relevantie gesorteerd en bij gelijke score op starttijd.
+        """
+        tokens = list(dict.fromkeys(tokenize(query)))
+        if not tokens or not self._docs:
+            return 0, []
+
+        fields = {name: weight for name, weight in SEARCH_FIELDS.items() if include_description or name != 'description'}
+        doc_count = len(self._docs)
+        avg_lengths = {name: self._total_lengths[name] / doc_count for name in fields}
+
+        scores: Optional[Dict[str, float]] = None
+        for token in tokens:
+            token_scores: Dict[str, float] = {}
+            for term, factor in self._expand(token):
+                postings = self._postings[term]
+                idf = math.log(1 + (doc_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for event_id, frequencies in postings.items():
+                    if calendar_name and self._docs[event_id]['calendar_name'] != calendar_name:
+                        continue
+                    # BM25F: per veld gewogen en op veldlengte genormaliseerde frequentie
+                    weighted = 0.0
+                    for name, weight in fields.items():
+                        frequency = frequencies.get(name)
+                        if frequency:
+                            avg = avg_lengths[name] or 1
+                            norm = 1 - BM25_B + BM25_B * self._field_lengths[event_id][name] / avg
+                            weighted += weight * frequency / norm
+                    if not weighted:
+                        continue
+                    score = factor * idf * weighted * (BM25_K1 + 1) / (weighted + BM25_K1)
+                    # De beste uitbreiding per woord telt, zodat een kort prefix niet opstapelt
+                    if score > token_scores.get(event_id, 0.0):
+                        token_scores[event_id] = score
+
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {event_id: score + token_scores[event_id] for event_id, score in scores.items() if event_id in token_scores}
+            if not scores:
+                return 0, []
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], self._docs[item[0]].get('start_time') or ''))
+        return len(ranked), [self._docs[event_id] for event_id, _ in ranked[offset:offset + limit]]
+
+search_index = SearchIndex()
+event_changes.subscribe(search_index.on_change)
@@ -0,0 +1,284 @@
+import asyncio
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+from redis.exceptions import WatchError
+
+from app.config import logger, STATS_AGGREGATES_MAX_AGE
+from app.services import event_changes
+from app.services import supabase_service as db
+from app.services.cache_service import get_redis, redis_available, register_persistent_prefix
+from app.utils.time_utils import parse_timestamp
+
+# Zo vaak probeert een rebuild het opnieuw als er tijdens het tellen wijzigingen binnenkomen
+REBUILD_ATTEMPTS = 3
+STATS_COLUMNS = 'calendar_name, start_time, location'
+
+def row_counters(row: dict) -> Tuple[Counter, Counter]:
+    """Tellers (totaal, per agenda, per weekdag) en locaties van één event-rij"""
+    counts = Counter(total=1)
+    if row.get('calendar_name'):
+        counts[f"cal:{row['calendar_name']}"] += 1
+    start = parse_timestamp(row.get('start_time'))
+    if start is not None:
+        if start.tzinfo is not None:
+            start = start.astimezone(ZoneInfo("Europe/Amsterdam"))
+        counts[f"day:{start.strftime('%A')}"] += 1
+    locations = Counter()
+    if row.get('location'):
+        locations[row['location']] += 1
+    return counts, locations
+
+def change_deltas(change: event_changes.EventChange) -> Tuple[Counter, Counter]:
+    """Netto verschil in tellers door een wijziging: nieuwe versies min oude versies"""
+    counts, locations = Counter(), Counter()
+    for sign, rows in ((1, change.upserted), (-1, change.previous), (-1, change.deleted)):
+        for row in rows:
+            row_counts, row_locations = row_counters(row)
+            for name, value in row_counts.items():
+                counts[name] += sign * value
+            for name, value in row_locations.items():
+                locations[name] += sign * value
+    # Counter + Counter laat nullen en negatieve waarden vallen; hier moeten ze blijven
+    return (
+        Counter({name: value for name, value in counts.items() if value}),
+        Counter({name: value for name, value in locations.items() if value})
+    )
+
+class AggregateStore:
+    """Opslag van de tellers; implementaties moeten deze methodes leveren.
+
+    apply() en clear() verhogen een generatie. Een rebuild leest die vóór het
+    tellen en replace() weigert als hij intussen veranderd is: dan kan de
+    telling een wijziging (uit welke worker ook) gemist hebben.
+    """
+
+    async def exists(self) -> bool:
+        raise NotImplementedError
+
+    async def generation(self) -> int:
+        raise NotImplementedError
+
+    async def apply(self, counts: Counter, locations: Counter):
+        raise NotImplementedError
+
+    async def replace(self, counts: Counter, locations: Counter, generation: int) -> bool:
+        raise NotImplementedError
+
+    async def clear(self):
+        raise NotImplementedError
+
+    async def read(self, top_locations: int) -> Tuple[Dict[str, int], List[Tuple[str, int]]]:
+        raise NotImplementedError
+
+class InMemoryAggregateStore(AggregateStore):
+    """Tellers in het geheugen van dit proces (lokaal / één worker).
+
+    Wijzigingen uit andere workers komen hier niet binnen; daarom gelden de
+    tellers na max_age seconden als ontbrekend en volgt een rebuild (0 = nooit).
+    """
+
+    def __init__(self, max_age: float = STATS_AGGREGATES_MAX_AGE):
+        self.max_age = max_age
+        self.built_at: Optional[float] = None
+        self._generation = 0
+        self._counts: Optional[Counter] = None
+        self._locations: Counter = Counter()
+
+    async def exists(self) -> bool:
+        if self._counts is None:
+            return False
+        return self.max_age <= 0 or time.monotonic() - self.built_at < self.max_age
+
+    async def generation(self) -> int:
+        return self._generation
+
+    async def apply(self, counts: Counter, locations: Counter):
+        self._generation += 1
+        if self._counts is None:
+            return
+        self._counts.update(counts)
+        self._locations.update(locations)
+
+    async def replace(self, counts: Counter, locations: Counter, generation: int) -> bool:
+        if generation != self._generation:
+            return False
+        self._counts = Counter(counts)
+        self._locations = Counter(locations)
+        self.built_at = time.monotonic()
+        return True
+
+    async def clear(self):
+        self._generation += 1
+        self._counts = None
+        self._locations = Counter()
+
+    async def read(self, top_locations: int) -> Tuple[Dict[str, int], List[Tuple[str, int]]]:
+        counts = dict(self._counts or {})
+        locations = [(name, count) for name, count in self._locations.most_common() if count > 0]
+        return counts, locations[:top_locations]
+
+class RedisAggregateStore(AggregateStore):
+    """Tellers in Redis (HINCRBY / ZINCRBY), gedeeld door alle workers"""
+
+    COUNTS_KEY = "stats:counts"
+    LOCATIONS_KEY = "stats:locations"
+    GENERATION_KEY = "stats:generation"
+
+    # Atomair: generatie verhogen en alleen ophogen als de tellers bestaan (ontbreken ze, dan wordt er herbouwd)
+    APPLY_SCRIPT = """
+    redis.call('INCR', KEYS[3])
+    if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+    local n = tonumber(ARGV[1])
+    for i = 1, n do redis.call('HINCRBY', KEYS[1], ARGV[2 * i], ARGV[2 * i + 1]) end
+    for i = 2 * n + 2, #ARGV, 2 do redis.call('ZINCRBY', KEYS[2], ARGV[i + 1], ARGV[i]) end
+    redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', 0)
+    return 1
+    """
+
+    @property
+    def client(self):
+        # Lazy: de gedeelde client wordt pas bij het eerste gebruik aangemaakt
+        return get_redis()
+
+    async def exists(self) -> bool:
+        return bool(await self.client.exists(self.COUNTS_KEY))
+
+    async def generation(self) -> int:
+        return int(await self.client.get(self.GENERATION_KEY) or 0)
+
+    async def apply(self, counts: Counter, locations: Counter):
+        args = [len(counts)]
+        for name, value in counts.items():
+            args.extend([name, value])
+        for name, value in locations.items():
+            args.extend([name, value])
+        await self.client.eval(
+            self.APPLY_SCRIPT, 3, self.COUNTS_KEY, self.LOCATIONS_KEY, self.GENERATION_KEY, *args
+        )
+
+    async def replace(self, counts: Counter, locations: Counter, generation: int) -> bool:
+        # Opbouwen onder tijdelijke keys en atomair omzetten, zodat lezers nooit een halve set zien
+        tmp_counts, tmp_locations = f"{self.COUNTS_KEY}:rebuild", f"{self.LOCATIONS_KEY}:rebuild"
+        async with self.client.pipeline(transaction=True) as pipe:
+            # WATCH: een apply of clear van een andere worker breekt de transactie af
+            await pipe.watch(self.GENERATION_KEY)
+            if int(await pipe.get(self.GENERATION_KEY) or 0) != generation:
+                return False
+            pipe.multi()
+            pipe.delete(tmp_counts, tmp_locations)
+            pipe.hset(tmp_counts, mapping={'total': 0, **counts})
+            if locations:
+                pipe.zadd(tmp_locations, dict(locations))
+                pipe.rename(tmp_locations, self.LOCATIONS_KEY)
+            else:
+                pipe.delete(self.LOCATIONS_KEY)
+            pipe.rename(tmp_counts, self.COUNTS_KEY)
+            try:
+                await pipe.execute()
+            except WatchError:
+                return False
+        return True
+
+    async def clear(self):
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(self.COUNTS_KEY, self.LOCATIONS_KEY)
+            pipe.incr(self.GENERATION_KEY)
+            await pipe.execute()
+
+    async def read(self, top_locations: int) -> Tuple[Dict[str, int], List[Tuple[str, int]]]:
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.hgetall(self.COUNTS_KEY)
+            pipe.zrevrange(self.LOCATIONS_KEY, 0, top_locations - 1, withscores=True)
+            raw_counts, raw_locations = await pipe.execute()
+        counts = {name.decode(): int(value) for name, value in raw_counts.items()}
+        locations = [(name.decode(), int(score)) for name, score in raw_locations]
+        return counts, locations
+
+# De tellers (en hun rebuild-kopieën) zijn geen cache: een cache clear laat ze staan
+register_persistent_prefix(RedisAggregateStore.COUNTS_KEY)
+register_persistent_prefix(RedisAggregateStore.LOCATIONS_KEY)
+register_persistent_prefix(RedisAggregateStore.GENERATION_KEY)
+
+def create_aggregate_store() -> AggregateStore:
+    """Redis als die beschikbaar is, anders in-process"""
+    if redis_available():
+        return RedisAggregateStore()
+    logger.warning("Redis not available, stats aggregates are kept per process")
+    return InMemoryAggregateStore()
+
+class StatsAggregates:
+    """Incrementeel bijgehouden statistieken over calendar_events.
+
+    De tellers worden één keer (lui) uit de database opgebouwd en daarna bij
+    elke gepubliceerde wijziging bijgewerkt, zodat een read niet meer van de
+    tabelgrootte afhangt. Is de oude versie van gewijzigde events onbekend,
+    dan worden de tellers weggegooid en bij de volgende read herbouwd.
+    """
+
+    def __init__(self, store: AggregateStore):
+        self.store = store
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _get_lock(self) -> asyncio.Lock:
+        # Pas binnen de draaiende event loop aanmaken (Python 3.9 bindt locks aan de loop)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        return self._lock
+
+    async def on_change(self, change: event_changes.EventChange):
+        """Listener voor event_changes"""
+        if not change.labels_known:
+            # Zonder oude versie kloppen de deltas niet; bij de volgende read herbouwen
+            await self.store.clear()
+            return
+        counts, locations = change_deltas(change)
+        if counts or locations:
+            await self.store.apply(counts, locations)
+
+    async def rebuild(self, only_if_missing: bool = False) -> Optional[int]:
+        """Tel alles opnieuw vanuit de database; geeft het aantal events terug"""
+        async with self._get_lock():
+            if only_if_missing and await self.store.exists():
+                # Een gelijktijdige read heeft de tellers al opgebouwd
+                return None
+            for attempt in range(REBUILD_ATTEMPTS):
+                generation = await self.store.generation()
+                counts, locations = Counter(), Counter()
+                rows = await db.fetch_all(
+                    lambda: db.table('calendar_events').select(STATS_COLUMNS).order('google_event_id')
+                )
+                for row in rows:
+                    row_counts, row_locations = row_counters(row)
+                    counts.update(row_counts)
+                    locations.update(row_locations)
+                if await self.store.replace(counts, locations, generation):
+                    logger.info(f"Stats aggregates rebuilt from {counts['total']} events")
+                    return counts['total']
+                # Een wijziging tijdens het tellen zit er mogelijk niet in: opnieuw tellen
+                logger.info(f"Stats aggregates changed during rebuild (attempt {attempt + 1})")
+            logger.warning("Stats aggregates not rebuilt: events kept changing during the rebuild")
+            return counts['total']
+
+    async def get_stats(self) -> Dict[str, Any]:
+        """Statistieken in het formaat van CalendarStats"""
+        if not await self.store.exists():
+            await self.rebuild(only_if_missing=True)
+        counts, locations = await self.store.read(top_locations=5)
+
+        per_calendar = {name[4:]: value for name, value in counts.items() if name.startswith('cal:') and value > 0}
+        per_day = [(name[4:], value) for name, value in counts.items() if name.startswith('day:') and value > 0]
+        return {
+            'total_events': counts.get('total', 0),
+            'events_per_calendar': per_calendar,
+            'busy_days': [
+                {"day": day, "count": count}
+                for day, count in sorted(per_day, key=lambda x: x[1], reverse=True)[:3]
+            ],
+            'common_locations': [{"location": loc, "count": cnt} for loc, cnt in locations]
+        }
+
+stats_aggregates = StatsAggregates(create_aggregate_store())
+event_changes.subscribe(stats_aggregates.on_change)
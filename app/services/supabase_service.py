@@ -0,0 +1,53 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Optional
+
+from app.config import supabase, logger, DB_POOL_SIZE, DB_TIMEOUT
+
+# De supabase client is synchroon. Alle queries lopen via deze begrensde thread
+# pool zodat de event loop vrij blijft; de threads delen de httpx connection
+# pool van de PostgREST client, dus verbindingen worden hergebruikt.
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix="supabase")
+# Rijen per request bij fetch_all (PostgREST begrenst een response standaard op 1000)
+FETCH_BATCH_SIZE = 1000
+
+class DatabaseTimeoutError(Exception):
+    """Een Supabase query duurde langer dan de ingestelde timeout"""
+
+def table(name: str):
+    """Start een query op een Supabase tabel"""
+    return supabase.table(name)
+
+async def run_sync(func: Callable[..., Any], *args, timeout: Optional[float] = DB_TIMEOUT, **kwargs) -> Any:
+    """Voer een blokkerende database-functie uit in de database thread pool"""
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_executor, lambda: func(*args, **kwargs))
+    try:
+        return await asyncio.wait_for(future, timeout=timeout)
+    except asyncio.TimeoutError:
+        logger.error(f"Database call {getattr(func, '__name__', func)} timed out after {timeout}s")
+        raise DatabaseTimeoutError(f"Database query timed out after {timeout}s")
+
+async def execute(query, timeout: Optional[float] = DB_TIMEOUT):
+    """Voer een PostgREST query builder uit zonder de event loop te blokkeren"""
+    return await run_sync(query.execute, timeout=timeout)
+
+async def fetch_all(build_query: Callable[[], Any], batch_size: int = FETCH_BATCH_SIZE) -> List[dict]:
+    """Alle rijen van een query, in pagina's van batch_size opgehaald.
+
+    build_query geeft per pagina een nieuwe query builder (die worden bij
+    .range() aangepast). De query moet een unieke volgorde hebben, bijv. op
+    google_event_id, anders kunnen rijen tussen pagina's verschuiven.
+    """
+    rows = []
+    offset = 0
+    while True:
+        batch = (await execute(build_query().range(offset, offset + batch_size - 1))).data
+        rows.extend(batch)
+        if len(batch) < batch_size:
+            return rows
+        offset += batch_size
+
+def shutdown():
+    """Stop de thread pool bij het afsluiten van de app"""
+    _executor.shutdown(wait=False)
@@ -0,0 +1,300 @@
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional
+from zoneinfo import ZoneInfo
+
+from google.oauth2.credentials import Credentials
+
+from app.config import logger, REDIS_SOCKET_TIMEOUT, SYNC_JOB_BACKEND, SYNC_JOB_HISTORY, SYNC_JOB_TTL, SYNC_INTERVAL_SECONDS
+from app.schemas import SyncJob, SyncJobStatus
+from app.services.cache_service import get_redis, redis_available, register_persistent_prefix
+from app.services.calendar_service import sync_calendar
+
+def _now_iso():
+    return datetime.now(ZoneInfo("Europe/Amsterdam")).isoformat()
+
+class JobBackend:
+    """Opslag van sync jobs, de queue en de credentials; implementaties moeten deze methodes leveren"""
+
+    async def save(self, job: SyncJob):
+        raise NotImplementedError
+
+    async def get(self, job_id: str) -> Optional[SyncJob]:
+        raise NotImplementedError
+
+    async def list_recent(self, limit: int = 20) -> List[SyncJob]:
+        raise NotImplementedError
+
+    async def push(self, job_id: str):
+        raise NotImplementedError
+
+    async def pop(self, timeout: float) -> Optional[str]:
+        """Volgende job id uit de queue, of None na timeout seconden"""
+        raise NotImplementedError
+
+    async def queued(self) -> int:
+        raise NotImplementedError
+
+    async def save_credentials(self, credentials: Credentials):
+        raise NotImplementedError
+
+    async def load_credentials(self) -> Optional[Credentials]:
+        raise NotImplementedError
+
+    async def claim_schedule(self, interval_seconds: int) -> bool:
+        """True voor precies één aanvrager per interval"""
+        raise NotImplementedError
+
+class InMemoryJobBackend(JobBackend):
+    """Jobs in het geheugen van dit proces (lokaal / één worker)"""
+
+    def __init__(self, max_jobs: int = SYNC_JOB_HISTORY):
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, SyncJob]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._credentials: Optional[Credentials] = None
+
+    def _get_queue(self) -> asyncio.Queue:
+        # Pas binnen de draaiende event loop aanmaken (Python 3.9 bindt queues aan de loop)
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        return self._queue
+
+    async def save(self, job: SyncJob):
+        self._jobs[job.id] = job
+        self._jobs.move_to_end(job.id)
+        while len(self._jobs) > self.max_jobs:
+            self._jobs.popitem(last=False)
+
+    async def get(self, job_id: str) -> Optional[SyncJob]:
+        return self._jobs.get(job_id)
+
+    async def list_recent(self, limit: int = 20) -> List[SyncJob]:
+        return list(reversed(self._jobs.values()))[:limit]
+
+    async def push(self, job_id: str):
+        await self._get_queue().put(job_id)
+
+    async def pop(self, timeout: float) -> Optional[str]:
+        try:
+            return await asyncio.wait_for(self._get_queue().get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    async def queued(self) -> int:
+        return self._get_queue().qsize()
+
+    async def save_credentials(self, credentials: Credentials):
+        self._credentials = credentials
+
+    async def load_credentials(self) -> Optional[Credentials]:
+        return self._credentials
+
+    async def claim_schedule(self, interval_seconds: int) -> bool:
+        return True
+
+class RedisJobBackend(JobBackend):
+    """Jobs, queue en credentials in Redis, gedeeld door alle workers.
+
+    Elke worker kan een job in de queue (een Redis list) zetten en elke worker
+    haalt er jobs uit; welke worker de login afhandelde maakt niet uit.
+    """
+
+    KEY_PREFIX = "sync:job:"
+    INDEX_KEY = "sync:jobs"
+    QUEUE_KEY = "sync:queue"
+    CREDENTIALS_KEY = "sync:credentials"
+    SCHEDULE_KEY = "sync:schedule"
+
+    def __init__(self, ttl: int = SYNC_JOB_TTL, max_jobs: int = SYNC_JOB_HISTORY):
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+
+    @property
+    def client(self):
+        # Lazy: de gedeelde client wordt pas bij het eerste gebruik aangemaakt
+        return get_redis()
+
+    async def save(self, job: SyncJob):
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.setex(f"{self.KEY_PREFIX}{job.id}", self.ttl, job.model_dump_json())
+            pipe.lrem(self.INDEX_KEY, 0, job.id)
+            pipe.lpush(self.INDEX_KEY, job.id)
+            pipe.ltrim(self.INDEX_KEY, 0, self.max_jobs - 1)
+            await pipe.execute()
+
+    async def get(self, job_id: str) -> Optional[SyncJob]:
+        data = await self.client.get(f"{self.KEY_PREFIX}{job_id}")
+        return SyncJob.model_validate_json(data) if data else None
+
+    async def list_recent(self, limit: int = 20) -> List[SyncJob]:
+        job_ids = [job_id.decode() for job_id in await self.client.lrange(self.INDEX_KEY, 0, limit - 1)]
+        if not job_ids:
+            return []
+        values = await self.client.mget([f"{self.KEY_PREFIX}{job_id}" for job_id in job_ids])
+        return [SyncJob.model_validate_json(value) for value in values if value]
+
+    async def push(self, job_id: str):
+        await self.client.rpush(self.QUEUE_KEY, job_id)
+
+    async def pop(self, timeout: float) -> Optional[str]:
+        # BLPOP houdt de verbinding bezet: ruim binnen de socket timeout blijven
+        item = await self.client.blpop(self.QUEUE_KEY, timeout=min(timeout, REDIS_SOCKET_TIMEOUT / 2))
+        return item[1].decode() if item else None
+
+    async def queued(self) -> int:
+        return await self.client.llen(self.QUEUE_KEY)
+
+    async def save_credentials(self, credentials: Credentials):
+        await self.client.set(self.CREDENTIALS_KEY, credentials.to_json())
+
+    async def load_credentials(self) -> Optional[Credentials]:
+        data = await self.client.get(self.CREDENTIALS_KEY)
+        return Credentials.from_authorized_user_info(json.loads(data)) if data else None
+
+    async def claim_schedule(self, interval_seconds: int) -> bool:
+        # Elke worker draait de scheduler; alleen wie de key zet, plant de resync
+        return bool(await self.client.set(self.SCHEDULE_KEY, 1, nx=True, ex=interval_seconds))
+
+# Een cache clear mag de job-historie, de queue en de credentials niet wissen
+for _key in (
+    RedisJobBackend.KEY_PREFIX, RedisJobBackend.INDEX_KEY, RedisJobBackend.QUEUE_KEY,
+    RedisJobBackend.CREDENTIALS_KEY, RedisJobBackend.SCHEDULE_KEY
+):
+    register_persistent_prefix(_key)
+
+def create_job_backend() -> JobBackend:
+    """Kies de job backend op basis van SYNC_JOB_BACKEND"""
+    if SYNC_JOB_BACKEND == 'redis':
+        if redis_available():
+            return RedisJobBackend()
+        logger.warning("SYNC_JOB_BACKEND=redis but Redis is not available, using in-memory job backend")
+    return InMemoryJobBackend()
+
+class SyncScheduler:
+    """Achtergrond-sync: een queue met een worker per proces plus periodieke resyncs.
+
+    De OAuth callback zet alleen een job in de queue en geeft direct het job id
+    terug; de worker voert `sync_calendar` uit en werkt de voortgang bij in de
+    backend. De laatst bekende credentials worden in de backend bewaard voor
+    handmatige en periodieke syncs. Met de Redis backend delen alle workers de
+    queue en de credentials.
+
+    De worker draait als asyncio-task in het API-proces. Een serverless
+    omgeving die het proces na de response bevriest (Vercel) voert de queue dus
+    niet betrouwbaar uit; daar is een langlopend proces voor nodig.
+    """
+
+    # Zo lang wacht de worker per keer op een job (dan kan stop() hem netjes afbreken)
+    POLL_TIMEOUT = 2
+
+    def __init__(self, backend: JobBackend, interval_seconds: int = SYNC_INTERVAL_SECONDS):
+        self.backend = backend
+        self.interval_seconds = interval_seconds
+        self._tasks: List[asyncio.Task] = []
+        self._active_job_id: Optional[str] = None
+
+    async def enqueue(self, credentials=None, full_sync: bool = False, trigger: str = "manual") -> SyncJob:
+        """Zet een sync job in de queue en geef hem direct terug"""
+        if credentials is not None:
+            await self.backend.save_credentials(credentials)
+        elif await self.backend.load_credentials() is None:
+            raise ValueError("No Google credentials available, log in via /api/auth/login first")
+
+        job = SyncJob(id=uuid.uuid4().hex, trigger=trigger, full_sync=full_sync, created_at=_now_iso())
+        await self.backend.save(job)
+        await self.backend.push(job.id)
+        logger.info(f"Sync job {job.id} queued ({trigger})")
+        return job
+
+    async def get_job(self, job_id: str) -> Optional[SyncJob]:
+        return await self.backend.get(job_id)
+
+    async def list_jobs(self, limit: int = 20) -> List[SyncJob]:
+        return await self.backend.list_recent(limit)
+
+    def start(self):
+        """Start de worker en (indien ingesteld) de periodieke scheduler"""
+        if self._tasks:
+            return
+        self._tasks.append(asyncio.create_task(self._worker()))
+        if self.interval_seconds > 0:
+            self._tasks.append(asyncio.create_task(self._periodic()))
+        logger.info(f"Sync scheduler started (interval: {self.interval_seconds or 'disabled'})")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _worker(self):
+        while True:
+            try:
+                job_id = await self.backend.pop(self.POLL_TIMEOUT)
+            except Exception as e:
+                logger.error(f"Sync worker failed to read the queue: {str(e)}")
+                await asyncio.sleep(self.POLL_TIMEOUT)
+                continue
+            if job_id is None:
+                continue
+            try:
+                await self._run_job(job_id)
+            except Exception as e:
+                logger.error(f"Sync worker error for job {job_id}: {str(e)}")
+
+    async def _run_job(self, job_id: str):
+        job = await self.backend.get(job_id)
+        if job is None:
+            return
+
+        self._active_job_id = job_id
+        started = time.time()
+        job.status = SyncJobStatus.RUNNING
+        job.started_at = _now_iso()
+        await self.backend.save(job)
+
+        async def progress(**fields):
+            for name, value in fields.items():
+                setattr(job, name, value)
+            job.duration_ms = (time.time() - started) * 1000
+            await self.backend.save(job)
+
+        try:
+            credentials = await self.backend.load_credentials()
+            if credentials is None:
+                raise ValueError("No Google credentials available, log in via /api/auth/login first")
+            result = await sync_calendar(credentials, full_sync=job.full_sync, progress=progress)
+            job.status = SyncJobStatus.COMPLETED
+            job.result = result
+            job.events_written = result['writes']['rows_written']
+        except Exception as e:
+            logger.error(f"Sync job {job_id} failed: {str(e)}")
+            job.status = SyncJobStatus.FAILED
+            job.error = str(e)
+        finally:
+            self._active_job_id = None
+            job.finished_at = _now_iso()
+            job.duration_ms = (time.time() - started) * 1000
+            await self.backend.save(job)
+
+    async def _periodic(self):
+        while True:
+            await asyncio.sleep(self.interval_seconds)
+            try:
+                # Geen nieuwe job als er nog een wacht of loopt
+                if self._active_job_id or await self.backend.queued():
+                    continue
+                if await self.backend.load_credentials() is None:
+                    continue
+                if not await self.backend.claim_schedule(self.interval_seconds):
+                    continue
+                await self.enqueue(trigger="schedule")
+            except Exception as e:
+                logger.error(f"Scheduled sync failed to enqueue: {str(e)}")
+
+sync_scheduler = SyncScheduler(create_job_backend())
@@ -0,0 +1,62 @@
+import hashlib
+from datetime import timedelta, timezone
+from typing import Any, Iterable, List, Optional
+
+from app.utils.time_utils import parse_timestamp
+
+# Langere keys worden gehasht (Redis keys en tag-sets blijven zo klein)
+MAX_KEY_LENGTH = 200
+
+def canonical_timestamp(value: Optional[str], round_up: bool = False) -> Optional[str]:
+    """Normaliseer een tijdstip naar één vorm, afgerond op de minuut.
+
+    Tijden met een offset worden naar UTC omgezet; '2024-01-01T10:00:00+01:00',
+    '2024-01-01T09:00Z' en '2024-01-01T09:00:30+00:00' leveren dus dezelfde
+    waarde op. Met round_up wordt naar boven afgerond, zodat een einddatum het
+    gevraagde bereik nooit verkleint. Onleesbare waarden blijven ongewijzigd.
+    """
+    if not value:
+        return None
+    parsed = parse_timestamp(value.strip())
+    if parsed is None:
+        return value
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc)
+    bucket = parsed.replace(second=0, microsecond=0)
+    if round_up and bucket != parsed:
+        bucket += timedelta(minutes=1)
+    return bucket.isoformat()
+
+def canonical_labels(labels: Optional[Iterable[str]]) -> Optional[List[str]]:
+    """Gesorteerde, unieke labels; None als er geen zijn"""
+    if not labels:
+        return None
+    cleaned = sorted({label.strip() for label in labels if label and label.strip()})
+    return cleaned or None
+
+def _key_part(value: Any) -> str:
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, (list, tuple, set)):
+        return ','.join(sorted(str(item) for item in value))
+    return str(value).strip()
+
+def build_cache_key(namespace: str, **params: Any) -> str:
+    """Bouw een canonieke cache key: `<namespace>:<naam>=<waarde>:...`.
+
+    Parameters worden op naam gesorteerd en lege waarden weggelaten, zodat de
+    volgorde van query-parameters niet uitmaakt. Normaliseer datums en labels
+    eerst met canonical_timestamp en canonical_labels (en gebruik diezelfde
+    waarden in de query). Keys langer dan MAX_KEY_LENGTH worden gehasht; het
+    namespace-prefix blijft, zodat invalidate_cache('<namespace>:*') werkt.
+    """
+    parts = [
+        f"{name}={_key_part(value)}"
+        for name, value in sorted(params.items())
+        if value is not None and value != '' and value != []
+    ]
+    key = f"{namespace}:{':'.join(parts)}"
+    if len(key) > MAX_KEY_LENGTH:
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        key = f"{namespace}:#{digest}"
+    return key
@@ -0,0 +1,42 @@
+from typing import List, Optional, Sequence
+
+from app.schemas import Event
+
+# Kolommen van calendar_events die via ?fields= opgevraagd mogen worden.
+# Grote JSON-kolommen (attendees, conference_data) staan hier bewust niet in.
+EVENT_FIELDS = (
+    'google_event_id', 'summary', 'description', 'start_time', 'end_time', 'location',
+    'calendar_name', 'is_recurring', 'category', 'labels', 'status', 'color_id',
+    'visibility', 'updated_at'
+)
+# Standaardprojecties: precies wat de response van het endpoint gebruikt
+EVENT_DEFAULT_FIELDS = tuple(Event.model_fields)
+FILTER_DEFAULT_FIELDS = EVENT_DEFAULT_FIELDS + ('category', 'labels')
+CHANGES_DEFAULT_FIELDS = ('google_event_id', 'updated_at') + FILTER_DEFAULT_FIELDS
+# Keyset-paginatie sorteert en maakt cursors op deze kolommen
+KEYSET_FIELDS = ('start_time', 'google_event_id')
+
+class InvalidFieldsError(ValueError):
+    """Een veld dat niet in EVENT_FIELDS staat"""
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Lees `fields=summary,start_time` in; None als er niets gevraagd is.
+
+    De velden komen terug in de volgorde van EVENT_FIELDS, zodat dezelfde set
+    altijd dezelfde response (en cache key) oplevert.
+    """
+    if not fields:
+        return None
+    requested = {name.strip() for name in fields.split(',') if name.strip()}
+    unknown = requested - set(EVENT_FIELDS)
+    if unknown:
+        raise InvalidFieldsError(f"Unknown fields: {', '.join(sorted(unknown))}")
+    return [name for name in EVENT_FIELDS if name in requested] or None
+
+def select_columns(fields: Sequence[str], required: Sequence[str] = KEYSET_FIELDS) -> str:
+    """Kolommen voor select(): de gevraagde velden plus wat de query zelf nodig heeft"""
+    return ', '.join(dict.fromkeys([*fields, *required]))
+
+def project(row: dict, fields: Sequence[str]) -> dict:
+    """Alleen de gevraagde velden van een rij"""
+    return {name: row.get(name) for name in fields}
@@ -1,6 +1,7 @@
 import datetime
-from datetime import timedelta
+from datetime import timedelta, timezone
 from zoneinfo import ZoneInfo
+from dateutil.parser import isoparse
 
 def convert_time(time_dict):
     if not time_dict:
@@ -26,3 +27,21 @@ def convert_time(time_dict):
     local_dt = dt.astimezone(amsterdam_tz)  # Verwijder +1 uur
 
     return local_dt.strftime('%Y-%m-%d %H:%M:%S%z')
+
+def parse_timestamp(value):
+    """Parse een ISO tijdstring (ook '+0100' offsets of alleen een datum) naar datetime"""
+    if not value:
+        return None
+    try:
+        return isoparse(value)
+    except (ValueError, TypeError):
+        return None
+
+def parse_utc(value):
+    """Zoals parse_timestamp, maar altijd in UTC; tijden zonder offset gelden als UTC (net als in Postgres)"""
+    parsed = parse_timestamp(value)
+    if parsed is None:
+        return None
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
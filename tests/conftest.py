@@ -0,0 +1,16 @@
+import json
+import os
+
+# app.config maakt bij het importeren een Supabase client en leest de Google
+# credentials; de tests praten met geen van beide
+os.environ.setdefault("SUPABASE_URL", "https://example.supabase.co")
+# supabase-py controleert alleen de vorm van de key (een JWT)
+os.environ.setdefault("SUPABASE_KEY", "eyJhbGciOiJIUzI1NiJ9.e30.test")
+os.environ.setdefault("GOOGLE_CREDENTIALS", json.dumps({
+    "web": {
+        "client_id": "test",
+        "client_secret": "test",
+        "auth_uri": "https://accounts.google.com/o/oauth2/auth",
+        "token_uri": "https://oauth2.googleapis.com/token"
+    }
+}))
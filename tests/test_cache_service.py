@@ -0,0 +1,71 @@
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.services import cache_service
+# Registreren bij het importeren hun persistente prefixes
+from app.services import stats_aggregates, sync_jobs  # noqa: F401
+from app.services.cache_service import CacheTTL, get_or_load, invalidate_events
+
+TAGS = ['cal:X', 'month:2024-01', 'cat:*', 'label:*']
+EVENT = {'calendar_name': 'X', 'start_time': '2024-01-05T10:00:00+00:00', 'end_time': '2024-01-05T11:00:00+00:00'}
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    client = fakeredis.FakeAsyncRedis()
+    monkeypatch.setattr(cache_service, "_redis_client", client)
+    monkeypatch.setattr(cache_service, "redis_available", lambda: True)
+    monkeypatch.setattr(cache_service, "get_redis", lambda: client)
+    cache_service._local_cache.clear()
+    cache_service._inflight.clear()
+    return client
+
+def test_invalidated_keys_leave_their_tag_sets(redis_client):
+    async def scenario():
+        await cache_service._set_entry('events:k', [1], None, CacheTTL.MEDIUM, TAGS)
+        await invalidate_events([EVENT])
+        members = set()
+        async for tag_set in redis_client.scan_iter(match='tag:*'):
+            members |= await redis_client.smembers(tag_set)
+        return members, await redis_client.exists('events:k')
+
+    members, exists = asyncio.run(scenario())
+    assert not exists
+    assert b'events:k' not in members
+
+def test_load_that_raced_an_invalidation_is_not_stored(redis_client):
+    async def scenario():
+        started, release = asyncio.Event(), asyncio.Event()
+
+        async def slow_loader():
+            started.set()
+            await release.wait()
+            return 'old'
+
+        async def loader():
+            return 'new'
+
+        pending = asyncio.ensure_future(get_or_load('events:r', slow_loader, CacheTTL.MEDIUM, TAGS))
+        await started.wait()
+        await invalidate_events([EVENT])
+        release.set()
+        await pending
+        return await get_or_load('events:r', loader, CacheTTL.MEDIUM, TAGS)
+
+    assert asyncio.run(scenario()) == ('new', 'MISS')
+
+def test_full_clear_keeps_job_state_and_stats_counters(redis_client):
+    async def scenario():
+        await redis_client.set('sync:job:1', '{}')
+        await redis_client.hset('stats:counts', 'total', 1)
+        await redis_client.set('events:k', 'x')
+        await cache_service.invalidate_cache()
+        return await redis_client.exists('sync:job:1', 'stats:counts', 'events:k')
+
+    assert asyncio.run(scenario()) == 2
+
+def test_query_tags_mixes_dates_with_and_without_offset():
+    tags = cache_service.query_tags(start_date='2025-01-01', end_date='2025-02-01T00:00:00+01:00')
+    assert 'month:2025-01' in tags
@@ -0,0 +1,52 @@
+import asyncio
+
+from app.services import event_changes
+from app.services.conflict_index import ConflictIndex
+from app.services.search_index import SearchIndex
+
+ROWS = [
+    {'google_event_id': f'e{i:02d}', 'summary': f'Overleg {i}', 'calendar_name': 'AB'[i % 2],
+     'start_time': f'2024-03-{1 + i % 5:02d}T{8 + i % 7:02d}:00:00+00:00',
+     'end_time': f'2024-03-{1 + i % 5:02d}T{10 + i % 7:02d}:00:00+00:00'}
+    for i in range(40)
+]
+CHANGE = event_changes.EventChange(
+    [{'google_event_id': 'new', 'summary': 'Nieuw overleg', 'calendar_name': 'C',
+      'start_time': '2024-03-01T09:00:00+00:00', 'end_time': '2024-03-01T11:00:00+00:00'}],
+    [],
+    [{'google_event_id': 'e00'}],
+    True
+)
+
+def build(model):
+    """Bouw via build(); CHANGE komt binnen terwijl de rijen geladen worden"""
+    async def load_rows():
+        await model.on_change(CHANGE)
+        return ROWS
+
+    model._load_rows = load_rows
+    asyncio.run(model.build())
+    return model
+
+def incremental(model):
+    """Zelfde eindstand met losse add()-aanroepen"""
+    model.built_at = 0
+    for row in ROWS:
+        model.add(row)
+    model.apply(CHANGE)
+    return model
+
+def test_conflict_index_build_matches_incremental_updates():
+    built, expected = build(ConflictIndex()), incremental(ConflictIndex())
+
+    assert built._intervals == sorted(built._intervals)
+    assert built._intervals == expected._intervals
+    assert built.conflicts() == expected.conflicts()
+    assert 'e00' not in built._events and 'new' in built._events
+
+def test_search_index_build_matches_incremental_updates():
+    built, expected = build(SearchIndex()), incremental(SearchIndex())
+
+    assert built._vocab == expected._vocab
+    assert built.search('overl') == expected.search('overl')
+    assert len(built) == len(ROWS)
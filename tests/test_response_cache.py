@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from app.services import cache_service
+from app.services.cache_service import CacheTTL, bump_data_versions, changed_tags
+from app.services.response_cache import cached_json_response
+
+KEY = "events:test"
+TAGS = ['cal:X', 'month:2024-01', 'cat:*', 'label:*']
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    client = fakeredis.FakeAsyncRedis()
+    monkeypatch.setattr(cache_service, "_redis_client", client)
+    monkeypatch.setattr(cache_service, "redis_available", lambda: True)
+    monkeypatch.setattr(cache_service, "get_redis", lambda: client)
+    cache_service._local_cache.clear()
+    return client
+
+@pytest.fixture
+def data():
+    return [{"summary": "Dienst"}]
+
+@pytest.fixture
+def client(redis_client, data):
+    app = FastAPI()
+
+    @app.get("/events")
+    async def events(request: Request):
+        async def load():
+            return list(data)
+        return await cached_json_response(request, KEY, load, CacheTTL.MEDIUM, TAGS)
+
+    return TestClient(app)
+
+def test_hit_after_unrelated_bump_returns_current_etag(client):
+    first = client.get("/events")
+    assert first.status_code == 200
+
+    # Andere maand in dezelfde agenda: de entry blijft geldig, de versie van cal:X niet
+    other_month = {'calendar_name': 'X', 'start_time': '2024-03-05T10:00:00+00:00', 'end_time': '2024-03-05T11:00:00+00:00'}
+    asyncio.run(bump_data_versions(changed_tags([other_month])))
+
+    second = client.get("/events", headers={"If-None-Match": first.headers["ETag"]})
+    assert second.status_code == 200
+    assert second.headers["X-Cache-Status"] == "HIT"
+    assert second.headers["ETag"] != first.headers["ETag"]
+
+    third = client.get("/events", headers={"If-None-Match": second.headers["ETag"]})
+    assert third.status_code == 304
+
+def test_invalidation_by_other_worker_is_not_served_from_l1(client, redis_client, data):
+    first = client.get("/events")
+    assert first.json() == [{"summary": "Dienst"}]
+    # L1 staat nog voor deze worker; hij heeft de generatie net gecontroleerd
+    cache_service._generation_checked_at = time.monotonic()
+
+    # Een andere worker wijzigt het event en invalideert alleen Redis
+    data[:] = [{"summary": "Dienst (verplaatst)"}]
+    changed = {'calendar_name': 'X', 'start_time': '2024-01-05T10:00:00+00:00', 'end_time': '2024-01-05T11:00:00+00:00'}
+
+    async def other_worker():
+        await redis_client.unlink(KEY)
+        await redis_client.set(cache_service.GENERATION_KEY, "other-worker")
+        await bump_data_versions(changed_tags([changed]))
+    asyncio.run(other_worker())
+
+    second = client.get("/events", headers={"If-None-Match": first.headers["ETag"]})
+    assert second.status_code == 200
+    assert second.json() == [{"summary": "Dienst (verplaatst)"}]
+    assert second.headers["X-Cache-Status"] == "MISS"
+
+    third = client.get("/events", headers={"If-None-Match": second.headers["ETag"]})
+    assert third.status_code == 304
@@ -0,0 +1,53 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from app.services import cache_service, event_changes
+from app.services import stats_aggregates as stats_module
+from app.services.stats_aggregates import InMemoryAggregateStore, RedisAggregateStore, StatsAggregates
+
+FIRST = {'google_event_id': 'a', 'calendar_name': 'X', 'start_time': '2024-01-05T10:00:00+00:00', 'location': 'Hal'}
+SECOND = {'google_event_id': 'b', 'calendar_name': 'Y', 'start_time': '2024-01-06T10:00:00+00:00', 'location': 'Hal'}
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    client = fakeredis.FakeAsyncRedis()
+    monkeypatch.setattr(cache_service, "get_redis", lambda: client)
+    monkeypatch.setattr(stats_module, "get_redis", lambda: client)
+    return client
+
+def test_delta_from_another_worker_during_rebuild_is_not_lost(redis_client, monkeypatch):
+    # Twee workers met elk hun eigen StatsAggregates, maar dezelfde Redis-tellers
+    worker_a, worker_b = StatsAggregates(RedisAggregateStore()), StatsAggregates(RedisAggregateStore())
+    table = [FIRST]
+
+    async def execute(query):
+        snapshot = list(table)
+        if len(table) == 1:
+            # Worker B schrijft een event terwijl A nog telt; A's snapshot mist het
+            table.append(SECOND)
+            await worker_b.on_change(event_changes.EventChange([SECOND], [], [], True))
+        return SimpleNamespace(data=snapshot)
+
+    monkeypatch.setattr(stats_module.db, "execute", execute)
+    total = asyncio.run(worker_a.rebuild())
+    stats = asyncio.run(worker_a.get_stats())
+
+    assert total == 2
+    assert stats['total_events'] == 2
+    assert stats['events_per_calendar'] == {'X': 1, 'Y': 1}
+
+def test_in_memory_counters_expire_after_max_age(monkeypatch):
+    async def execute(query):
+        return SimpleNamespace(data=[FIRST])
+
+    monkeypatch.setattr(stats_module.db, "execute", execute)
+    store = InMemoryAggregateStore(max_age=60)
+    asyncio.run(StatsAggregates(store).rebuild())
+    assert asyncio.run(store.exists())
+
+    store.built_at -= 61
+    assert not asyncio.run(store.exists())
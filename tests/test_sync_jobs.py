@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from google.oauth2.credentials import Credentials
+
+from app.schemas import SyncJobStatus
+from app.services import sync_jobs
+from app.services.sync_jobs import RedisJobBackend, SyncScheduler
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    client = fakeredis.FakeAsyncRedis()
+    monkeypatch.setattr(sync_jobs, "get_redis", lambda: client)
+    return client
+
+def make_credentials():
+    return Credentials(
+        token='access', refresh_token='refresh', client_id='client', client_secret='secret',
+        token_uri='https://oauth2.googleapis.com/token'
+    )
+
+def test_job_queued_on_one_worker_runs_on_another(redis_client, monkeypatch):
+    used = []
+
+    async def sync_calendar(credentials, full_sync=False, progress=None):
+        used.append(credentials.refresh_token)
+        return {'writes': {'rows_written': 3}}
+
+    monkeypatch.setattr(sync_jobs, "sync_calendar", sync_calendar)
+    # Twee workers met elk hun eigen scheduler, maar dezelfde Redis
+    login_worker, other_worker = SyncScheduler(RedisJobBackend()), SyncScheduler(RedisJobBackend())
+
+    async def scenario():
+        await login_worker.enqueue(make_credentials(), trigger="oauth")
+        # De andere worker kent de credentials ook en kan zelf een job starten
+        manual = await other_worker.enqueue(full_sync=True)
+        job_ids = [await other_worker.backend.pop(1), await other_worker.backend.pop(1)]
+        for job_id in job_ids:
+            await other_worker._run_job(job_id)
+        return manual, job_ids, await other_worker.get_job(manual.id)
+
+    manual, job_ids, finished = asyncio.run(scenario())
+
+    assert job_ids[1] == manual.id
+    assert used == ['refresh', 'refresh']
+    assert finished.status == SyncJobStatus.COMPLETED
+    assert finished.events_written == 3
+
+def test_enqueue_without_credentials_is_rejected(redis_client):
+    with pytest.raises(ValueError):
+        asyncio.run(SyncScheduler(RedisJobBackend()).enqueue())